@@ -0,0 +1,11 @@
+"""
+Benchmarks and load tests of the traffic shadowing Lambda function.
+"""
+import os
+
+# The handler reads its configuration at import time
+os.environ.setdefault('S3_DATA_CAPTURE_BUCKET', 'benchmark-capture')
+os.environ.setdefault('S3_DATA_CAPTURE_PREFIX', 'datacapture')
+os.environ.setdefault('S3_DATA_TRAINING_BUCKET', 'benchmark-training')
+os.environ.setdefault('S3_DATA_TRAINING_PREFIX', 'training')
+os.environ.setdefault('HYDROSPHERE_ENDPOINT', 'http://localhost:9090')
@@ -0,0 +1,166 @@
+"""
+This module provides in-process stand-ins for the services used by the
+Lambda function, so that benchmarks measure only the function's own work.
+"""
+import io
+import re
+import json
+import gzip
+import datetime
+from typing import Dict, List, Tuple, Union
+import boto3
+import botocore
+from botocore.response import StreamingBody
+from src.clients import AWSClientFactory
+from src.model import Model
+from src.model_pool import ModelPool
+from src.sinks import NullSink
+
+
+SELECT_FIELD = re.compile(r's\.([\w.]+)\s+AS\s+"(\w+)"', re.I)
+
+
+def _select_fields(expression: str) -> List[Tuple[List[str], str]]:
+    """Parse `SELECT s.a.b AS "alias", ... FROM S3Object s` projections."""
+    fields = [(path.split('.'), alias) for path, alias in SELECT_FIELD.findall(expression)]
+    if not fields or not re.search(r'FROM\s+S3Object\s+s\s*$', expression, re.I):
+        raise botocore.exceptions.ClientError(
+            {'Error': {'Code': 'ParseUnsupportedSyntax', 'Message': expression}},
+            'SelectObjectContent',
+        )
+    return fields
+
+
+class FakeS3Client:
+    """In-memory subset of the S3 client API used by the function."""
+    def __init__(self) -> 'FakeS3Client':
+        self.objects: Dict[Tuple[str, str], bytes] = {}
+        self._selected: Dict[Tuple[str, str, str, str], List[bytes]] = {}
+
+    @staticmethod
+    def _metadata(status: int = 200) -> dict:
+        return {'ResponseMetadata': {'HTTPStatusCode': status}}
+
+    @staticmethod
+    def _not_found(operation: str) -> botocore.exceptions.ClientError:
+        return botocore.exceptions.ClientError(
+            {'Error': {'Code': '404', 'Message': 'Not Found'},
+             'ResponseMetadata': {'HTTPStatusCode': 404}},
+            operation,
+        )
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes = b'', **kwargs) -> dict:
+        # pylint: disable=invalid-name,unused-argument,missing-function-docstring
+        self.objects[(Bucket, Key)] = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        self._selected = {}
+        return self._metadata()
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        # pylint: disable=invalid-name,unused-argument,missing-function-docstring
+        try:
+            body = self.objects[(Bucket, Key)]
+        except KeyError:
+            raise self._not_found('GetObject') from None
+        response = self._metadata()
+        response.update({
+            'Body': StreamingBody(io.BytesIO(body), len(body)),
+            'ContentLength': len(body),
+        })
+        return response
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        # pylint: disable=invalid-name,unused-argument,missing-function-docstring
+        if (Bucket, Key) not in self.objects:
+            raise self._not_found('HeadObject')
+        response = self._metadata()
+        response['ContentLength'] = len(self.objects[(Bucket, Key)])
+        return response
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        # pylint: disable=invalid-name,unused-argument,missing-function-docstring
+        self.objects.pop((Bucket, Key), None)
+        self._selected = {}
+        return self._metadata(204)
+
+    def select_object_content(
+            self,
+            Bucket: str,
+            Key: str,
+            Expression: str,
+            InputSerialization: Dict,
+            **kwargs,
+    ) -> dict:
+        """
+        Evaluate projections of JSON Lines objects, as used by the function,
+        and return the result as an event stream of a couple of chunks.
+        Results are cached, since the projection is the work of S3.
+        """
+        # pylint: disable=invalid-name,unused-argument
+        compression = InputSerialization.get('CompressionType', 'NONE')
+        cache_key = (Bucket, Key, Expression, compression)
+        if cache_key not in self._selected:
+            self._selected[cache_key] = self._select(Bucket, Key, Expression, compression)
+        chunks = self._selected[cache_key]
+        response = self._metadata()
+        response['Payload'] = [{'Records': {'Payload': chunk}} for chunk in chunks] + [
+            {'Stats': {'Details': {'BytesReturned': sum(len(chunk) for chunk in chunks)}}},
+            {'End': {}},
+        ]
+        return response
+
+    def _select(self, bucket: str, key: str, expression: str, compression: str) -> List[bytes]:
+        fields = _select_fields(expression)
+        body = self.get_object(bucket, key)['Body'].read()
+        if compression == 'GZIP':
+            body = gzip.decompress(body)
+        records = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            document, record = json.loads(line), {}
+            for path, alias in fields:
+                value = document
+                for name in path:
+                    value = value.get(name) if isinstance(value, dict) else None
+                if value is not None:
+                    record[alias] = value
+            records.append(json.dumps(record).encode() + b'\n')
+        payload = b''.join(records)
+        middle = len(payload) // 2
+        return [payload[:middle], payload[middle:]]
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', **kwargs) -> dict:
+        # pylint: disable=invalid-name,unused-argument,missing-function-docstring
+        contents = [
+            {'Key': key, 'Size': len(body), 'LastModified': datetime.datetime.utcnow()}
+            for (bucket, key), body in sorted(self.objects.items())
+            if bucket == Bucket and key.startswith(Prefix)
+        ]
+        response = self._metadata()
+        response.update({'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False})
+        return response
+
+
+def install_s3_client(
+        client: FakeS3Client,
+        session: Union[boto3.Session, botocore.session.Session, None] = None,
+) -> Union[boto3.Session, botocore.session.Session]:
+    """Make `AWSClientFactory` hand out the fake client for the session."""
+    session = session or boto3.Session()
+    setattr(AWSClientFactory, str(id(session)), {'s3': client})
+    return session
+
+
+class LocalModelPool(ModelPool):
+    """
+    Model pool, which never talks to the Hydrosphere API and hands out
+    models sending their messages to a shared null sink.
+    """
+    null_sink = NullSink()
+
+    def make_model(self, name, version, model_version_id) -> Model:
+        return Model(name, version, model_version_id, spool=self.spool, sink=self.null_sink)
+
+    def get_or_create_model(self, name, schema, training_file, metadata=None,
+                            check_contract=False) -> Model:
+        return self.make_model(name, 1, 1)
@@ -0,0 +1,111 @@
+"""
+This module generates synthetic SageMaker capture data for benchmarks.
+"""
+import json
+import random
+import string
+import uuid
+import datetime
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Iterator, List
+
+DTYPES = ('int', 'float', 'string', 'bool')
+
+
+def parse_dtypes_mix(value: str) -> Dict[str, float]:
+    """Parse a dtypes mix, e.g. "int:0.5,float:0.4,string:0.1"."""
+    mix = {}
+    for item in filter(None, value.split(',')):
+        name, _, weight = item.partition(':')
+        if name not in DTYPES:
+            raise ValueError(f"Unknown dtype {name}, expected one of {DTYPES}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+@dataclass
+class CaptureSpec:
+    """Shape of a synthetic capture file."""
+    rows: int = 1000
+    columns: int = 20
+    outputs: int = 1
+    dtypes: Dict[str, float] = field(default_factory=lambda: {'int': 0.5, 'float': 0.5})
+    string_width: int = 8
+    float_digits: int = 0   # significant digits of floats, 0 for full precision
+    seed: int = 42
+
+    def to_dict(self) -> dict:
+        # pylint: disable=missing-function-docstring
+        return asdict(self)
+
+    def column_dtypes(self) -> List[str]:
+        """Assign a dtype to every input column according to the mix."""
+        rng = random.Random(self.seed)
+        names, weights = zip(*self.dtypes.items())
+        return rng.choices(names, weights=weights, k=self.columns)
+
+
+class CaptureGenerator:
+    """Generates capture lines and a matching training file."""
+    def __init__(self, spec: CaptureSpec) -> 'CaptureGenerator':
+        self.spec = spec
+        self.input_dtypes = spec.column_dtypes()
+        self._rng = random.Random(spec.seed)
+        self._start = datetime.datetime(2020, 3, 11, 12, 45, 15)
+
+    def _cell(self, dtype: str) -> str:
+        rng = self._rng
+        if dtype == 'int':
+            return str(rng.randint(0, 100000))
+        if dtype == 'float':
+            value = rng.uniform(-1000, 1000)
+            return f"{value:.{self.spec.float_digits}g}" if self.spec.float_digits else repr(value)
+        if dtype == 'bool':
+            return rng.choice(('True', 'False'))
+        return ''.join(rng.choices(string.ascii_letters, k=self.spec.string_width))
+
+    def _row(self, dtypes: List[str]) -> str:
+        return ','.join(self._cell(dtype) for dtype in dtypes)
+
+    def header(self) -> List[str]:
+        """Column names of the training file, outputs go first."""
+        return [f"target_{i}" for i in range(self.spec.outputs)] + \
+            [f"feature_{i}" for i in range(self.spec.columns)]
+
+    def training_file(self, rows: int = 10) -> bytes:
+        """Generate a training CSV file with a header."""
+        lines = [','.join(self.header())]
+        for _ in range(rows):
+            outputs = self._row(['float'] * self.spec.outputs)
+            lines.append(outputs + ',' + self._row(self.input_dtypes))
+        return ('\n'.join(lines) + '\n').encode()
+
+    def lines(self) -> Iterator[bytes]:
+        """Generate capture lines in SageMaker data capture format."""
+        for i in range(self.spec.rows):
+            inference_time = self._start + datetime.timedelta(milliseconds=i)
+            yield json.dumps({
+                "captureData": {
+                    "endpointInput": {
+                        "observedContentType": "text/csv",
+                        "mode": "INPUT",
+                        "data": self._row(self.input_dtypes),
+                        "encoding": "CSV"
+                    },
+                    "endpointOutput": {
+                        "observedContentType": "text/csv; charset=utf-8",
+                        "mode": "OUTPUT",
+                        "data": self._row(['float'] * self.spec.outputs),
+                        "encoding": "CSV"
+                    }
+                },
+                "eventMetadata": {
+                    "eventId": str(uuid.UUID(int=self._rng.getrandbits(128), version=4)),
+                    "inferenceTime": inference_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                },
+                "eventVersion": "0"
+            }, separators=(',', ':')).encode()
+
+    def capture_file(self) -> bytes:
+        """Generate a whole capture file."""
+        return b'\n'.join(self.lines()) + b'\n'
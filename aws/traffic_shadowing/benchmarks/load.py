@@ -0,0 +1,197 @@
+"""
+Offline end-to-end load test of the Lambda handler.
+
+Capture and training files are served from an in-memory S3, Hydrosphere is
+replaced with a local gRPC MonitoringService server and a fake REST API.
+Synthetic S3 events are fired at the handler from a pool of workers, one
+pool size per concurrency setting:
+
+    python -m benchmarks.load --concurrency 1 4 8 --latency-ms 5 --error-rate 0.01
+
+For every setting, end-to-end rows/sec, p50/p95/p99 per-row latency and
+the rates at which the MonitoringService received messages are reported.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Union
+from unittest import mock
+from src.model import Model
+from benchmarks.generators import CaptureSpec, CaptureGenerator, parse_dtypes_mix
+from benchmarks.fakes import FakeS3Client, install_s3_client
+from benchmarks.servers import (
+    MonitoringServicer, MonitoringServer, HydrosphereApiServer
+)
+
+SPOOL_BUCKET = 'benchmark-spool'
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of the values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class LoadTest:
+    """Fires synthetic S3 events at the handler and collects statistics."""
+    def __init__(
+            self,
+            spec: CaptureSpec,
+            servicer: MonitoringServicer,
+            files_per_worker: int = 2,
+            models: int = 1,
+    ) -> 'LoadTest':
+        from src import handler  # pylint: disable=import-outside-toplevel
+        self.handler = handler
+        self.spec = spec
+        self.servicer = servicer
+        self.files_per_worker = files_per_worker
+        self.s3_client = FakeS3Client()
+        self.session = install_s3_client(self.s3_client)
+        self.model_names = [f"load-model-{i}" for i in range(models)]
+        self._runs = 0
+
+        generator = CaptureGenerator(spec)
+        self.capture = generator.capture_file()
+        for name in self.model_names:
+            self.s3_client.put_object(
+                Bucket=handler.S3_DATA_TRAINING_BUCKET,
+                Key=f"{handler.S3_DATA_TRAINING_PREFIX}/{name}/train.csv",
+                Body=generator.training_file(),
+            )
+
+    def _make_events(self, count: int) -> List[Dict]:
+        """Upload capture files and build S3 events referencing them."""
+        events = []
+        for i in range(count):
+            self._runs += 1
+            name = self.model_names[i % len(self.model_names)]
+            key = f"{self.handler.S3_DATA_CAPTURE_PREFIX}/{name}/run-{self._runs}.jsonl"
+            self.s3_client.put_object(
+                Bucket=self.handler.S3_DATA_CAPTURE_BUCKET, Key=key, Body=self.capture)
+            events.append({'Records': [{'s3': {
+                'bucket': {'name': self.handler.S3_DATA_CAPTURE_BUCKET},
+                'object': {'key': key, 'eTag': '', 'sequencer': str(self._runs)},
+            }}]})
+        return events
+
+    def run(self, concurrency: int) -> Dict:
+        """Run the load with the given number of concurrent invocations."""
+        events = self._make_events(concurrency * self.files_per_worker)
+        latencies = []
+        analyse = Model.analyse
+
+        def timed_analyse(model, request):
+            start = time.perf_counter()
+            try:
+                return analyse(model, request)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        def invoke(event):
+            try:
+                body = json.loads(self.handler.lambda_handler(event, None, self.session)['body'])
+                return body['detail'], body['spooled'], None
+            except Exception as error:  # pylint: disable=broad-except
+                return 0, 0, error
+
+        self.servicer.reset()
+        with mock.patch.object(Model, 'analyse', timed_analyse), \
+                contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                outcomes = list(executor.map(invoke, events))
+            elapsed = time.perf_counter() - start
+
+        rows = sum(outcome[0] for outcome in outcomes)
+        return {
+            'concurrency': concurrency,
+            'invocations': len(events),
+            'failed_invocations': sum(1 for outcome in outcomes if outcome[2] is not None),
+            'rows': rows,
+            'spooled': sum(outcome[1] for outcome in outcomes),
+            'seconds': elapsed,
+            'rows_per_sec': rows / elapsed if elapsed else 0.0,
+            'latency_ms': {
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+            },
+            'server': self.servicer.receive_rates(),
+        }
+
+
+def run_load(
+        spec: CaptureSpec,
+        concurrency: List[int],
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        max_rps: Union[float, None] = None,
+        files_per_worker: int = 2,
+        models: int = 1,
+) -> List[Dict]:
+    """Start the local services and run the load for every concurrency setting."""
+    servicer = MonitoringServicer(latency, error_rate, max_rps, spec.seed)
+    with MonitoringServer(servicer, workers=max(concurrency) * 2) as grpc_server, \
+            HydrosphereApiServer() as api_server, \
+            mock.patch.dict(os.environ, {'HYDROSPHERE_ENDPOINT': grpc_server.endpoint}):
+        load = LoadTest(spec, servicer, files_per_worker, models)
+        with mock.patch.object(load.handler, 'HYDROSPHERE_ENDPOINT', api_server.endpoint), \
+                mock.patch.object(load.handler, 'S3_SPOOL_BUCKET', SPOOL_BUCKET):
+            return [load.run(setting) for setting in concurrency]
+
+
+def parse_args(argv: Union[List[str], None] = None) -> argparse.Namespace:
+    # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--files-per-worker', type=int, default=2)
+    parser.add_argument('--models', type=int, default=1)
+    parser.add_argument('--rows', type=int, default=200)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--dtypes', type=parse_dtypes_mix, default='int:0.5,float:0.5')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='Latency added to every Analyze call')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of Analyze calls failing with UNAVAILABLE')
+    parser.add_argument('--max-rps', type=float, default=None,
+                        help='Maximum number of Analyze calls served per second')
+    parser.add_argument('--output', help='Write results to this file')
+    return parser.parse_args(argv)
+
+
+def main(argv: Union[List[str], None] = None) -> int:
+    # pylint: disable=missing-function-docstring
+    args = parse_args(argv)
+    spec = CaptureSpec(rows=args.rows, columns=args.columns, dtypes=args.dtypes, seed=args.seed)
+    report = {
+        'spec': spec.to_dict(),
+        'server': {
+            'latency_ms': args.latency_ms,
+            'error_rate': args.error_rate,
+            'max_rps': args.max_rps,
+        },
+        'results': run_load(
+            spec, args.concurrency, args.latency_ms / 1000, args.error_rate,
+            args.max_rps, args.files_per_worker, args.models,
+        ),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
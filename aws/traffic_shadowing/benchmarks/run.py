@@ -0,0 +1,346 @@
+"""
+Benchmarks of the traffic shadowing hot path.
+
+Every stage is timed on synthetic capture data: contract inference, request
+parsing, tensor building, composing ExecutionInformation messages and the
+whole Lambda handler loop over an in-memory S3, reading capture files
+either whole or through S3 Select projections. When pyarrow is installed,
+writing parsed requests to a Parquet export is timed too, and its size is
+reported next to the size of the capture file. Writing composed messages
+to a file sink archive is timed as well; the handler loop itself sends them
+to a null sink, alone or together with two mirror clusters. The cost of the metrics
+instrumentation and the logging calls made for every row is measured as
+well, and the run fails if either exceeds the allowed share of the per-row
+cost. Logging is configured by LOG_LEVEL, as in the function. Results are printed
+as JSON and can be compared against a stored baseline:
+
+    python -m benchmarks.run --rows 1000 --columns 20 --output baseline.json
+    python -m benchmarks.run --rows 1000 --columns 20 --compare baseline.json
+
+The comparison exits with a non-zero code if any stage got slower or used
+more memory than the tolerance allows.
+"""
+import io
+import sys
+import importlib.util
+import json
+import time
+import argparse
+import itertools
+import contextlib
+import platform
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Union
+from unittest import mock
+from src.data import Record, Contract, Request
+from src.model import Model, rows_logger
+from src import export
+from src import metrics
+from src import log
+from src import sinks
+from benchmarks.generators import CaptureSpec, CaptureGenerator, parse_dtypes_mix
+from benchmarks.fakes import FakeS3Client, LocalModelPool, install_s3_client
+
+MODEL_NAME = 'benchmark-model'
+CONTRACT_ITERATIONS = 100
+INSTRUMENTATION_ITERATIONS = 10000
+METRICS = (
+    ('rows_per_sec', 1),
+    ('bytes_per_sec', 1),
+    ('peak_memory_bytes', -1),
+    ('message_bytes', -1),
+)
+# Sequencers of S3 events, shared by all handler loops of a run
+SEQUENCERS = itertools.count()
+
+
+class InMemoryRecord(Record):
+    """Record backed by a byte string instead of an S3 object."""
+    def __init__(self, body: bytes) -> 'InMemoryRecord':
+        # pylint: disable=super-init-not-called
+        self.bucket, self.key = 'memory', 'memory'
+        self.body = body
+
+    def read(self) -> Iterator[bytes]:
+        return iter(self.body.splitlines())
+
+
+def measure(func: Callable[[], None], rows: int, size: int, repeat: int) -> Dict:
+    """
+    Time the function, taking the best of several runs, then run it once
+    more under tracemalloc to find the peak memory usage.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    best = min(timings)
+    return {
+        'rows': rows,
+        'bytes': size,
+        'seconds': best,
+        'rows_per_sec': rows / best if best else 0.0,
+        'bytes_per_sec': size / best if best else 0.0,
+        'peak_memory_bytes': peak,
+    }
+
+
+def run_benchmarks(spec: CaptureSpec, repeat: int = 3, only: Union[List[str], None] = None) -> Dict:
+    """Run all benchmarks for the given capture shape."""
+    generator = CaptureGenerator(spec)
+    capture = generator.capture_file()
+    training = generator.training_file()
+    lines = capture.splitlines()
+    s3_client = FakeS3Client()
+    session = install_s3_client(s3_client)
+    log.configure()
+    contract = Contract(InMemoryRecord(capture), InMemoryRecord(training), session)
+    narrow_contract = Contract(InMemoryRecord(capture), InMemoryRecord(training), session, narrow=True)
+    packed_contract = Contract(InMemoryRecord(capture), InMemoryRecord(training), session, pack=True)
+    documents = [json.loads(line) for line in lines]
+    requests = [Request.from_dict(document, contract.schema) for document in documents]
+    narrow_requests = [Request.from_dict(document, narrow_contract.schema) for document in documents]
+    packed_requests = [Request.from_dict(document, packed_contract.schema) for document in documents]
+    model = Model(MODEL_NAME, 1, 1)
+    row_size = len(capture) // max(1, len(lines))
+
+    def contract_inference():
+        for _ in range(CONTRACT_ITERATIONS):
+            Contract(InMemoryRecord(lines[0]), InMemoryRecord(training), session)
+
+    def request_from_dict():
+        for document in documents:
+            Request.from_dict(document, contract.schema)
+
+    def build_tensors():
+        for request in requests:
+            request.build_input_tensors()
+            request.build_output_tensors()
+
+    def compose_message():
+        for request in requests:
+            model.compose_execution_information_proto(request)
+
+    def compose_narrow_message():
+        for request in narrow_requests:
+            model.compose_execution_information_proto(request)
+
+    def compose_packed_message():
+        for request in packed_requests:
+            model.compose_execution_information_proto(request)
+
+    composed = [model.compose_execution_information_proto(request) for request in requests]
+    archive_sizes = []
+
+    def file_sink():
+        sink = sinks.FileSink('s3://archive/sink', session=session)
+        for message in composed:
+            sink.send(message)
+        keys = [location.split('/', 3)[3] for location in sink.flush()]
+        archive_sizes.append(sum(len(s3_client.objects[('archive', key)]) for key in keys))
+
+    export_sizes = []
+
+    def export_parquet():
+        exporter = export.Exporter(contract.schema, export.PARQUET)
+        for request in requests:
+            exporter.add(request)
+        key = exporter.upload('export', '', MODEL_NAME, 'capture.jsonl', session)
+        export_sizes.append(len(s3_client.objects[('export', key)]))
+
+    def instrumentation():
+        # Mirrors the metrics calls made for every shadowed row
+        for _ in range(INSTRUMENTATION_ITERATIONS):
+            collector = metrics.current()
+            with collector.timer('Parse'):
+                pass
+            with collector.timer('TensorBuild'):
+                pass
+            with collector.timer('Analyze', histogram=True):
+                pass
+
+    def logging_calls():
+        # Mirrors the logging calls made for every shadowed row
+        for j in range(INSTRUMENTATION_ITERATIONS):
+            if rows_logger.enabled:
+                rows_logger.debug("Reading %d request", j)
+            if rows_logger.enabled:
+                rows_logger.debug("Analysing a request of %s model", MODEL_NAME)
+
+    benchmarks = {
+        'contract_inference': (contract_inference, CONTRACT_ITERATIONS, CONTRACT_ITERATIONS * row_size),
+        'request_from_dict': (request_from_dict, len(lines), len(capture)),
+        'build_tensors': (build_tensors, len(lines), len(capture)),
+        'compose_message': (compose_message, len(lines), len(capture)),
+        'compose_narrow_message': (compose_narrow_message, len(lines), len(capture)),
+        'compose_packed_message': (compose_packed_message, len(lines), len(capture)),
+        'handler': (_handler_loop(capture, training), len(lines), len(capture)),
+        'handler_select': (_handler_loop(capture, training, select=True), len(lines), len(capture)),
+        'handler_summary': (_handler_loop(capture, training, summarize=True), len(lines), len(capture)),
+        'handler_fanout': (_handler_loop(capture, training, mirrors=2), len(lines), len(capture)),
+        'export_parquet': (export_parquet, len(lines), len(capture)),
+        'file_sink': (file_sink, len(lines), len(capture)),
+        'instrumentation': (instrumentation, INSTRUMENTATION_ITERATIONS, 0),
+        'logging': (logging_calls, INSTRUMENTATION_ITERATIONS, 0),
+    }
+    if importlib.util.find_spec('pyarrow') is None:
+        del benchmarks['export_parquet']
+    results = {
+        name: measure(func, rows, size, repeat)
+        for name, (func, rows, size) in benchmarks.items()
+        if not only or name in only
+    }
+    if 'export_parquet' in results:
+        results['export_parquet']['export_bytes'] = export_sizes[-1]
+        results['export_parquet']['export_ratio'] = len(capture) / export_sizes[-1]
+    if 'file_sink' in results:
+        results['file_sink']['archive_bytes'] = archive_sizes[-1]
+    for name, messages in (
+            ('compose_message', requests),
+            ('compose_narrow_message', narrow_requests),
+            ('compose_packed_message', packed_requests),
+    ):
+        if name in results:
+            results[name]['message_bytes'] = sum(
+                model.compose_execution_information_proto(request).ByteSize()
+                for request in messages
+            ) / max(1, len(messages))
+    for name in ('instrumentation', 'logging'):
+        if 'handler' in results and name in results:
+            results[name]['overhead_ratio'] = \
+                results['handler']['rows_per_sec'] / results[name]['rows_per_sec']
+    return results
+
+
+def _handler_loop(
+        capture: bytes,
+        training: bytes,
+        select: bool = False,
+        summarize: bool = False,
+        mirrors: int = 0,
+) -> Callable[[], None]:
+    """
+    Prepare a run of the Lambda handler over a capture file stored in an
+    in-memory S3, with Hydrosphere replaced by a null sink. With `select`,
+    capture files are read through S3 Select projections. With `summarize`,
+    files are summarized instead of shadowing every row. With `mirrors`,
+    rows are sent to that many mirror clusters besides the primary one.
+    """
+    from src import handler  # pylint: disable=import-outside-toplevel
+
+    s3_client = FakeS3Client()
+    session = install_s3_client(s3_client)
+    capture_key = f"{handler.S3_DATA_CAPTURE_PREFIX}/{MODEL_NAME}/capture.jsonl"
+    training_key = f"{handler.S3_DATA_TRAINING_PREFIX}/{MODEL_NAME}/train.csv"
+    s3_client.put_object(Bucket=handler.S3_DATA_CAPTURE_BUCKET, Key=capture_key, Body=capture)
+    s3_client.put_object(Bucket=handler.S3_DATA_TRAINING_BUCKET, Key=training_key, Body=training)
+    def handler_loop():
+        # A new sequencer per run keeps the deduplication from skipping the file
+        event = {'Records': [{'s3': {
+            'bucket': {'name': handler.S3_DATA_CAPTURE_BUCKET},
+            'object': {'key': capture_key, 'eTag': '', 'sequencer': str(next(SEQUENCERS))},
+        }}]}
+        with mock.patch.object(handler, 'ModelPool', LocalModelPool), \
+                mock.patch.object(handler, 'S3_SELECT', select), \
+                mock.patch.object(handler, 'SHADOWING_MODE',
+                                  {'*': 'summary' if summarize else 'rows'}), \
+                mock.patch.object(handler, 'MIRROR_ENDPOINTS',
+                                  [f"http://mirror-{i}:9090" for i in range(mirrors)]), \
+                contextlib.redirect_stdout(io.StringIO()):
+            handler.lambda_handler(event, None, session)
+
+    return handler_loop
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.1) -> List[str]:
+    """
+    Compare results against a baseline. Return descriptions of metrics,
+    which regressed by more than the tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        for metric, direction in METRICS:
+            old, new = reference.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * direction
+            if change < -tolerance:
+                regressions.append(
+                    f"{name}.{metric}: {old:.6g} -> {new:.6g} ({abs(change):.1%} worse)")
+    return regressions
+
+
+def parse_args(argv: Union[List[str], None] = None) -> argparse.Namespace:
+    # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--outputs', type=int, default=1)
+    parser.add_argument('--dtypes', type=parse_dtypes_mix, default='int:0.5,float:0.5',
+                        help='Mix of input column types, e.g. "int:0.5,float:0.4,bool:0.1"')
+    parser.add_argument('--string-width', type=int, default=8)
+    parser.add_argument('--float-digits', type=int, default=0,
+                        help='Significant digits of generated floats, 0 for full precision')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help='Names of the benchmarks to run')
+    parser.add_argument('--output', help='Write results to this file')
+    parser.add_argument('--compare', help='Baseline results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative degradation before reporting a regression')
+    parser.add_argument('--max-overhead', type=float, default=0.01,
+                        help='Allowed share of metrics instrumentation or logging in the per-row cost')
+    return parser.parse_args(argv)
+
+
+def main(argv: Union[List[str], None] = None) -> int:
+    # pylint: disable=missing-function-docstring
+    args = parse_args(argv)
+    spec = CaptureSpec(
+        rows=args.rows, columns=args.columns, outputs=args.outputs,
+        dtypes=args.dtypes, string_width=args.string_width,
+        float_digits=args.float_digits, seed=args.seed,
+    )
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'spec': spec.to_dict(),
+        'results': run_benchmarks(spec, args.repeat, args.only),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+
+    for name, title in (('instrumentation', 'Metrics instrumentation'), ('logging', 'Logging')):
+        overhead = report['results'].get(name, {}).get('overhead_ratio')
+        if overhead is not None and overhead > args.max_overhead:
+            print(f"{title} takes {overhead:.2%} of the per-row cost", file=sys.stderr)
+            return 1
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get('spec') != report['spec']:
+            print("Warning: baseline was recorded for a different capture shape", file=sys.stderr)
+        regressions = compare(report['results'], baseline.get('results', {}), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
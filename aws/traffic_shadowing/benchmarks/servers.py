@@ -0,0 +1,204 @@
+"""
+This module provides local stand-ins for the Hydrosphere services: a gRPC
+MonitoringService server and a REST API covering model lookup, external
+model registration and training data profiling.
+"""
+import re
+import json
+import time
+import random
+import threading
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Union
+import grpc
+from google.protobuf.empty_pb2 import Empty
+from hydro_serving_grpc.monitoring.api_pb2_grpc import (
+    MonitoringServiceServicer, add_MonitoringServiceServicer_to_server
+)
+
+
+class TokenBucket:
+    """Limits the rate of events, blocking callers until a token is available."""
+    def __init__(self, rate: float, burst: Union[int, None] = None) -> 'TokenBucket':
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one if the bucket is empty."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MonitoringServicer(MonitoringServiceServicer):
+    """
+    MonitoringService accepting `Analyze` calls with a configurable latency,
+    error rate and throughput cap. Arrival times of accepted messages are
+    recorded to calculate receive rates.
+    """
+    def __init__(
+            self,
+            latency: float = 0.0,
+            error_rate: float = 0.0,
+            max_rps: Union[float, None] = None,
+            seed: int = 42,
+    ) -> 'MonitoringServicer':
+        self.latency = latency
+        self.error_rate = error_rate
+        self.limiter = TokenBucket(max_rps) if max_rps else None
+        self.received: List[float] = []
+        self.rejected = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def Analyze(self, request, context):  # pylint: disable=invalid-name
+        if self.limiter is not None:
+            self.limiter.acquire()
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.rejected += 1
+            else:
+                self.received.append(time.monotonic())
+        if failed:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Injected failure")
+        return Empty()
+
+    def reset(self):
+        """Forget received messages."""
+        with self._lock:
+            self.received = []
+            self.rejected = 0
+
+    def receive_rates(self) -> Dict:
+        """Average and peak per-second rates of accepted messages."""
+        with self._lock:
+            received = list(self.received)
+        if not received:
+            return {'received': 0, 'rejected': self.rejected, 'mean_rps': 0.0, 'peak_rps': 0}
+        buckets: Dict[int, int] = {}
+        for arrival in received:
+            second = int(arrival - received[0])
+            buckets[second] = buckets.get(second, 0) + 1
+        elapsed = received[-1] - received[0]
+        return {
+            'received': len(received),
+            'rejected': self.rejected,
+            'mean_rps': len(received) / elapsed if elapsed else float(len(received)),
+            'peak_rps': max(buckets.values()),
+        }
+
+
+class MonitoringServer:
+    """Runs `MonitoringServicer` on a local port."""
+    def __init__(self, servicer: MonitoringServicer, workers: int = 16) -> 'MonitoringServer':
+        self.servicer = servicer
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+        add_MonitoringServiceServicer_to_server(servicer, self._server)
+        self.port = self._server.add_insecure_port('127.0.0.1:0')
+
+    @property
+    def endpoint(self) -> str:
+        # pylint: disable=missing-function-docstring
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> 'MonitoringServer':
+        self._server.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.stop(grace=None)
+
+
+class HydrosphereApi:
+    """In-memory catalog of models, registered through the fake REST API."""
+    def __init__(self) -> 'HydrosphereApi':
+        self.models: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def register(self, body: dict) -> dict:
+        # pylint: disable=missing-function-docstring
+        with self._lock:
+            name = body['name']
+            if name not in self.models:
+                self.models[name] = {
+                    'id': len(self.models) + 1,
+                    'model': {'id': len(self.models) + 1, 'name': name},
+                    'modelVersion': 1,
+                    'contract': body.get('contract'),
+                    'metadata': body.get('metadata', {}),
+                }
+            return self.models[name]
+
+
+class _ApiRequestHandler(BaseHTTPRequestHandler):
+    # pylint: disable=invalid-name
+    api: HydrosphereApi = None
+    version_path = re.compile(r'^/api/v2/model/version/(?P<name>[^/]+)/(?P<version>\d+)$')
+    profile_path = re.compile(r'^/monitoring/profiles/batch/(?P<id>\d+)/(?P<action>s3|status)$')
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _reply(self, body, status: int = 200):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/api/v2/model':
+            return self._reply([model['model'] for model in self.api.models.values()])
+        match = self.version_path.match(self.path)
+        if match and match['name'] in self.api.models:
+            return self._reply(self.api.models[match['name']])
+        match = self.profile_path.match(self.path)
+        if match and match['action'] == 'status':
+            return self._reply({'kind': 'Success'})
+        return self._reply({'error': 'Not found'}, 404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path == '/api/v2/externalmodel':
+            return self._reply(self.api.register(body))
+        match = self.profile_path.match(self.path)
+        if match and match['action'] == 's3':
+            return self._reply({})
+        return self._reply({'error': 'Not found'}, 404)
+
+
+class HydrosphereApiServer:
+    """Runs the fake Hydrosphere REST API on a local port."""
+    def __init__(self, api: Union[HydrosphereApi, None] = None) -> 'HydrosphereApiServer':
+        self.api = api or HydrosphereApi()
+        handler = type('ApiRequestHandler', (_ApiRequestHandler,), {'api': self.api})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self) -> str:
+        # pylint: disable=missing-function-docstring
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self) -> 'HydrosphereApiServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
@@ -3,12 +3,23 @@ This module defines various clients for a Lambda function.
 """
 import os
 import urllib.parse
-from typing import Union
+from typing import List, Union
 import grpc
 import boto3
 import botocore
 
 
+def parse_endpoints(value: str) -> List[str]:
+    """
+    Split a comma-separated list of Hydrosphere endpoints. The first one is
+    the primary cluster, the rest are mirrors.
+    """
+    endpoints = [endpoint.strip() for endpoint in value.split(',') if endpoint.strip()]
+    if not endpoints:
+        raise ValueError("At least one Hydrosphere endpoint is required")
+    return endpoints
+
+
 class AWSClientFactory:
     """Helper class for managing AWS clients."""
 
@@ -18,7 +29,9 @@ class AWSClientFactory:
         if not getattr(AWSClientFactory, session_id, {}):
             setattr(AWSClientFactory, session_id, {})
         clients = getattr(AWSClientFactory, session_id)
-        return clients.setdefault(name, AWSClientFactory._get_or_create_client(name, session))
+        if name not in clients:
+            clients[name] = AWSClientFactory._get_or_create_client(name, session)
+        return clients[name]
 
     @staticmethod
     def _get_or_create_client(name: str, session: Union[boto3.Session, botocore.session.Session]):
@@ -30,12 +43,21 @@ class AWSClientFactory:
 
 class RPCStubFactory:
     """Helper class for managing gRPC stubs."""
+    _channels = {}
 
     @staticmethod
     def create_stub(service_stub, channel: Union[grpc.Channel, None] = None):
-        channel = channel or RPCStubFactory._create_channel(os.environ["HYDROSPHERE_ENDPOINT"])
+        channel = channel or RPCStubFactory.get_or_create_channel(
+            parse_endpoints(os.environ["HYDROSPHERE_ENDPOINT"])[0])
         return service_stub(channel)
 
+    @staticmethod
+    def get_or_create_channel(uri: str) -> grpc.Channel:
+        """Return a channel to the endpoint, shared by all stubs."""
+        if uri not in RPCStubFactory._channels:
+            RPCStubFactory._channels[uri] = RPCStubFactory._create_channel(uri)
+        return RPCStubFactory._channels[uri]
+
     @staticmethod
     def _create_channel(uri: str)-> grpc.Channel:
         """Make a gRPC channel from endpoint URI."""
@@ -0,0 +1,145 @@
+"""
+This module decompresses capture files while they are streamed from S3.
+
+Compression is detected by the Content-Encoding of the object, then by the
+suffix of the key, and finally by the magic bytes at the start of the body,
+so renamed or re-encoded archives are still recognized. gzip is handled
+with zlib, zstd with the `zstandard` package, which is imported only when
+a zstd file is met. Data is decompressed chunk by chunk with a bounded
+output size, so a compressed file needs about as much memory as a plain one.
+Files written by the function itself are compressed with `compress`.
+"""
+import gzip
+import zlib
+from typing import IO, Union
+from src import errors
+
+GZIP, ZSTD = 'gzip', 'zstd'
+
+ENCODINGS = {'gzip': GZIP, 'x-gzip': GZIP, 'zstd': ZSTD}
+SUFFIXES = {'.gz': GZIP, '.gzip': GZIP, '.zst': ZSTD, '.zstd': ZSTD}
+MAGIC_BYTES = {b'\x1f\x8b': GZIP, b'\x28\xb5\x2f\xfd': ZSTD}
+MAGIC_LENGTH = max(len(magic) for magic in MAGIC_BYTES)
+
+COMPRESSED_READ_SIZE = 64 * 1024
+
+
+def detect(
+        key: str = '',
+        content_encoding: Union[str, None] = None,
+        head: bytes = b'',
+) -> Union[str, None]:
+    """Detect the compression of an object. Return None for plain data."""
+    for encoding in (content_encoding or '').lower().split(','):
+        if encoding.strip() in ENCODINGS:
+            return ENCODINGS[encoding.strip()]
+    for suffix, codec in SUFFIXES.items():
+        if key.lower().endswith(suffix):
+            return codec
+    for magic, codec in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+class _PrefixedStream:
+    """Returns bytes peeked from a stream before the rest of it."""
+    def __init__(self, head: bytes, stream: IO[bytes]) -> '_PrefixedStream':
+        self._head = head
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        # pylint: disable=missing-function-docstring
+        if not self._head:
+            return self._stream.read(size)
+        if size is None or size < 0:
+            data, self._head = self._head + self._stream.read(), b''
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        return data
+
+    def readinto(self, buffer: memoryview) -> int:
+        # pylint: disable=missing-function-docstring
+        if not self._head and hasattr(self._stream, 'readinto'):
+            return self._stream.readinto(buffer)
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class GzipStream:
+    """
+    Decompresses a gzip stream incrementally. Concatenated gzip members,
+    as produced by appending to an archive, are read one after another.
+    """
+    def __init__(self, stream: IO[bytes], read_size: int = COMPRESSED_READ_SIZE) -> 'GzipStream':
+        self._stream = stream
+        self._read_size = read_size
+        self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        self._pending = b''
+        self._exhausted = False
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size decompressed bytes. An empty result means EOF."""
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self._read_size), b''))
+        while True:
+            if not self._pending:
+                if self._exhausted:
+                    return b''
+                self._pending = self._stream.read(self._read_size)
+                if not self._pending:
+                    self._exhausted = True
+                    return self._decompressor.flush()
+            data = self._decompressor.decompress(self._pending, size)
+            self._pending = self._decompressor.unconsumed_tail
+            if self._decompressor.eof:
+                # The next member starts right after the end of this one,
+                # unused_data holds all input past it
+                self._pending = self._decompressor.unused_data.lstrip(b'\x00')
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            if data:
+                return data
+
+
+def _zstandard():
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise errors.UnsupportedCompression(
+            "Reading and writing zstd compressed files requires the zstandard package")
+    return zstandard
+
+
+def _zstd_stream(stream: IO[bytes]) -> IO[bytes]:
+    return _zstandard().ZstdDecompressor().stream_reader(
+        stream, read_size=COMPRESSED_READ_SIZE, read_across_frames=True)
+
+
+def open_stream(
+        stream: IO[bytes],
+        key: str = '',
+        content_encoding: Union[str, None] = None,
+) -> IO[bytes]:
+    """Wrap the body of an object into a decompressing stream if needed."""
+    codec = detect(key, content_encoding)
+    if codec is None:
+        head = stream.read(MAGIC_LENGTH)
+        codec = detect(head=head)
+        stream = _PrefixedStream(head, stream) if head else stream
+        if codec is None:
+            return stream
+    if codec == GZIP:
+        return GzipStream(stream)
+    return _zstd_stream(stream)
+
+
+def compress(data: bytes, codec: Union[str, None]) -> bytes:
+    """Compress data with the given codec. None leaves data as is."""
+    if codec is None:
+        return data
+    if codec == GZIP:
+        return gzip.compress(data)
+    if codec == ZSTD:
+        return _zstandard().ZstdCompressor().compress(data)
+    raise errors.UnsupportedCompression(f"Compression should be one of {(GZIP, ZSTD)}, got {codec}")
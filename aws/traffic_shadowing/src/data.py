@@ -1,21 +1,49 @@
 """
 This module defines different data instances to work with accross other modules.
+
+hydro_serving_grpc is imported on first use, since importing it takes the
+most of a cold start.
 """
 import logging
 import json
-from typing import Generator, Dict, List, Tuple, Union
+from typing import Generator, Dict, Iterator, List, Tuple, Union
 from dataclasses import dataclass
-from io import StringIO, BytesIO
-from itertools import chain
-import pandas as pd
+from itertools import chain, islice
 import boto3
 import botocore
-import hydro_serving_grpc as hs
 from src.utils import DTYPE_CONVERSIONS, VALUE_CONVERSIONS
 from src.clients import AWSClientFactory
+from src import compression
+from src import decoders
+from src import dtypes
+from src import errors
+from src import metrics
+from src.lines import READ_CHUNK_SIZE, iter_line_batches
+from src.projection import Projection
 
 logger = logging.getLogger('main')
 
+# Projection of capture lines to the fields `Request.from_dict` needs
+CAPTURE_PROJECTION = (
+    'SELECT s.captureData.endpointInput.data AS "input", '
+    's.captureData.endpointOutput.data AS "output", '
+    's.eventMetadata.eventId AS "eventId", '
+    's.eventMetadata.inferenceTime AS "inferenceTime" '
+    'FROM S3Object s'
+)
+SELECT_COMPRESSION = {None: 'NONE', compression.GZIP: 'GZIP'}
+# Capture and training rows, whose values must fit narrowed dtypes
+NARROWING_SAMPLE_ROWS = 1000
+# Dtypes, which narrowed columns were inferred with, for values not fitting them
+WIDE_DTYPES = {'int32': 'int64', 'float32': 'float64'}
+# Kinds of dtypes, whose columns can be packed into a vector tensor
+PACKED_DTYPE_PREFIXES = ('int', 'uint', 'float')
+# Errors, after which the whole object is read instead of a projection
+SELECT_ERRORS = (
+    botocore.exceptions.ClientError,
+    botocore.exceptions.ConnectionError,
+)
+
 
 @dataclass
 class ColumnDescription:
@@ -24,6 +52,7 @@ class ColumnDescription:
     dtype: str
     htype: str
     shape: Tuple[int]
+    features: Tuple[str, ...] = ()      # names of features packed into the column
 
 
 @dataclass
@@ -31,13 +60,19 @@ class SchemaDescription:
     # pylint: disable=missing-class-docstring
     inputs: List[ColumnDescription]
     outputs: List[ColumnDescription]
+    input_decoder: decoders.Decoder = decoders.CsvDecoder()
+    output_decoder: decoders.Decoder = decoders.CsvDecoder()
+    # Positions of decoded values of every column, a tuple for packed
+    # columns. None means the columns follow the decoded values one to one.
+    input_layout: Union[List[Union[int, Tuple[int, ...]]], None] = None
+    output_layout: Union[List[Union[int, Tuple[int, ...]]], None] = None
 
 
 @dataclass
 class Column:
     # pylint: disable=missing-class-docstring
     description: ColumnDescription
-    data: str
+    data: Union[str, Tuple[str], 'numpy.ndarray']   # CSV cells or a decoded array
 
 
 @dataclass
@@ -76,11 +111,81 @@ class Record:
             session
         )
 
-    def read(self) -> Generator[Dict, None, None]:
+    def read_batches(self, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[List[memoryview]]:
+        """
+        Iterate by batches of lines on the remote object, decompressing it
+        on the fly if needed. Lines are views, which are valid until the
+        next batch, see `src.lines`.
+        """
+        timer = metrics.current().timer('S3Read')
+        with timer:
+            obj = self._s3_client.get_object(Bucket=self.bucket, Key=self.key)
+        body = compression.open_stream(obj['Body'], self.key, obj.get('ContentEncoding'))
+        return iter_line_batches(body, chunk_size, timer)
+
+    def select_batches(
+            self,
+            expression: str = CAPTURE_PROJECTION,
+            chunk_size: int = READ_CHUNK_SIZE,
+    ) -> Iterator[List[memoryview]]:
+        """
+        Iterate by batches of JSON lines, projected by S3 Select on the
+        server side. If Select can't be used for the object, e.g. it's
+        disabled for the account or the compression isn't supported, the
+        whole object is read with `read_batches`.
+        """
+        codec = compression.detect(self.key)
+        if codec not in SELECT_COMPRESSION:
+            return self.read_batches(chunk_size)
+        timer = metrics.current().timer('S3Read')
+        try:
+            with timer:
+                response = self._s3_client.select_object_content(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Expression=expression,
+                    ExpressionType='SQL',
+                    InputSerialization={
+                        'JSON': {'Type': 'LINES'},
+                        'CompressionType': SELECT_COMPRESSION[codec],
+                    },
+                    OutputSerialization={'JSON': {'RecordDelimiter': '\n'}},
+                )
+                # Errors of the query arrive as the first event
+                events = iter(response['Payload'])
+                first = next(events, None)
+        except SELECT_ERRORS as error:
+            logger.warning("Can't select from s3://%s/%s, reading the whole object: %s",
+                           self.bucket, self.key, error)
+            return self.read_batches(chunk_size)
+        stream = SelectStream(chain([first], events) if first is not None else events)
+        return iter_line_batches(stream, chunk_size, timer)
+
+    def read(self) -> Generator[bytes, None, None]:
         """Iterate by lines on the remote object."""
-        obj = self._s3_client.get_object(Bucket=self.bucket, Key=self.key)
-        for line in obj['Body'].iter_lines():
-            yield line
+        for batch in self.read_batches():
+            for line in batch:
+                yield line.tobytes()
+
+
+class SelectStream:
+    """Reads records of a SelectObjectContent event stream as a byte stream."""
+    def __init__(self, events: Iterator[Dict]) -> 'SelectStream':
+        self._events = events
+        self._chunk = b''
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes. An empty result means the end of the stream."""
+        while not self._chunk:
+            event = next(self._events, None)
+            if event is None:
+                return b''
+            self._chunk = event.get('Records', {}).get('Payload', b'')
+        if size is None or size < 0 or size >= len(self._chunk):
+            data, self._chunk = self._chunk, b''
+        else:
+            data, self._chunk = self._chunk[:size], self._chunk[size:]
+        return data
 
 
 class Contract:
@@ -89,16 +194,39 @@ class Contract:
             self,
             capture_record: Record,                     # Should be jsonl file
             train_record: Union[Record, None] = None,   # Should be csv file
-            session: Union[boto3.Session, botocore.session.Session, None] = None
+            session: Union[boto3.Session, botocore.session.Session, None] = None,
+            batched: bool = False,                      # Keep CSV mini-batches whole
+            narrow: bool = False,                       # Narrow dtypes of CSV columns
+            pack: bool = False,                         # Pack CSV columns into vectors
+            projection: Projection = Projection(),      # Columns to shadow
     ) -> 'Contract':
         self._session = session or boto3.Session()
         self._s3_client = AWSClientFactory.get_or_create_client('s3', self._session)
 
         self.capture_record = capture_record
         self.train_record = train_record
-        self.schema = self._parse_schema()
-        if self.train_record:
-            self._update_headers()
+        self.batched = batched
+        self.narrow = narrow
+        self.pack = pack
+        self.projection = projection
+        with metrics.current().timer('SchemaInference'):
+            self.schema = self._parse_schema()
+            if self.train_record:
+                self._update_headers()
+            if self.narrow:
+                self._narrow_dtypes()
+            if self.projection != Projection():
+                self._project_columns()
+            if self.pack:
+                self._pack_features()
+
+    @property
+    def adjusted(self) -> bool:
+        """
+        Whether narrowing, packing or the projection changed the inferred
+        schema. They apply only to models registered with them.
+        """
+        return bool(self.narrow or self.pack or self.projection != Projection())
 
     def _parse_schema(self) -> SchemaDescription:
         """
@@ -107,43 +235,167 @@ class Contract:
         data = json.loads(next(self.capture_record.read()))
         inputs = data['captureData']['endpointInput']
         outputs = data['captureData']['endpointOutput']
-        assert inputs["encoding"] == "CSV", \
-            "At the moment the only support is provided for CSV data"
-        assert outputs["encoding"] == "CSV", \
-            "At the moment the only support is provided for CSV data"
+        input_decoder = decoders.for_payload(inputs, self.batched)
+        output_decoder = decoders.for_payload(outputs, self.batched)
 
         schema = SchemaDescription(
-            self._parse_data("input", inputs['data']),
-            self._parse_data("output", outputs['data'])
+            self._parse_data("input", inputs['data'], input_decoder),
+            self._parse_data("output", outputs['data'], output_decoder),
+            input_decoder,
+            output_decoder,
         )
         logger.debug("Inferred schemas with %d inputs and %d outputs",
                      len(schema.inputs), len(schema.outputs))
         return schema
 
-    def _parse_data(self, prefix: str, row: str) -> List[ColumnDescription]:
-        """Infer column schemas based on a CSV row."""
+    def _parse_data(
+            self,
+            prefix: str,
+            row: str,
+            decoder: decoders.Decoder = decoders.CsvDecoder(),
+    ) -> List[ColumnDescription]:
+        """Infer column schemas based on a captured payload."""
         logger.debug("Inferencing a row schema")
-        dataframe = pd.read_csv(StringIO(row), header=None)
         return [
             ColumnDescription(
-                f"{prefix}_{i}",
-                dataframe.dtypes[i].name,
-                DTYPE_CONVERSIONS.get(dataframe.dtypes[i].name),
-                dataframe.dtypes[i].shape,
+                field.name or f"{prefix}_{i}",
+                field.dtype,
+                DTYPE_CONVERSIONS.get(field.dtype),
+                field.shape,
             )
-            for i in range(len(dataframe.columns))
+            for i, field in enumerate(decoder.infer(decoder.payload(row)))
         ]
 
     def _update_headers(self):
         """
         Substitute synthetic headers with ones, extracted from a training record.
+        Only columns of CSV payloads are named by position.
         """
+        if not (self.schema.input_decoder.positional and self.schema.output_decoder.positional):
+            logger.debug("Keeping inferred header names of non-CSV payloads")
+            return
         logger.debug("Substituting header names")
-        dataframe = pd.read_csv(BytesIO(next(self.train_record.read())))
+        columns = dtypes.parse_header(next(self.train_record.read()))
         descriptions = chain(reversed(self.schema.inputs), reversed(self.schema.outputs))
-        for new_name, desc in zip(reversed(dataframe.columns), descriptions):
+        for new_name, desc in zip(reversed(columns), descriptions):
             desc.name = new_name
 
+    def _narrow_dtypes(self):
+        """
+        Narrow dtypes of CSV columns to the smallest ones, which hold every
+        value of the sampled capture and training rows.
+        """
+        schema = self.schema
+        cells = {id(desc): [] for desc in chain(schema.inputs, schema.outputs)}
+        sides = (
+            (schema.inputs, schema.input_decoder, 'endpointInput'),
+            (schema.outputs, schema.output_decoder, 'endpointOutput'),
+        )
+        for line in islice(self.capture_record.read(), NARROWING_SAMPLE_ROWS):
+            capture = json.loads(line)['captureData']
+            for descriptions, decoder, key in sides:
+                if not decoder.positional:
+                    continue
+                for row in decoder.payload(capture[key]['data']).splitlines():
+                    for desc, cell in zip(descriptions, dtypes.split_row(row)):
+                        cells[id(desc)].append(cell)
+        if self.train_record and schema.input_decoder.positional and schema.output_decoder.positional:
+            # Training rows are aligned with the columns as in `_update_headers`
+            descriptions = list(chain(reversed(schema.inputs), reversed(schema.outputs)))
+            for row in islice(self.train_record.read(), 1, NARROWING_SAMPLE_ROWS + 1):
+                for desc, cell in zip(descriptions, reversed(dtypes.split_row(row))):
+                    cells[id(desc)].append(cell)
+
+        narrowed = 0
+        for desc in chain(schema.inputs, schema.outputs):
+            if not cells[id(desc)]:
+                continue
+            dtype = dtypes.narrow_dtype(desc.dtype, cells[id(desc)])
+            if dtype != desc.dtype:
+                desc.dtype, desc.htype = dtype, DTYPE_CONVERSIONS[dtype]
+                narrowed += 1
+        logger.debug("Narrowed dtypes of %d columns", narrowed)
+
+    def _project_columns(self):
+        """
+        Drop columns, which the projection doesn't keep. CSV values are
+        picked by position, so dropped cells are split off but never cast;
+        other decoders read kept columns only. Raise `EmptyProjection`, if
+        no column is kept.
+        """
+        schema = self.schema
+        names = [column.name for column in chain(schema.inputs, schema.outputs)]
+        unknown = self.projection.unknown(names)
+        if unknown:
+            logger.warning("Projection lists columns, which the contract doesn't have: %s",
+                           ", ".join(sorted(unknown)))
+        schema.inputs, schema.input_layout = self._projected_columns(
+            schema.inputs, schema.input_decoder)
+        schema.outputs, schema.output_layout = self._projected_columns(
+            schema.outputs, schema.output_decoder)
+        if not (schema.inputs or schema.outputs):
+            raise errors.EmptyProjection(
+                f"Projection {self.projection} keeps none of the columns: {', '.join(names)}")
+        logger.debug("Projected schemas to %d inputs and %d outputs",
+                     len(schema.inputs), len(schema.outputs))
+
+    def _projected_columns(
+            self,
+            columns: List[ColumnDescription],
+            decoder: decoders.Decoder,
+    ) -> Tuple[List[ColumnDescription], Union[List, None]]:
+        positions = self.projection.positions(column.name for column in columns)
+        if len(positions) == len(columns):
+            return columns, None
+        layout = positions if decoder.positional else None
+        return [columns[position] for position in positions], layout
+
+    def _pack_features(self):
+        """
+        Replace scalar numeric CSV columns of the same dtype with a single
+        vector column, which keeps names of the features. Columns of other
+        dtypes and of batched payloads are kept as they are.
+        """
+        schema = self.schema
+        schema.inputs, schema.input_layout = self._packed_columns(
+            "input", schema.inputs, schema.input_layout, schema.input_decoder)
+        schema.outputs, schema.output_layout = self._packed_columns(
+            "output", schema.outputs, schema.output_layout, schema.output_decoder)
+
+    @staticmethod
+    def _packed_columns(
+            prefix: str,
+            columns: List[ColumnDescription],
+            layout: Union[List[int], None],
+            decoder: decoders.Decoder,
+    ) -> Tuple[List[ColumnDescription], Union[List, None]]:
+        groups = {}
+        if decoder.positional and not getattr(decoder, 'batched', False):
+            for index, column in enumerate(columns):
+                if column.shape == () and column.dtype.startswith(PACKED_DTYPE_PREFIXES):
+                    groups.setdefault(column.dtype, []).append(index)
+        groups = {dtype: indices for dtype, indices in groups.items() if len(indices) > 1}
+        if not groups:
+            return columns, layout
+
+        # Positions of decoded values, which may skip projected out columns
+        positions = layout or list(range(len(columns)))
+        packed = set(chain.from_iterable(groups.values()))
+        kept = [index for index in range(len(columns)) if index not in packed]
+        result = [columns[index] for index in kept]
+        layout = [positions[index] for index in kept]
+        for dtype, indices in groups.items():
+            result.append(ColumnDescription(
+                f"{prefix}_{dtype}",
+                dtype,
+                DTYPE_CONVERSIONS.get(dtype),
+                (len(indices),),
+                tuple(columns[index].name for index in indices),
+            ))
+            layout.append(tuple(positions[index] for index in indices))
+        logger.debug("Packed %d %s columns into %d tensors", len(packed), prefix, len(groups))
+        return result, layout
+
 
 class Request:
     """A single request processed by a Sagemaker model."""
@@ -159,27 +411,86 @@ class Request:
         self.outputs = outputs
         self.metadata = metadata
 
+    @staticmethod
+    def unpack(data: Dict) -> Tuple[str, str, Metadata]:
+        """Extract payloads and metadata of a raw json line or of its projection."""
+        capture = data.get('captureData')
+        if capture is None:
+            return data['input'], data['output'], Metadata(data['eventId'], data['inferenceTime'])
+        return (
+            capture['endpointInput']['data'],
+            capture['endpointOutput']['data'],
+            Metadata(
+                data['eventMetadata']['eventId'],
+                data['eventMetadata']['inferenceTime']
+            ),
+        )
+
     @classmethod
     def from_dict(cls, data: Dict, schema: SchemaDescription) -> 'Request':
-        """Create a new Request instance from a raw json line."""
-        input_data = data['captureData']['endpointInput']['data'].split(',')
-        output_data = data['captureData']['endpointOutput']['data'].split(',')
-        inputs = [
-            Column(description, data)
-            for description, data in zip(schema.inputs, input_data)
-        ]
-        outputs = [
-            Column(description, data)
-            for description, data in zip(schema.outputs, output_data)
+        """
+        Create a new Request instance from a raw json line, or from its
+        projection with `CAPTURE_PROJECTION`.
+        """
+        input_data, output_data, metadata = cls.unpack(data)
+        return cls._from_payloads(
+            schema.input_decoder.payload(input_data),
+            schema.output_decoder.payload(output_data),
+            metadata,
+            schema,
+        )
+
+    @classmethod
+    def from_dict_rows(cls, data: Dict, schema: SchemaDescription) -> List['Request']:
+        """
+        Create Requests from a raw json line, a Request per row of a CSV
+        mini-batch, unless the schema keeps mini-batches whole. Requests of
+        rows get ids derived from the event id: "<eventId>-<row>".
+        """
+        input_data, output_data, metadata = cls.unpack(data)
+        input_payload = schema.input_decoder.payload(input_data)
+        output_payload = schema.output_decoder.payload(output_data)
+        input_rows = schema.input_decoder.rows(input_payload)
+        if len(input_rows) == 1:
+            return [cls._from_payloads(input_rows[0], output_payload, metadata, schema)]
+        output_rows = schema.output_decoder.rows(output_payload)
+        if len(output_rows) != len(input_rows):
+            raise errors.MalformedCapture(
+                f"Request {metadata.event_id} has {len(input_rows)} input rows "
+                f"and {len(output_rows)} output rows")
+        return [
+            cls._from_payloads(
+                input_row,
+                output_row,
+                Metadata(f"{metadata.event_id}-{i}", metadata.inference_time),
+                schema,
+            )
+            for i, (input_row, output_row) in enumerate(zip(input_rows, output_rows))
         ]
-        metadata = Metadata(
-            data['eventMetadata']['eventId'],
-            data['eventMetadata']['inferenceTime']
+
+    @classmethod
+    def _from_payloads(
+            cls,
+            input_payload: Union[str, bytes],
+            output_payload: Union[str, bytes],
+            metadata: Metadata,
+            schema: SchemaDescription,
+    ) -> 'Request':
+        inputs = _columns(
+            schema.inputs,
+            schema.input_layout,
+            schema.input_decoder.split(input_payload, schema.inputs),
+        )
+        outputs = _columns(
+            schema.outputs,
+            schema.output_layout,
+            schema.output_decoder.split(output_payload, schema.outputs),
         )
         return cls(inputs, outputs, metadata)
 
     def build_input_tensors(self) -> Dict:
         """Build input tensors for Hydrosphere analysis."""
+        import hydro_serving_grpc as hs  # pylint: disable=import-outside-toplevel
         return {
             column.description.name: hs.TensorProto(
                 **self._build_tensor_kwargs(column)
@@ -189,6 +500,7 @@ class Request:
 
     def build_output_tensors(self) -> Dict:
         """Build output tensors for Hydrosphere analysis."""
+        import hydro_serving_grpc as hs  # pylint: disable=import-outside-toplevel
         return {
             column.description.name: hs.TensorProto(
                 **self._build_tensor_kwargs(column)
@@ -197,14 +509,52 @@ class Request:
         }
 
     def _build_tensor_kwargs(self, column: Column) -> Dict:
-        """Build keyword arguments for tensor construction."""
-        kwargs = {"dtype": column.description.htype}
-        value_field = VALUE_CONVERSIONS.get(column.description.htype)
-        value = pd.read_csv(StringIO(column.data), header=None)
-        value = value.iloc[0].astype(column.description.dtype)
-        kwargs[value_field] = value.values
+        """
+        Build keyword arguments for tensor construction. A tensor of a
+        narrowed column, some value of which doesn't fit, is built with the
+        dtype the column was inferred with, so no value is lost. Raise
+        `ValueOutOfRange`, if a cell doesn't fit the dtype otherwise.
+        """
+        import hydro_serving_grpc as hs  # pylint: disable=import-outside-toplevel
+        htype = column.description.htype
+        try:
+            values, shape = _tensor_values(column, column.description.dtype)
+        except errors.ValueOutOfRange as error:
+            wide = WIDE_DTYPES.get(column.description.dtype)
+            if wide is None:
+                raise errors.ValueOutOfRange(f"Column {column.description.name}: {error}") from None
+            values, shape = _tensor_values(column, wide)
+            htype = DTYPE_CONVERSIONS[wide]
+        kwargs = {"dtype": htype, VALUE_CONVERSIONS.get(htype): values}
         kwargs["tensor_shape"] = hs.TensorShapeProto(dim=[
-            hs.TensorShapeProto.Dim(size=shape)
-            for shape in column.description.shape
+            hs.TensorShapeProto.Dim(size=size)
+            for size in shape
         ])
         return kwargs
+
+
+def _tensor_values(column: Column, dtype: str) -> Tuple[List, Tuple[int, ...]]:
+    """Cast values of a column to the dtype, return them and the shape of the tensor."""
+    if isinstance(column.data, str):
+        return [dtypes.cast(column.data, dtype)], column.description.shape
+    if isinstance(column.data, tuple):
+        values = [dtypes.cast(cell, dtype) for cell in column.data]
+        return values, (len(values),)
+    return decoders.tensor_values(column.data, dtype)
+
+
+def _columns(
+        descriptions: List[ColumnDescription],
+        layout: Union[List[Union[int, Tuple[int, ...]]], None],
+        values: List,
+) -> List[Column]:
+    """Assign decoded values to columns according to the layout of the schema."""
+    if layout is None:
+        return [Column(description, data) for description, data in zip(descriptions, values)]
+    return [
+        Column(
+            description,
+            values[position] if isinstance(position, int) else tuple(map(values.__getitem__, position)),
+        )
+        for description, position in zip(descriptions, layout)
+    ]
@@ -0,0 +1,282 @@
+"""
+This module decodes captured request and response payloads into columns.
+
+SageMaker Data Capture stores every payload with its `observedContentType`
+and an `encoding`: CSV or JSON for text payloads, BASE64 for binary ones.
+A decoder is picked by the content type, falling back to the encoding:
+
+    text/csv            -> a scalar column per cell
+    application/json    -> a tensor per array, or per key of an object
+    application/x-npy   -> a single tensor, described by the array header
+
+Decoders infer names, dtypes and shapes of columns from a sample payload,
+and split payloads into column values. CSV cells stay strings until tensors
+are built; JSON and NPY payloads become NumPy arrays, which are cast and
+flattened in one go. NPY data is wrapped with `np.frombuffer` right after
+base64 decoding, without a text step. NumPy is imported only when a JSON or
+NPY payload is met.
+
+Clients may send several newline-separated CSV rows in one invocation. Such
+mini-batches are either decoded into columns with a leading batch dimension
+("batch" mode), or exploded into a request per row ("explode" mode, the
+default), as configured per model.
+
+Keys of JSON objects, which are missing from a payload, are decoded as
+missing values: NaN, empty strings or False, with no samples along
+variable dimensions. Arrays are cast to integer columns only if no value
+changes, so missing values, fractions and integers out of range reject
+their rows as `ValueOutOfRange`, as CSV cells do.
+"""
+import abc
+import io
+import json
+import binascii
+from dataclasses import dataclass
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple, Union
+from src.utils import DTYPE_CONVERSIONS
+from src import dtypes
+from src import errors
+from src import lines
+
+CSV, JSON, BASE64 = 'CSV', 'JSON', 'BASE64'
+BATCH, EXPLODE = 'batch', 'explode'
+BATCH_MODES = (BATCH, EXPLODE)
+DEFAULT_MODE_KEY = '*'
+
+
+class Field(NamedTuple):
+    """A column inferred from a sample payload. Unnamed columns get synthetic names."""
+    name: Union[str, None]
+    dtype: str
+    shape: Tuple[int, ...]
+
+
+def _numpy():
+    try:
+        import numpy  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise errors.UnsupportedEncoding(
+            "Decoding JSON and NPY payloads requires the numpy package")
+    return numpy
+
+
+@dataclass(frozen=True)
+class Decoder(abc.ABC):
+    """Splits payloads of one content type into values of columns."""
+    base64: bool = False
+    # Columns are identified by position, so training headers can name them
+    positional = False
+
+    def payload(self, data: str) -> Union[str, bytes]:
+        """
+        Undo the transfer encoding of a captured payload. Other methods
+        accept payloads returned by this one.
+        """
+        return binascii.a2b_base64(data) if self.base64 else data
+
+    def rows(self, payload: Union[str, bytes]) -> List[Union[str, bytes]]:
+        """Split a payload into payloads of single rows, if it's a mini-batch."""
+        return [payload]
+
+    @abc.abstractmethod
+    def infer(self, payload: Union[str, bytes]) -> List[Field]:
+        """Infer columns of a sample payload."""
+
+    @abc.abstractmethod
+    def split(self, payload: Union[str, bytes], columns: Sequence) -> List[Any]:
+        """Split a payload into values of the given columns."""
+
+
+@dataclass(frozen=True)
+class CsvDecoder(Decoder):
+    """
+    Reads CSV rows, which are a scalar column per cell. When `batched`,
+    every column holds the cells of all rows of the payload.
+    """
+    batched: bool = False
+    positional = True
+
+    def payload(self, data: str) -> str:
+        if not self.base64:
+            return data
+        return binascii.a2b_base64(data).decode('utf-8-sig')
+
+    def rows(self, payload: str) -> List[str]:
+        if self.batched or '\n' not in payload:
+            return [payload]
+        return [row for row in payload.splitlines() if row]
+
+    def infer(self, payload: str) -> List[Field]:
+        shape = (-1,) if self.batched else ()
+        first_row = payload.strip().split('\n', 1)[0]
+        return [Field(None, dtypes.infer_dtype(cell), shape) for cell in dtypes.split_row(first_row)]
+
+    def split(self, payload: str, columns: Sequence) -> List[Any]:
+        if not self.batched:
+            return dtypes.split_row(payload)
+        # Tuples of cells of every column
+        return list(zip(*(dtypes.split_row(row) for row in payload.splitlines() if row)))
+
+
+@dataclass(frozen=True)
+class JsonDecoder(Decoder):
+    """
+    Reads a JSON document. An object is a column per key, anything else is
+    a single column; values are converted to arrays as a whole.
+    """
+    def infer(self, payload: Union[str, bytes]) -> List[Field]:
+        document = lines.loads(payload)
+        if isinstance(document, dict):
+            return [_describe(name, _as_array(value)) for name, value in document.items()]
+        return [_describe(None, _as_array(document))]
+
+    def split(self, payload: Union[str, bytes], columns: Sequence) -> List[Any]:
+        document = lines.loads(payload)
+        if isinstance(document, dict):
+            return [
+                _as_array(document[column.name]) if column.name in document else _missing(column)
+                for column in columns
+            ]
+        return [_as_array(document)]
+
+
+@dataclass(frozen=True)
+class NpyDecoder(Decoder):
+    """Reads a single array in the NumPy .npy format."""
+    base64: bool = True
+
+    def infer(self, payload: Union[str, bytes]) -> List[Field]:
+        return [_describe(None, self._array(payload))]
+
+    def split(self, payload: Union[str, bytes], columns: Sequence) -> List[Any]:
+        return [self._array(payload)]
+
+    @staticmethod
+    def _array(raw: Union[str, bytes]) -> Any:
+        numpy = _numpy()
+        if isinstance(raw, str):
+            raw = raw.encode('latin-1')
+        header = io.BytesIO(raw)
+        version = numpy.lib.format.read_magic(header)
+        if version == (1, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(header)
+        else:
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(header)
+        if dtype.hasobject:
+            raise errors.UnsupportedEncoding("NPY payloads of Python objects are not supported")
+        count = 1
+        for dim in shape:
+            count *= dim
+        array = numpy.frombuffer(raw, dtype, count=count, offset=header.tell())
+        return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+# Decoders by the observed content type, without parameters like charset
+CONTENT_TYPES = {
+    'text/csv': CsvDecoder,
+    'application/json': JsonDecoder,
+    'application/jsonlines': JsonDecoder,
+    'application/x-npy': NpyDecoder,
+}
+# Decoders by the capture encoding, when the content type isn't known
+ENCODINGS = {
+    CSV: CsvDecoder,
+    JSON: JsonDecoder,
+}
+
+
+def for_payload(payload: Dict, batched: bool = False) -> Decoder:
+    """
+    Pick a decoder for the `endpointInput` or `endpointOutput` of a capture
+    line. With `batched`, CSV mini-batches are decoded as a whole.
+    """
+    encoding = payload.get('encoding', CSV).upper()
+    content_type = payload.get('observedContentType', '').split(';')[0].strip().lower()
+    decoder = CONTENT_TYPES.get(content_type) or ENCODINGS.get(encoding)
+    if decoder is None:
+        raise errors.UnsupportedEncoding(
+            f"Payloads of {content_type or 'unknown'} type with {encoding} encoding are not supported")
+    if decoder is CsvDecoder:
+        return CsvDecoder(base64=encoding == BASE64, batched=batched)
+    return decoder(base64=encoding == BASE64)
+
+
+def parse_batch_modes(value: str) -> Dict[str, str]:
+    """
+    Parse mini-batch configuration. The value is either a single mode applied
+    to all models, e.g. "batch", or a JSON object mapping model names to
+    modes, where the "*" key defines the default mode.
+    """
+    value = (value or '').strip() or EXPLODE
+    modes = json.loads(value) if value.startswith('{') else {DEFAULT_MODE_KEY: value}
+    for name, mode in modes.items():
+        if mode not in BATCH_MODES:
+            raise ValueError(f"Mini-batch mode for {name} should be one of {BATCH_MODES}, got {mode}")
+    modes.setdefault(DEFAULT_MODE_KEY, EXPLODE)
+    return modes
+
+
+def batch_mode(modes: Dict[str, str], model_name: str) -> str:
+    """Find the mini-batch mode configured for the given model."""
+    return modes.get(model_name, modes.get(DEFAULT_MODE_KEY, EXPLODE))
+
+
+def _as_array(value: Any) -> Any:
+    return _numpy().asarray(value)
+
+
+def _missing(column: Any) -> Any:
+    """An array standing for a column missing from a JSON object."""
+    numpy = _numpy()
+    shape = tuple(0 if size == -1 else size for size in column.shape)
+    if column.dtype == 'string':
+        return numpy.full(shape, b'', dtype=object)
+    if column.dtype == 'bool':
+        return numpy.zeros(shape, dtype=bool)
+    return numpy.full(shape, numpy.nan)
+
+
+def _dtype(array: Any) -> str:
+    """Name the dtype of an array in the vocabulary of `DTYPE_CONVERSIONS`."""
+    if array.dtype.kind in 'USO':
+        return 'string'
+    if array.dtype.kind == 'b':
+        return 'bool'
+    if array.dtype.name not in DTYPE_CONVERSIONS:
+        raise errors.UnsupportedEncoding(f"Arrays of {array.dtype} are not supported")
+    return array.dtype.name
+
+
+def _describe(name: Union[str, None], array: Any) -> Field:
+    # The leading dimension usually counts samples, which vary between requests
+    shape = (-1,) + tuple(array.shape[1:]) if array.ndim else ()
+    return Field(name, _dtype(array), shape)
+
+
+def tensor_values(array: Any, dtype: str) -> Tuple[List, Tuple[int, ...]]:
+    """Cast an array to the dtype of its column, return flat values and the shape."""
+    numpy = _numpy()
+    array = numpy.asarray(array)
+    if dtype == 'string':
+        values = [
+            value if isinstance(value, bytes) else str(value).encode()
+            for value in array.ravel().tolist()
+        ]
+    elif dtype in ('float16', 'half'):
+        # half_val holds the bit patterns of the values
+        values = array.astype(numpy.float16).view(numpy.uint16).ravel().tolist()
+    elif dtype.startswith('complex'):
+        # Complex values are stored as pairs of real and imaginary parts
+        part = numpy.float32 if dtype == 'complex64' else numpy.float64
+        values = numpy.ascontiguousarray(array, dtype).view(part).ravel().tolist()
+    elif dtype.startswith(('int', 'uint')) and array.dtype.kind in 'iuf' \
+            and not numpy.can_cast(array.dtype, dtype, casting='safe'):
+        # Fractions, missing values and integers out of range don't survive the cast
+        with numpy.errstate(invalid='ignore'):
+            cast = array.astype(dtype)
+        if not numpy.array_equal(cast, array):
+            raise errors.ValueOutOfRange(f"Values of {array.dtype} don't fit {dtype}")
+        values = cast.ravel().tolist()
+    else:
+        values = array.astype(dtype, copy=False).ravel().tolist()
+    return values, array.shape
@@ -0,0 +1,160 @@
+"""
+This module provides means of suppressing duplicate deliveries.
+
+S3 notifications are delivered at least once, so the same capture file may
+trigger the function several times. Processed objects are remembered in a
+bounded in-memory log, which survives warm invocations, and optionally as
+marker objects on S3. Within a single file, re-sent rows are dropped with
+a Bloom filter over their event ids. A false positive drops a genuine row,
+so the filter stops remembering ids once it holds its capacity, which keeps
+the chance of that at most the configured error rate.
+"""
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Union
+import boto3
+import botocore
+from src.clients import AWSClientFactory
+
+logger = logging.getLogger('main')
+
+
+@dataclass(frozen=True)
+class ObjectIdentity:
+    # pylint: disable=missing-class-docstring
+    bucket: str
+    key: str
+    etag: str
+    sequencer: str
+
+    @classmethod
+    def from_event_record(cls, event_record: dict) -> 'ObjectIdentity':
+        """Create `ObjectIdentity` instance from S3 event record."""
+        obj = event_record['s3']['object']
+        return cls(
+            event_record['s3']['bucket']['name'],
+            obj['key'],
+            obj.get('eTag', ''),
+            obj.get('sequencer', ''),
+        )
+
+    @property
+    def digest(self) -> str:
+        """Compact fingerprint of the identity."""
+        return hashlib.blake2b(
+            '\0'.join([self.bucket, self.key, self.etag, self.sequencer]).encode(),
+            digest_size=16,
+        ).hexdigest()
+
+
+class ProcessedObjectLog:
+    """
+    Bounded log of processed objects. Only fingerprints are stored, and the
+    least recently seen ones are evicted once the capacity is reached.
+    """
+    def __init__(self, capacity: int = 4096) -> 'ProcessedObjectLog':
+        self.capacity = capacity
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, identity: ObjectIdentity) -> bool:
+        digest = identity.digest
+        if digest in self._entries:
+            self._entries.move_to_end(digest)
+            return True
+        return False
+
+    def add(self, identity: ObjectIdentity):
+        """Remember a processed object."""
+        self._entries[identity.digest] = None
+        self._entries.move_to_end(identity.digest)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+
+class ObjectMarkers:
+    """Persists processed object fingerprints as empty objects on S3."""
+    def __init__(
+            self,
+            bucket: str,
+            prefix: str,
+            session: Union[boto3.Session, botocore.session.Session, None] = None,
+    ) -> 'ObjectMarkers':
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self._session = session or boto3.Session()
+        self._s3_client = AWSClientFactory.get_or_create_client('s3', self._session)
+
+    def _key(self, identity: ObjectIdentity) -> str:
+        return f"{self.prefix}/{identity.digest}"
+
+    def exists(self, identity: ObjectIdentity) -> bool:
+        """Check whether the object has been marked as processed."""
+        try:
+            self._s3_client.head_object(Bucket=self.bucket, Key=self._key(identity))
+            return True
+        except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def mark(self, identity: ObjectIdentity):
+        """Mark the object as processed."""
+        self._s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(identity),
+            Body=b'',
+            Metadata={'source-key': identity.key[:1024]},
+        )
+
+
+class BloomFilter:
+    """
+    Probabilistic set with a fixed memory footprint. False positives occur
+    with at most the configured probability, false negatives never happen.
+    Once `capacity` items are added, the filter is full: further items are
+    only looked up and not remembered, so the rate of false positives
+    doesn't grow past the configured one.
+    """
+    def __init__(self, capacity: int = 100000, error_rate: float = 1e-4) -> 'BloomFilter':
+        self.capacity = capacity
+        self.count = 0
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: bytes):
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def __contains__(self, item: bytes) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @property
+    def full(self) -> bool:
+        # pylint: disable=missing-function-docstring
+        return self.count >= self.capacity
+
+    def add(self, item: bytes) -> bool:
+        """
+        Add an item to the filter, unless it's full. Return False if it was
+        (probably) present.
+        """
+        if self.full:
+            return item not in self
+        added = False
+        for pos in self._positions(item):
+            mask = 1 << (pos & 7)
+            if not self._bits[pos >> 3] & mask:
+                self._bits[pos >> 3] |= mask
+                added = True
+        self.count += added
+        return added
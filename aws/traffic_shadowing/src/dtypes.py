@@ -0,0 +1,146 @@
+"""
+This module infers types of CSV cells and casts cells to tensor values.
+
+Inference follows the rules pandas.read_csv applies to a single row, so
+the produced dtypes belong to the vocabulary of `DTYPE_CONVERSIONS` and
+`PROFILE_CONVERSIONS`:
+
+    "186"           -> int64 (uint64 above the int64 range)
+    "0.1", "1e-3"   -> float64, as well as missing values, e.g. "" or "NaN"
+    "True", "false" -> bool
+    anything else   -> string
+
+Columns can be narrowed afterwards to the smallest dtype holding every value
+of a sample, see `narrow_dtype`. Values of later rows may not fit a narrowed
+dtype; `cast` rejects them with `ValueOutOfRange`, so their tensors are
+built with the wide dtype instead.
+"""
+import re
+import csv
+import math
+from typing import Iterable, List, Union
+from src import errors
+
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+UINT64_MAX = 2 ** 64 - 1
+INT_RANGES = {
+    'int8': (-2 ** 7, 2 ** 7 - 1),
+    'int16': (-2 ** 15, 2 ** 15 - 1),
+    'int32': (INT32_MIN, INT32_MAX),
+    'int64': (INT64_MIN, INT64_MAX),
+    'uint8': (0, 2 ** 8 - 1),
+    'uint16': (0, 2 ** 16 - 1),
+    'uint32': (0, 2 ** 32 - 1),
+    'uint64': (0, UINT64_MAX),
+}
+# Decimals of up to 6 significant digits survive a round trip through float32
+FLOAT32_DIGITS = 6
+FLOAT32_MIN, FLOAT32_MAX = 1.1754943508222875e-38, 3.4028234663852886e+38
+
+INT_PATTERN = re.compile(r'^\s*[+-]?\d+\s*$')
+FLOAT_PATTERN = re.compile(
+    r'^\s*[+-]?(\d+\.?\d*(e[+-]?\d+)?|\.\d+(e[+-]?\d+)?|inf|infinity)\s*$', re.I
+)
+BOOL_VALUES = {'True': True, 'TRUE': True, 'true': True,
+               'False': False, 'FALSE': False, 'false': False}
+
+# Cells pandas reads as missing values by default
+NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+    'nan', 'null',
+])
+
+
+def split_row(row: Union[str, bytes]) -> List[str]:
+    """Split a CSV row into cells, honouring quotes."""
+    if isinstance(row, bytes):
+        row = row.decode('utf-8-sig')
+    return next(csv.reader([row]), [])
+
+
+def parse_header(row: Union[str, bytes]) -> List[str]:
+    """
+    Parse column names of a CSV header. Repeated names get a numeric
+    suffix, as pandas does: "a", "a" -> "a", "a.1".
+    """
+    names, seen = [], {}
+    for name in split_row(row):
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def infer_dtype(cell: str) -> str:
+    """Infer the dtype of a single CSV cell."""
+    if cell in NA_VALUES:
+        return 'float64'
+    if INT_PATTERN.match(cell):
+        value = int(cell)
+        if INT64_MIN <= value <= INT64_MAX:
+            return 'int64'
+        return 'uint64' if 0 <= value <= UINT64_MAX else 'float64'
+    if FLOAT_PATTERN.match(cell):
+        return 'float64'
+    if cell in BOOL_VALUES:
+        return 'bool'
+    return 'string'
+
+
+def cast(cell: str, dtype: str) -> Union[int, float, bool, bytes]:
+    """
+    Convert a CSV cell to a value of the given dtype. Integers outside the
+    range of the dtype and float32 cells, which float32 doesn't hold exactly
+    as written, raise `ValueOutOfRange`.
+    """
+    if dtype.startswith(('int', 'uint')):
+        value = int(cell)
+        low, high = INT_RANGES[dtype]
+        if not low <= value <= high:
+            raise errors.ValueOutOfRange(f"{value} is out of the {dtype} range")
+        return value
+    if dtype == 'bool':
+        return BOOL_VALUES.get(cell.strip(), False)
+    if dtype == 'string':
+        return cell.encode()
+    if cell in NA_VALUES:
+        return math.nan
+    if dtype == 'float32' and not _fits_float32(cell):
+        raise errors.ValueOutOfRange(f"{cell.strip()} doesn't fit float32")
+    return float(cell)
+
+
+def _fits_float32(cell: str) -> bool:
+    """Check whether float32 holds the decimal value of a cell exactly as written."""
+    if cell in NA_VALUES:
+        return True
+    if not FLOAT_PATTERN.match(cell) and not INT_PATTERN.match(cell):
+        return False
+    text = cell.strip().lower().lstrip('+-')
+    if text in ('inf', 'infinity'):
+        return True
+    mantissa = text.split('e')[0]
+    if len(mantissa.replace('.', '').strip('0')) > FLOAT32_DIGITS:
+        return False
+    value = abs(float(text))
+    return value == 0.0 or FLOAT32_MIN <= value <= FLOAT32_MAX
+
+
+def narrow_dtype(dtype: str, cells: Iterable[str]) -> str:
+    """
+    Find the narrowest dtype, which holds every cell of a column without
+    losing information. int64 columns become int32, float64 columns become
+    float32 when no cell has more than 6 significant digits. Integers aren't
+    narrowed further, since tensors carry them as varints anyway.
+    """
+    if dtype == 'int64':
+        fits = all(INT_PATTERN.match(cell) and INT32_MIN <= int(cell) <= INT32_MAX for cell in cells)
+        return 'int32' if fits else dtype
+    if dtype == 'float64':
+        return 'float32' if all(map(_fits_float32, cells)) else dtype
+    return dtype
@@ -22,3 +22,35 @@ class ModelRegistrationFailed(Exception):
 
 class DataUploadFailed(Exception):
     pass
+
+
+class AnalysisFailed(Exception):
+    pass
+
+
+class UnsupportedCompression(Exception):
+    pass
+
+
+class UnsupportedEncoding(Exception):
+    pass
+
+
+class MalformedCapture(Exception):
+    pass
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+class ValueOutOfRange(ValueError):
+    pass
+
+
+class ContractMismatch(Exception):
+    pass
+
+
+class EmptyProjection(Exception):
+    pass
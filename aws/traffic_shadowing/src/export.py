@@ -0,0 +1,249 @@
+"""
+This module exports parsed capture files as typed columnar files.
+
+Requests, which were parsed for shadowing, are written to Parquet or Arrow
+IPC files with a column per feature, named as in the contract, plus the
+`event_id` and `inference_time` of every row. Packed columns are written
+feature by feature; tensors of JSON and NPY payloads and CSV mini-batches
+become list columns of their flattened values. Offline readers then read
+only the columns they need, without parsing JSON lines again.
+
+Rows are buffered and written as a row group of `EXPORT_ROW_GROUP_ROWS`
+rows at a time into a temporary file, which is streamed to S3 when the
+capture file is done, so memory is bounded by a row group. CSV cells are
+converted to column types by Arrow, a row group at a time. Files go to
+
+    s3://<bucket>/<prefix>/model=<model>/date=<yyyy-mm-dd>/<capture file>.parquet
+
+where the date is the inference time of the first exported row, so
+retried files overwrite their exports. `pyarrow` is imported only when the
+export is enabled, and should be packaged with the function then.
+"""
+import logging
+import posixpath
+import tempfile
+from typing import Any, IO, List, NamedTuple, Union
+import boto3
+import botocore
+from src.clients import AWSClientFactory
+from src.data import Request, SchemaDescription
+from src import dtypes
+from src import errors
+
+logger = logging.getLogger('main')
+
+PARQUET, ARROW = 'parquet', 'arrow'
+EXTENSIONS = {PARQUET: '.parquet', ARROW: '.arrow'}
+CAPTURE_SUFFIXES = ('.gz', '.gzip', '.zst', '.zstd', '.jsonl')
+
+
+def _pyarrow():
+    try:
+        # pylint: disable=import-outside-toplevel
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise errors.UnsupportedFormat("Exporting capture data requires the pyarrow package")
+    return pyarrow
+
+
+def _arrow_type(pyarrow: Any, dtype: str) -> Any:
+    """Arrow type of values of a column with the given dtype."""
+    if dtype == 'string':
+        return pyarrow.string()
+    if dtype == 'bool':
+        return pyarrow.bool_()
+    if dtype.startswith(('int', 'uint')) or dtype in ('float32', 'float64'):
+        return pyarrow.from_numpy_dtype(dtype)
+    if dtype in ('float16', 'half'):
+        return pyarrow.float32()
+    if dtype == 'double':
+        return pyarrow.float64()
+    # Complex numbers and variants are kept as their text
+    return pyarrow.string()
+
+
+def export_key(prefix: str, model_name: str, date: str, capture_key: str, file_format: str) -> str:
+    """Build the key of the export of a capture file within a model/date partition."""
+    name = posixpath.basename(capture_key)
+    for suffix in CAPTURE_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return '/'.join(filter(None, [
+        prefix.strip('/'), f"model={model_name}", f"date={date}", name + EXTENSIONS[file_format]
+    ]))
+
+
+class _Field(NamedTuple):
+    name: str
+    dtype: str
+    side: str                       # 'inputs' or 'outputs'
+    index: int                      # Index of the column within the side
+    feature: Union[int, None]       # Index of the feature within a packed column
+    cells: bool                     # Values are CSV cells
+    scalar: bool
+
+
+class Exporter:
+    """Writes requests of a capture file into a columnar file."""
+    def __init__(
+            self,
+            schema: SchemaDescription,
+            file_format: str = PARQUET,
+            row_group_rows: int = 10000,
+    ) -> 'Exporter':
+        if file_format not in EXTENSIONS:
+            raise errors.UnsupportedFormat(
+                f"Export format should be one of {tuple(EXTENSIONS)}, got {file_format}")
+        self._pyarrow = _pyarrow()
+        self.file_format = file_format
+        self.row_group_rows = row_group_rows
+        self.rows = 0
+        self.date = None
+        self._fields = self._plan(schema)
+        self._schema = self._arrow_schema()
+        self._columns: List[List] = [[] for _ in self._fields]
+        self._event_ids: List[str] = []
+        self._inference_times: List[str] = []
+        self._file: Union[IO[bytes], None] = None
+        self._writer = None
+
+    @staticmethod
+    def _plan(schema: SchemaDescription) -> List[_Field]:
+        fields = []
+        sides = (
+            ('inputs', schema.inputs, schema.input_decoder),
+            ('outputs', schema.outputs, schema.output_decoder),
+        )
+        for side, columns, decoder in sides:
+            for index, column in enumerate(columns):
+                if column.features:
+                    fields.extend(
+                        _Field(name, column.dtype, side, index, feature, True, True)
+                        for feature, name in enumerate(column.features)
+                    )
+                else:
+                    fields.append(_Field(column.name, column.dtype, side, index, None,
+                                         decoder.positional, column.shape == ()))
+        return fields
+
+    def _arrow_schema(self) -> Any:
+        pyarrow = self._pyarrow
+        fields = []
+        for field in self._fields:
+            value_type = _arrow_type(pyarrow, field.dtype)
+            fields.append(pyarrow.field(
+                field.name, value_type if field.scalar else pyarrow.list_(value_type)))
+        fields.append(pyarrow.field('event_id', pyarrow.string()))
+        fields.append(pyarrow.field('inference_time', pyarrow.timestamp('ms', tz='UTC')))
+        return pyarrow.schema(fields)
+
+    def add(self, request: Request):
+        """Buffer a request, write a row group when enough rows are buffered."""
+        for field, values in zip(self._fields, self._columns):
+            data = getattr(request, field.side)[field.index].data
+            values.append(data if field.feature is None else data[field.feature])
+        self._event_ids.append(request.metadata.event_id)
+        self._inference_times.append(request.metadata.inference_time)
+        if self.date is None:
+            self.date = request.metadata.inference_time[:10]
+        self.rows += 1
+        if len(self._event_ids) >= self.row_group_rows:
+            self.flush()
+
+    def _array(self, field: _Field, values: List) -> Any:
+        pyarrow = self._pyarrow
+        value_type = _arrow_type(pyarrow, field.dtype)
+        if field.cells and field.scalar:
+            return self._cast_cells(values, field.dtype, value_type)
+        if field.cells:
+            # Cells of CSV mini-batches
+            return pyarrow.array(
+                [[self._cast_cell(cell, field.dtype) for cell in cells] for cells in values],
+                pyarrow.list_(value_type),
+            )
+        if field.scalar:
+            return pyarrow.array([_plain(value) for value in values], value_type)
+        return pyarrow.array(
+            [_plain(value.ravel()) for value in values], pyarrow.list_(value_type))
+
+    def _cast_cells(self, cells: List[str], dtype: str, value_type: Any) -> Any:
+        """Convert CSV cells with Arrow casts, which treat NA values as nulls."""
+        pyarrow = self._pyarrow
+        array = pyarrow.array(cells, pyarrow.string())
+        if value_type == pyarrow.string():
+            return array
+        compute = pyarrow.compute
+        nulls = compute.is_in(
+            compute.utf8_trim_whitespace(array),
+            value_set=pyarrow.array(sorted(dtypes.NA_VALUES)),
+        )
+        array = compute.if_else(nulls, pyarrow.scalar(None, pyarrow.string()), array)
+        try:
+            return array.cast(value_type)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+            return pyarrow.array([self._cast_cell(cell, dtype) for cell in cells], value_type)
+
+    @staticmethod
+    def _cast_cell(cell: str, dtype: str) -> Any:
+        if cell.strip() in dtypes.NA_VALUES and dtype != 'string':
+            return None
+        try:
+            value = dtypes.cast(cell, dtype)
+        except ValueError:
+            return None
+        return value.decode() if isinstance(value, bytes) else value
+
+    def flush(self):
+        """Write buffered rows as a row group."""
+        if not self._event_ids:
+            return
+        pyarrow = self._pyarrow
+        arrays = [self._array(field, values) for field, values in zip(self._fields, self._columns)]
+        arrays.append(pyarrow.array(self._event_ids, pyarrow.string()))
+        arrays.append(pyarrow.array(self._inference_times, pyarrow.string())
+                      .cast(pyarrow.timestamp('ms', tz='UTC')))
+        table = pyarrow.Table.from_arrays(arrays, schema=self._schema)
+        if self._writer is None:
+            self._file = tempfile.TemporaryFile()
+            if self.file_format == PARQUET:
+                self._writer = pyarrow.parquet.ParquetWriter(self._file, self._schema)
+            else:
+                self._writer = pyarrow.ipc.new_file(self._file, self._schema)
+        self._writer.write_table(table)
+        self._columns = [[] for _ in self._fields]
+        self._event_ids, self._inference_times = [], []
+
+    def upload(
+            self,
+            bucket: str,
+            prefix: str,
+            model_name: str,
+            capture_key: str,
+            session: Union[boto3.Session, botocore.session.Session, None] = None,
+    ) -> Union[str, None]:
+        """Finish the file and stream it to S3. Return its key, if any rows were exported."""
+        self.flush()
+        if self._writer is None:
+            return None
+        self._writer.close()
+        self._writer = None
+        key = export_key(prefix, model_name, self.date, capture_key, self.file_format)
+        s3_client = AWSClientFactory.get_or_create_client('s3', session or boto3.Session())
+        with self._file:
+            self._file.seek(0)
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=self._file,
+                ContentType='application/octet-stream',
+            )
+        logger.info("Exported %d rows to s3://%s/%s", self.rows, bucket, key)
+        return key
+
+
+def _plain(value: Any) -> Any:
+    """Convert NumPy values to Python ones, which Arrow arrays are built of."""
+    return value.tolist() if hasattr(value, 'tolist') else value
@@ -1,31 +1,177 @@
 """
 Lambda function shadowing traffic from SageMaker models to the Hydrosphere platform.
+
+The module is kept cheap to import: heavy dependencies are loaded on the
+paths which need them, and the AWS session, S3 client and gRPC channel are
+created by `init` on the first invocation and reused by the following ones.
 """
 import logging
 import json
 import os
-from typing import Dict, Any, Union
+import time
+from collections import Counter
+from itertools import chain
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Tuple, Union
+import grpc
 import boto3
 import botocore
+from src.clients import AWSClientFactory, RPCStubFactory, parse_endpoints
+from src.model import Model, send_concurrently
 from src.model_pool import ModelPool
 from src.data import Record, Request, Contract
-from src import log  # pylint: disable=unused-import
+from src.spool import Spool, SpoolReader
+from src.sampling import Sampler, parse_sampling_rates, extract_event_id
+from src.dedup import ObjectIdentity, ProcessedObjectLog, ObjectMarkers, BloomFilter
+from src import decoders
+from src import export
+from src import lines
+from src import loader
+from src import log
+from src import metrics
+from src import profiling
+from src import projection
+from src import sinks
+from src import summary
+from src import errors
 from src import utils
 from src.utils import S3Utils
 
-logger = logging.getLogger(__name__)
+logger = logging.getLogger('main')
+rows_logger = log.RowLogger(logger)
 
 S3_DATA_CAPTURE_BUCKET = os.environ['S3_DATA_CAPTURE_BUCKET']
 S3_DATA_CAPTURE_PREFIX = os.environ['S3_DATA_CAPTURE_PREFIX']
 S3_DATA_TRAINING_BUCKET = os.environ['S3_DATA_TRAINING_BUCKET']
 S3_DATA_TRAINING_PREFIX = os.environ['S3_DATA_TRAINING_PREFIX']
-HYDROSPHERE_ENDPOINT = os.environ['HYDROSPHERE_ENDPOINT']
+# The first endpoint is the primary cluster, others receive copies of its traffic
+HYDROSPHERE_ENDPOINTS = parse_endpoints(os.environ['HYDROSPHERE_ENDPOINT'])
+HYDROSPHERE_ENDPOINT, MIRROR_ENDPOINTS = HYDROSPHERE_ENDPOINTS[0], HYDROSPHERE_ENDPOINTS[1:]
+S3_SPOOL_BUCKET = os.environ.get('S3_SPOOL_BUCKET', '')
+S3_SPOOL_PREFIX = os.environ.get('S3_SPOOL_PREFIX', 'hydrosphere/spool')
+ANALYZE_CONCURRENCY = int(os.environ.get('ANALYZE_CONCURRENCY', '8'))
+ANALYZE_TIMEOUT = float(os.environ.get('ANALYZE_TIMEOUT', '5'))
+ANALYZE_BREAKER_THRESHOLD = int(os.environ.get('ANALYZE_BREAKER_THRESHOLD', '5'))
+# Time left, when spooled messages are written and Hydrosphere isn't called anymore
+DEADLINE_MARGIN_MS = int(os.environ.get('DEADLINE_MARGIN_MS', '15000'))
+REPLAY_BATCH_SIZE = int(os.environ.get('REPLAY_BATCH_SIZE', '100'))
+SAMPLING_RATE = parse_sampling_rates(os.environ.get('SAMPLING_RATE', '1.0'))
+S3_DEDUP_MARKER_PREFIX = os.environ.get('S3_DEDUP_MARKER_PREFIX', '')
+DEDUP_CACHE_SIZE = int(os.environ.get('DEDUP_CACHE_SIZE', '4096'))
+DEDUP_FILTER_CAPACITY = int(os.environ.get('DEDUP_FILTER_CAPACITY', '100000'))
+DEDUP_FILTER_ERROR_RATE = float(os.environ.get('DEDUP_FILTER_ERROR_RATE', '0.0001'))
+S3_SELECT = os.environ.get('S3_SELECT', 'false').lower() in ('1', 'true', 'yes')
+MINI_BATCH_MODE = decoders.parse_batch_modes(os.environ.get('MINI_BATCH_MODE', decoders.EXPLODE))
+NARROW_DTYPES = os.environ.get('NARROW_DTYPES', 'false').lower() in ('1', 'true', 'yes')
+PACK_FEATURES = os.environ.get('PACK_FEATURES', 'false').lower() in ('1', 'true', 'yes')
+FEATURE_PROJECTION = projection.parse_projections(os.environ.get('FEATURE_PROJECTION', ''))
+SHADOWING_MODE = summary.parse_shadowing_modes(os.environ.get('SHADOWING_MODE', summary.ROWS))
+SUMMARY_SAMPLE_ROWS = int(os.environ.get('SUMMARY_SAMPLE_ROWS', '100'))
+S3_EXPORT_BUCKET = os.environ.get('S3_EXPORT_BUCKET', '')
+S3_EXPORT_PREFIX = os.environ.get('S3_EXPORT_PREFIX', 'hydrosphere/export')
+EXPORT_FORMAT = os.environ.get('EXPORT_FORMAT', export.PARQUET)
+EXPORT_ROW_GROUP_ROWS = int(os.environ.get('EXPORT_ROW_GROUP_ROWS', '10000'))
+SINK = sinks.parse_sink(os.environ.get('SINK', sinks.GRPC))
+SINK_URI = os.environ.get('SINK_URI', '')
+SINK_COMPRESSION = os.environ.get('SINK_COMPRESSION', 'gzip')
+SINK_MAX_BYTES = int(os.environ.get('SINK_MAX_BYTES', str(32 * 1024 * 1024)))
+LOAD_CONCURRENCY = int(os.environ.get('LOAD_CONCURRENCY', '64'))
+MODEL_CACHE_TTL = float(os.environ.get('MODEL_CACHE_TTL', '300'))
+WARMUP_MAX_MODELS = int(os.environ.get('WARMUP_MAX_MODELS', '10'))
+WARMUP_LOOKBACK_HOURS = int(os.environ.get('WARMUP_LOOKBACK_HOURS', '24'))
 
 logger.debug('%s=%s', 'S3_DATA_CAPTURE_BUCKET', S3_DATA_CAPTURE_BUCKET)
 logger.debug('%s=%s', 'S3_DATA_CAPTURE_PREFIX', S3_DATA_CAPTURE_PREFIX)
 logger.debug('%s=%s', 'S3_DATA_TRAINING_BUCKET', S3_DATA_TRAINING_BUCKET)
 logger.debug('%s=%s', 'S3_DATA_TRAINING_PREFIX', S3_DATA_TRAINING_PREFIX)
 logger.debug('%s=%s', 'HYDROSPHERE_ENDPOINT', HYDROSPHERE_ENDPOINT)
+logger.debug('%s=%s', 'MIRROR_ENDPOINTS', MIRROR_ENDPOINTS)
+logger.debug('%s=%s', 'S3_SPOOL_BUCKET', S3_SPOOL_BUCKET)
+logger.debug('%s=%s', 'S3_SPOOL_PREFIX', S3_SPOOL_PREFIX)
+logger.debug('%s=%s', 'ANALYZE_TIMEOUT', ANALYZE_TIMEOUT)
+logger.debug('%s=%s', 'ANALYZE_BREAKER_THRESHOLD', ANALYZE_BREAKER_THRESHOLD)
+logger.debug('%s=%s', 'SAMPLING_RATE', SAMPLING_RATE)
+logger.debug('%s=%s', 'S3_DEDUP_MARKER_PREFIX', S3_DEDUP_MARKER_PREFIX)
+logger.debug('%s=%s', 'S3_SELECT', S3_SELECT)
+logger.debug('%s=%s', 'MINI_BATCH_MODE', MINI_BATCH_MODE)
+logger.debug('%s=%s', 'NARROW_DTYPES', NARROW_DTYPES)
+logger.debug('%s=%s', 'PACK_FEATURES', PACK_FEATURES)
+logger.debug('%s=%s', 'FEATURE_PROJECTION', FEATURE_PROJECTION)
+logger.debug('%s=%s', 'SHADOWING_MODE', SHADOWING_MODE)
+logger.debug('%s=%s', 'SUMMARY_SAMPLE_ROWS', SUMMARY_SAMPLE_ROWS)
+logger.debug('%s=%s', 'S3_EXPORT_BUCKET', S3_EXPORT_BUCKET)
+logger.debug('%s=%s', 'S3_EXPORT_PREFIX', S3_EXPORT_PREFIX)
+logger.debug('%s=%s', 'EXPORT_FORMAT', EXPORT_FORMAT)
+logger.debug('%s=%s', 'SINK', SINK)
+logger.debug('%s=%s', 'SINK_URI', SINK_URI)
+logger.debug('%s=%s', 'SINK_COMPRESSION', SINK_COMPRESSION)
+
+# Failures, which are worth retrying in S3 Batch Operations jobs
+TRANSIENT_ERRORS = (
+    errors.ApiNotAvailable, errors.AnalysisFailed, grpc.RpcError,
+    botocore.exceptions.ConnectionError,
+)
+
+# Invocation counters reported as metrics
+METRIC_COUNTERS = {
+    'requests': 'Requests',
+    'sampled': 'Sampled',
+    'dropped': 'Dropped',
+    'spooled': 'Spooled',
+    'rejected': 'Rejected',
+    'duplicates': 'Duplicates',
+    'duplicate_rows': 'DuplicateRows',
+    'summarized': 'Summarized',
+    'exported': 'Exported',
+    'archived': 'Archived',
+    'discarded': 'Discarded',
+    'mirrored': 'Mirrored',
+}
+
+# Survive between warm invocations of the same container
+PROCESSED_OBJECTS = ProcessedObjectLog(DEDUP_CACHE_SIZE)
+SESSION = None
+# Model name -> (resolution time, contract, (name, version, model_version_id))
+RESOLVED_MODELS: Dict[str, Tuple[float, Contract, Tuple[str, int, int]]] = {}
+# (Mirror endpoint, model name) -> (resolution time, (name, version, model_version_id)),
+# the identity is None if the mirror failed to resolve the model
+MIRRORED_MODELS: Dict[Tuple[str, str], Tuple[float, Union[Tuple[str, int, int], None]]] = {}
+
+
+def init(
+        session: Union[boto3.Session, botocore.session.Session, None] = None
+) -> Union[boto3.Session, botocore.session.Session]:
+    """
+    Initialize the container: configure logging, create the AWS session
+    with its S3 client and gRPC channels to Hydrosphere clusters. Subsequent
+    calls reuse the existing session, unless another one is given.
+    """
+    global SESSION  # pylint: disable=global-statement
+    if SESSION is None:
+        log.configure()
+    if session is not None or SESSION is None:
+        SESSION = session or boto3.Session()
+        AWSClientFactory.get_or_create_client('s3', SESSION)
+        for endpoint in HYDROSPHERE_ENDPOINTS:
+            RPCStubFactory.get_or_create_channel(endpoint)
+    return SESSION
+
+
+@dataclass
+class Invocation:
+    """State shared by all capture files processed within one invocation."""
+    session: Union[boto3.Session, botocore.session.Session]
+    s3_utils: S3Utils
+    model_pool: ModelPool
+    markers: Union[ObjectMarkers, None] = None
+    counters: Counter = field(default_factory=Counter)
+    resolved: Dict[str, Tuple[Contract, Model]] = field(default_factory=dict)
+    # Pools of mirror clusters and models resolved in them, by model name
+    mirrors: List[ModelPool] = field(default_factory=list)
+    mirrored: Dict[str, List[Model]] = field(default_factory=dict)
+    # Lambda context, which tells the time left to the invocation
+    context: Any = None
+    deadline_reached: bool = False
 
 
 def lambda_handler(
@@ -34,39 +180,568 @@ def lambda_handler(
         session: Union[boto3.Session, botocore.session.Session, None] = None
 ) -> Dict:
     """
-    AWS Lambda function handler.
+    AWS Lambda function handler. Accepts S3 notifications delivered either
+    directly or through an SQS queue, S3 Batch Operations jobs and replay
+    requests, and warm-up pings. Metrics of the invocation are emitted in
+    the end as a single EMF log line. A sample of invocations may be profiled, see `src.profiling`.
     """
+    if SESSION is None:
+        init()
+    session = session or SESSION
+    request_id = getattr(context, 'aws_request_id', None)
+    log.bind(requestId=request_id)
+    collector = metrics.start()
+    profiler = profiling.Profiler.from_env(request_id, session)
+    try:
+        with profiler:
+            if _is_warmup(event):
+                return warmup_handler(event, context, session)
+            if event.get('action') == 'replay':
+                return replay_handler(event, context, session)
+            if event.get('action') == 'load':
+                return load_handler(event, context, session)
+            if 'invocationSchemaVersion' in event:
+                return batch_operations_handler(event, context, session)
+            return notifications_handler(event, context, session)
+    finally:
+        collector.emit()
+        log.flush()
+
+
+def notifications_handler(
+        event: Dict,
+        context: Any,
+        session: Union[boto3.Session, botocore.session.Session, None] = None
+) -> Dict:
+    """Shadow capture files referenced by S3 notifications."""
     session = session or boto3.Session()
-    s3_utils = S3Utils(session)
-    model_pool = ModelPool(HYDROSPHERE_ENDPOINT)
-
-    total_requests = 0
-    for i, event_record in enumerate(event.get('Records')):
-        logger.debug("%d/%d | Scanning through record %s", i, len(event.get('Records')), event)
-        capture_record = Record.from_event_record(event_record, session)
-        model_name = utils.parse_model_name(
-            S3_DATA_CAPTURE_PREFIX, capture_record.key
-        )
-        training_file_uri = s3_utils.get_largest_csv(
-            S3_DATA_TRAINING_BUCKET, S3_DATA_TRAINING_PREFIX, model_name
-        )
-        train_record = Record(*utils.parse_s3_uri(training_file_uri), session)
-        contract = Contract(capture_record, train_record, session)
-
-        model = model_pool.get_or_create_model(
-            model_name, contract.schema, training_file_uri
-        )
-        j = 0
-        for j, data in enumerate(capture_record.read()):
-            logger.debug("Reading %d request", j)
-            request = Request.from_dict(json.loads(data), contract.schema)
+    spool = Spool(S3_SPOOL_BUCKET, S3_SPOOL_PREFIX, session) if S3_SPOOL_BUCKET else None
+    sink = sinks.create(SINK, SINK_URI, SINK_COMPRESSION, SINK_MAX_BYTES, session,
+                        ANALYZE_TIMEOUT, ANALYZE_BREAKER_THRESHOLD)
+    invocation = Invocation(
+        session=session,
+        s3_utils=S3Utils(session),
+        model_pool=ModelPool(HYDROSPHERE_ENDPOINT, spool, sink),
+        markers=ObjectMarkers(S3_DATA_CAPTURE_BUCKET, S3_DEDUP_MARKER_PREFIX, session)
+        if S3_DEDUP_MARKER_PREFIX else None,
+        mirrors=_mirror_pools(),
+        context=context,
+    )
+    counters = invocation.counters
+
+    records = event.get('Records', [])
+    batch_item_failures = None
+    try:
+        if records and records[0].get('eventSource') == 'aws:sqs':
+            batch_item_failures = _process_messages(records, invocation)
+        else:
+            _process_records(records, invocation)
+    finally:
+        _flush(invocation, spool)
+        _record_counters(counters)
+
+    logger.info("Sampled %d requests, dropped %d requests",
+                counters['sampled'], counters['dropped'])
+    response = {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Processed %d requests' % counters['requests'],
+            'detail': counters['requests'],
+            'sampled': counters['sampled'],
+            'dropped': counters['dropped'],
+            'spooled': counters['spooled'],
+            'duplicates': counters['duplicates'],
+            'duplicate_rows': counters['duplicate_rows'],
+        })
+    }
+    if batch_item_failures is not None:
+        response['batchItemFailures'] = batch_item_failures
+    return response
+
+
+def _mirror_pools() -> List[ModelPool]:
+    """Create a model pool for every mirror cluster, sending through a mirror sink."""
+    return [
+        ModelPool(endpoint, sink=sinks.MirrorSink(endpoint, ANALYZE_CONCURRENCY))
+        for endpoint in MIRROR_ENDPOINTS
+    ]
+
+
+def _flush(invocation: Invocation, spool: Union[Spool, None]):
+    """
+    Wait for mirrors, write messages buffered by the sink and the spool in
+    the end of an invocation.
+    """
+    counters = invocation.counters
+    pools = invocation.mirrors + [invocation.model_pool]
+    try:
+        for pool in pools:
+            pool.sink.flush()
+    finally:
+        for pool in pools:
+            if pool.sink.counter is not None:
+                counters[pool.sink.counter] += pool.sink.count
+        if spool is not None:
+            counters['spooled'] += len(spool)
+            spool.flush()
+
+
+def _check_deadline(invocation: Invocation):
+    """
+    Write spooled messages and stop calling Hydrosphere, when the invocation
+    is about to time out. Following rows go to the spool right away, so
+    neither they nor the rows spooled before are lost to the timeout.
+    """
+    if invocation.deadline_reached or invocation.context is None:
+        return
+    remaining = getattr(invocation.context, 'get_remaining_time_in_millis', None)
+    if remaining is None or remaining() > DEADLINE_MARGIN_MS:
+        return
+    invocation.deadline_reached = True
+    pool = invocation.model_pool
+    if pool.spool is None:
+        return
+    logger.warning("The invocation is about to time out, spooling remaining requests")
+    if isinstance(pool.sink, sinks.GrpcSink):
+        pool.sink.breaker.trip("the invocation is about to time out")
+    invocation.counters['spooled'] += len(pool.spool)
+    pool.spool.flush()
+
+
+def _record_counters(counters: Counter):
+    """Report invocation counters as metrics."""
+    collector = metrics.current()
+    for name, metric in METRIC_COUNTERS.items():
+        collector.increment(metric, counters[name])
+
+
+def _process_messages(messages: List[Dict], invocation: Invocation) -> List[Dict]:
+    """
+    Shadow capture files referenced by S3 notifications wrapped into SQS
+    messages. Return identifiers of messages, which failed to be processed,
+    so that only they are delivered again.
+    """
+    failures = []
+    for message in messages:
+        try:
+            body = json.loads(message['body'])
+            if body.get('Event') == 's3:TestEvent':
+                logger.info("Skipping S3 test event")
+                continue
+            _process_records(body.get('Records', []), invocation)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to process message %s", message.get('messageId'))
+            failures.append({'itemIdentifier': message['messageId']})
+    return failures
+
+
+def _process_records(records: List[Dict], invocation: Invocation):
+    """Shadow all capture files referenced by S3 event records."""
+    for i, event_record in enumerate(records):
+        logger.debug("%d/%d | Scanning through record", i + 1, len(records))
+        _process_capture_file(event_record, invocation)
+
+
+def _resolve(model_name: str, capture_record: Record, invocation: Invocation) -> Tuple[Contract, Model]:
+    """
+    Infer the contract and find or register the model. The result is reused
+    by all capture files of the same model within the invocation, and by
+    the following invocations of the container for `MODEL_CACHE_TTL` seconds.
+    """
+    if model_name not in invocation.resolved:
+        cached = RESOLVED_MODELS.get(model_name)
+        if cached is not None and time.monotonic() - cached[0] < MODEL_CACHE_TTL:
+            _, contract, identity = cached
+            model = invocation.model_pool.make_model(*identity)
+        else:
+            training_file_uri = invocation.s3_utils.get_largest_csv(
+                S3_DATA_TRAINING_BUCKET, S3_DATA_TRAINING_PREFIX, model_name
+            )
+            train_record = Record(*utils.parse_s3_uri(training_file_uri), invocation.session)
+            batched = decoders.batch_mode(MINI_BATCH_MODE, model_name) == decoders.BATCH
+            contract = Contract(
+                capture_record, train_record, invocation.session, batched, NARROW_DTYPES,
+                PACK_FEATURES, projection.for_model(FEATURE_PROJECTION, model_name))
+            model = invocation.model_pool.get_or_create_model(
+                model_name, contract.schema, training_file_uri, check_contract=contract.adjusted
+            )
+            RESOLVED_MODELS[model_name] = (
+                time.monotonic(), contract, (model.name, model.version, model.model_version_id)
+            )
+        invocation.resolved[model_name] = (contract, model)
+    return invocation.resolved[model_name]
+
+
+def _resolve_mirrors(model_name: str, contract: Contract, invocation: Invocation) -> List[Model]:
+    """
+    Find or register the model in every mirror cluster with the contract of
+    the primary one. A mirror, which fails to resolve the model, is skipped
+    for `MODEL_CACHE_TTL` seconds without failing the capture file.
+    """
+    if model_name not in invocation.mirrored:
+        models = []
+        for pool in invocation.mirrors:
+            cached = MIRRORED_MODELS.get((pool.endpoint, model_name))
+            if cached is not None and time.monotonic() - cached[0] < MODEL_CACHE_TTL:
+                if cached[1] is not None:
+                    models.append(pool.make_model(*cached[1]))
+                continue
+            identity = None
+            try:
+                training_file_uri = invocation.s3_utils.get_largest_csv(
+                    S3_DATA_TRAINING_BUCKET, S3_DATA_TRAINING_PREFIX, model_name
+                )
+                model = pool.get_or_create_model(
+                    model_name, contract.schema, training_file_uri, check_contract=contract.adjusted)
+                identity = (model.name, model.version, model.model_version_id)
+                models.append(model)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Model %s won't be mirrored to %s", model_name, pool.endpoint)
+            MIRRORED_MODELS[(pool.endpoint, model_name)] = (time.monotonic(), identity)
+        invocation.mirrored[model_name] = models
+    return invocation.mirrored[model_name]
+
+
+def _analyse(request: Request, model: Model, mirrors: List[Model]) -> bool:
+    """
+    Send a request to the primary cluster and its mirrors. The target
+    independent part of the message is encoded once and shared by all.
+    Return False, if a value of the request doesn't fit the contract and
+    the request is skipped.
+    """
+    try:
+        if not mirrors:
             model.analyse(request)
-        total_requests += j
+            return True
+        with metrics.current().timer('TensorBuild'):
+            shared = model.encode_shared(request)
+    except errors.ValueOutOfRange as error:
+        logger.warning("Skipping request %s: %s", request.metadata.event_id, error)
+        return False
+    model.analyse(request, shared)
+    for mirror in mirrors:
+        mirror.analyse(request, shared)
+    return True
+
+
+def _process_capture_file(event_record: Dict, invocation: Invocation):
+    """Shadow a single capture file referenced by an S3 event record."""
+    counters, markers = invocation.counters, invocation.markers
+    identity = ObjectIdentity.from_event_record(event_record)
+    if identity in PROCESSED_OBJECTS or (markers and markers.exists(identity)):
+        logger.info("Skipping already processed s3://%s/%s", identity.bucket, identity.key)
+        counters['duplicates'] += 1
+        return
+    logger.debug("Processing s3://%s/%s", identity.bucket, identity.key)
+
+    capture_record = Record.from_event_record(event_record, invocation.session)
+    model_name = utils.parse_model_name(
+        S3_DATA_CAPTURE_PREFIX, capture_record.key
+    )
+    collector = metrics.current()
+    collector.set_model(model_name)
+    contract, model = _resolve(model_name, capture_record, invocation)
+    mirrors = _resolve_mirrors(model_name, contract, invocation)
+
+    sampler = Sampler.for_model(SAMPLING_RATE, model_name)
+    summarizer = None
+    if summary.shadowing_mode(SHADOWING_MODE, model_name) == summary.SUMMARY:
+        summarizer = summary.Summarizer(contract.schema, SUMMARY_SAMPLE_ROWS)
+    exporter = None
+    if S3_EXPORT_BUCKET and summarizer is None:
+        try:
+            exporter = export.Exporter(contract.schema, EXPORT_FORMAT, EXPORT_ROW_GROUP_ROWS)
+        except errors.UnsupportedFormat:
+            logger.exception("Capture data of %s model won't be exported", model_name)
+    seen_events = BloomFilter(DEDUP_FILTER_CAPACITY, DEDUP_FILTER_ERROR_RATE)
+    if S3_SELECT:
+        batches = capture_record.select_batches()
+    else:
+        batches = capture_record.read_batches()
+    # Lines are views over the read buffer, valid until the next batch is read
+    for j, data in enumerate(chain.from_iterable(batches)):
+        event_id = extract_event_id(data)
+        if event_id is not None and not seen_events.add(event_id):
+            counters['duplicate_rows'] += 1
+            continue
+        if summarizer is not None:
+            with collector.timer('Summarize'):
+                summarizer.add(data)
+            continue
+        if not sampler.accept(data):
+            continue
+        if rows_logger.enabled:
+            rows_logger.debug("Reading %d request", j)
+        _check_deadline(invocation)
+        with collector.timer('Parse'):
+            requests = Request.from_dict_rows(lines.loads(data), contract.schema)
+        counters['requests'] += len(requests)
+        for request in requests:
+            if not _analyse(request, model, mirrors):
+                counters['rejected'] += 1
+                continue
+            if exporter is not None:
+                exporter.add(request)
+    if seen_events.full:
+        logger.info("s3://%s/%s has over %d events, duplicates of later ones weren't dropped",
+                    capture_record.bucket, capture_record.key, DEDUP_FILTER_CAPACITY)
+    if exporter is not None:
+        _export(exporter, capture_record, model_name, invocation)
+    if summarizer is not None:
+        _shadow_summary(summarizer, capture_record, model_name, model, mirrors, invocation)
+    counters['sampled'] += sampler.sampled
+    counters['dropped'] += sampler.dropped
+
+    PROCESSED_OBJECTS.add(identity)
+    if markers is not None:
+        markers.mark(identity)
+
+
+def _export(exporter: export.Exporter, capture_record: Record, model_name: str,
+            invocation: Invocation):
+    """
+    Upload the columnar export of a capture file. The export doesn't fail
+    shadowing, since rows are sent to Hydrosphere already.
+    """
+    try:
+        with metrics.current().timer('Export'):
+            exporter.upload(S3_EXPORT_BUCKET, S3_EXPORT_PREFIX, model_name,
+                            capture_record.key, invocation.session)
+        invocation.counters['exported'] += exporter.rows
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Failed to export s3://%s/%s", capture_record.bucket, capture_record.key)
+
+
+def _shadow_summary(
+        summarizer: summary.Summarizer,
+        capture_record: Record,
+        model_name: str,
+        model: Model,
+        mirrors: List[Model],
+        invocation: Invocation,
+):
+    """Store the summary of a capture file and shadow its sample of rows."""
+    document = summarizer.summary(model_name, capture_record.key)
+    summary.store(document, capture_record.bucket, capture_record.key, invocation.session)
+    for line in summarizer.sample_lines():
+        _check_deadline(invocation)
+        requests = Request.from_dict_rows(lines.loads(line), summarizer.schema)
+        invocation.counters['requests'] += len(requests)
+        for request in requests:
+            if not _analyse(request, model, mirrors):
+                invocation.counters['rejected'] += 1
+    invocation.counters['summarized'] += summarizer.rows
+
+
+def _bad_request(message: str) -> Dict:
+    """Respond to an event, which the configuration of the function can't serve."""
+    logger.error(message)
+    return {
+        'statusCode': 400,
+        'body': json.dumps({'message': message}),
+    }
+
+
+def _is_warmup(event: Dict) -> bool:
+    """Check whether the event is a warm-up ping, e.g. from a scheduled rule."""
+    return event.get('action') == 'warmup' or event.get('source') == 'aws.events'
+
+
+def warmup_handler(
+        event: Dict,
+        context: Any,   # pylint: disable=unused-argument
+        session: Union[boto3.Session, botocore.session.Session, None] = None
+) -> Dict:
+    """
+    Prepare the container for incoming capture files without shadowing any
+    data. Clients and gRPC channels are created by `init`; contracts and
+    models of endpoints, which captured requests recently, are resolved in
+    all clusters and cached. An optional `models` list in the event narrows
+    the set down.
+    """
+    session = session or boto3.Session()
+    invocation = Invocation(
+        session=session,
+        s3_utils=S3Utils(session),
+        model_pool=ModelPool(HYDROSPHERE_ENDPOINT),
+        mirrors=_mirror_pools(),
+    )
+    captures = invocation.s3_utils.find_recent_captures(
+        S3_DATA_CAPTURE_BUCKET, S3_DATA_CAPTURE_PREFIX, WARMUP_LOOKBACK_HOURS
+    )
+    if event.get('models'):
+        captures = {name: key for name, key in captures.items() if name in event['models']}
+
+    warmed, failed = [], []
+    for model_name, key in list(captures.items())[:WARMUP_MAX_MODELS]:
+        try:
+            RESOLVED_MODELS.pop(model_name, None)
+            for endpoint in MIRROR_ENDPOINTS:
+                MIRRORED_MODELS.pop((endpoint, model_name), None)
+            contract, _ = _resolve(model_name, Record(S3_DATA_CAPTURE_BUCKET, key, session), invocation)
+            _resolve_mirrors(model_name, contract, invocation)
+            warmed.append(model_name)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to warm up model %s", model_name)
+            failed.append(model_name)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Warmed up %d models' % len(warmed),
+            'models': warmed,
+            'failed': failed,
+        })
+    }
+
+
+def batch_operations_handler(
+        event: Dict,
+        context: Any,
+        session: Union[boto3.Session, botocore.session.Session, None] = None
+) -> Dict:
+    """
+    Handle an S3 Batch Operations job event, used for backfilling the capture
+    history. Every task references one capture file; the result of each task
+    is reported in the format expected by S3 Batch Operations.
+    """
+    session = session or boto3.Session()
+    spool = Spool(S3_SPOOL_BUCKET, S3_SPOOL_PREFIX, session) if S3_SPOOL_BUCKET else None
+    sink = sinks.create(SINK, SINK_URI, SINK_COMPRESSION, SINK_MAX_BYTES, session,
+                        ANALYZE_TIMEOUT, ANALYZE_BREAKER_THRESHOLD)
+    invocation = Invocation(
+        session=session,
+        s3_utils=S3Utils(session),
+        model_pool=ModelPool(HYDROSPHERE_ENDPOINT, spool, sink),
+        mirrors=_mirror_pools(),
+        context=context,
+    )
+
+    results = []
+    try:
+        for task in event.get('tasks', []):
+            try:
+                _process_capture_file(utils.batch_task_to_event_record(task), invocation)
+                result_code, result_string = 'Succeeded', 'Shadowed'
+            except Exception as error:  # pylint: disable=broad-except
+                if _is_transient(error):
+                    logger.exception("Task %s failed, it will be retried", task['taskId'])
+                    result_code = 'TemporaryFailure'
+                else:
+                    logger.exception("Task %s failed permanently", task['taskId'])
+                    result_code = 'PermanentFailure'
+                result_string = str(error)
+            results.append({
+                'taskId': task['taskId'],
+                'resultCode': result_code,
+                'resultString': result_string[:1024],
+            })
+    finally:
+        _flush(invocation, spool)
+        _record_counters(invocation.counters)
+
+    return {
+        'invocationSchemaVersion': event['invocationSchemaVersion'],
+        'treatMissingKeysAs': 'PermanentFailure',
+        'invocationId': event['invocationId'],
+        'results': results,
+    }
+
+
+def _is_transient(error: Exception) -> bool:
+    """Check whether processing may succeed, if retried later."""
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    if isinstance(error, botocore.exceptions.ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        code = error.response.get('Error', {}).get('Code', '')
+        return status >= 500 or code in ('SlowDown', 'Throttling', 'RequestTimeout')
+    return False
+
+
+def replay_handler(
+        event: Dict,
+        context: Any,   # pylint: disable=unused-argument
+        session: Union[boto3.Session, botocore.session.Session, None] = None
+) -> Dict:
+    """
+    Drain the dead-letter spool, sending spooled messages to Hydrosphere in
+    batches. Messages, which still can't be delivered, are spooled again
+    and written before their spool file is deleted, so an interrupted
+    replay never loses messages. An optional `prefix` in the event narrows
+    the replay down to a single model or hour partition. Without a spool
+    configured, the event is answered with a 400 status.
+    """
+    # pylint: disable=import-outside-toplevel
+    from hydro_serving_grpc.monitoring.api_pb2 import ExecutionInformation
+    from hydro_serving_grpc.monitoring.api_pb2_grpc import MonitoringServiceStub
+    if not S3_SPOOL_BUCKET:
+        return _bad_request("Nothing to replay, the dead-letter spool isn't configured, see s3_spool_uri")
+    session = session or boto3.Session()
+    reader = SpoolReader(S3_SPOOL_BUCKET, event.get('prefix', S3_SPOOL_PREFIX), session)
+    spool = Spool(S3_SPOOL_BUCKET, S3_SPOOL_PREFIX, session)
+    stub = RPCStubFactory.create_stub(MonitoringServiceStub)
+
+    replayed, failed = 0, 0
+    # Files spooled again by this replay aren't listed again
+    for key in list(reader.list_keys()):
+        logger.info("Replaying s3://%s/%s", S3_SPOOL_BUCKET, key)
+        for batch in utils.batched(reader.read(key), REPLAY_BATCH_SIZE):
+            messages = [ExecutionInformation.FromString(item) for item in batch]
+            rejected = send_concurrently(stub, messages, ANALYZE_CONCURRENCY, ANALYZE_TIMEOUT)
+            for message in rejected:
+                spool.put(message.metadata.model_name, message.SerializeToString())
+            replayed += len(messages) - len(rejected)
+            failed += len(rejected)
+        spool.flush()
+        reader.delete(key)
+    metrics.current().increment('Replayed', replayed)
+    metrics.current().increment('Spooled', failed)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Replayed %d requests' % replayed,
+            'detail': replayed,
+            'spooled': failed,
+        })
+    }
+
+
+def load_handler(
+        event: Dict,
+        context: Any,   # pylint: disable=unused-argument
+        session: Union[boto3.Session, botocore.session.Session, None] = None
+) -> Dict:
+    """
+    Load archives written by the file sink under the `uri` of the event,
+    `SINK_URI` by default, into Hydrosphere. Archives are deleted after
+    loading only if the event asks for it with `delete`; archives with
+    messages, which can't be delivered, are then rewritten to hold only
+    those, so they are loaded again later. Archives, not the spool, keep
+    undelivered messages, so no message is sent twice. Without a `uri`
+    to load, the event is answered with a 400 status.
+    """
+    # pylint: disable=import-outside-toplevel
+    from hydro_serving_grpc.monitoring.api_pb2_grpc import MonitoringServiceStub
+    uri = event.get('uri', SINK_URI)
+    if not uri:
+        return _bad_request("Nothing to load, pass the \"uri\" of archives or configure s3_sink_uri")
+    session = session or boto3.Session()
+    reader = loader.ArchiveReader(uri, session)
+    stub = RPCStubFactory.create_stub(MonitoringServiceStub)
+    loaded, undelivered = loader.load(
+        reader, stub, LOAD_CONCURRENCY, bool(event.get('delete')), ANALYZE_TIMEOUT)
+    failed = sum(undelivered.values())
+    metrics.current().increment('Loaded', loaded)
+    metrics.current().increment('AnalyzeFailures', failed)
 
     return {
         'statusCode': 200,
         'body': json.dumps({
-            'message': 'Processed %d requests' % total_requests,
-            'detail': total_requests
+            'message': 'Loaded %d requests' % loaded,
+            'detail': loaded,
+            'failed': failed,
+            'archives': sorted(undelivered),
         })
     }
@@ -0,0 +1,104 @@
+"""
+This module splits streamed capture bodies into lines without copying them.
+
+Chunks are read into a single reusable buffer and lines are yielded in
+batches of memoryview slices over it. A batch stays valid until the next one
+is requested, so the memory footprint is bounded by the chunk size and the
+longest line, not by the size of the object:
+
+    for batch in iter_line_batches(body):
+        for line in batch:
+            document = loads(line)
+
+JSON lines are decoded with orjson when it's installed, which reads the
+views directly, and with the standard library otherwise.
+"""
+import os
+import json
+from typing import Any, IO, Iterator, List, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+READ_CHUNK_SIZE = int(os.environ.get('READ_CHUNK_SIZE', str(64 * 1024)))
+
+Line = Union[bytes, bytearray, memoryview]
+
+
+def loads(line: Line) -> Any:
+    """Decode a JSON line, given as bytes or a view over them."""
+    if orjson is not None:
+        return orjson.loads(line)
+    if isinstance(line, memoryview):
+        line = line.tobytes()
+    return json.loads(line)
+
+
+def iter_line_batches(
+        stream: IO[bytes],
+        chunk_size: int = READ_CHUNK_SIZE,
+        timer: Any = None,
+) -> Iterator[List[memoryview]]:
+    """
+    Iterate over batches of non-empty lines of a binary stream. Lines are
+    views over an internal buffer without line terminators; they must not
+    be retained beyond the batch, copy them with `bytes(line)` to keep them.
+    Reads are measured with the given timer, if any.
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    start = end = 0
+    while True:
+        if end == len(buffer):
+            if start:
+                # Move the incomplete line to the front of the buffer
+                view[:end - start] = view[start:end]
+                start, end = 0, end - start
+            else:
+                # The line doesn't fit, continue in a larger buffer. The old
+                # one can't be resized, while views over it may be alive.
+                buffer = bytearray(2 * len(buffer))
+                buffer[:end] = view[:end]
+                view = memoryview(buffer)
+        if timer is not None:
+            with timer:
+                read = _read_into(stream, view, end)
+        else:
+            read = _read_into(stream, view, end)
+        if not read:
+            break
+        end += read
+
+        batch = []
+        position = buffer.find(b'\n', start, end)
+        while position != -1:
+            _append_line(batch, view, start, position)
+            start = position + 1
+            position = buffer.find(b'\n', start, end)
+        if batch:
+            yield batch
+        if start == end:
+            start = end = 0
+    batch = []
+    _append_line(batch, view, start, end)
+    if batch:
+        yield batch
+
+
+def _read_into(stream: IO[bytes], view: memoryview, end: int) -> int:
+    """Fill the free tail of the buffer, avoiding a copy when possible."""
+    readinto = getattr(stream, 'readinto', None)
+    if readinto is not None:
+        return readinto(view[end:]) or 0
+    chunk = stream.read(len(view) - end)
+    view[end:end + len(chunk)] = chunk
+    return len(chunk)
+
+
+def _append_line(batch: List[memoryview], view: memoryview, start: int, stop: int):
+    if stop > start and view[stop - 1] == 13:  # strip \r of \r\n
+        stop -= 1
+    if stop > start:
+        batch.append(view[start:stop])
@@ -0,0 +1,176 @@
+"""
+This module loads archives written by the file sink into Hydrosphere.
+
+Archives are listed under s3://<bucket>/<prefix> or a local directory, and
+their messages are sent with RPC method Analyze, keeping up to `concurrency`
+calls in flight on a single channel, each for at most `timeout` seconds.
+Archives are kept after loading unless asked otherwise, so the same archive
+may be loaded into several clusters. Archives own messages, which weren't
+delivered: with `delete`, an archive is deleted once all its messages are
+delivered, or rewritten to hold only the undelivered ones, so loading it
+again sends nothing twice. The Lambda function loads archives on S3 with
+a `{"action": "load", "uri": ...}` event; larger backfills run from any
+machine with access to them:
+
+    python -m src.loader s3://<bucket>/<prefix> --endpoint <url> --concurrency 64 --timeout 5
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from typing import Dict, Iterator, List, Tuple, Union
+import boto3
+import botocore
+from src.clients import AWSClientFactory, RPCStubFactory
+from src.model import send_concurrently
+from src.sinks import ARCHIVE_SUFFIX
+from src.spool import encode_delimited, iter_delimited
+from src import compression
+from src import utils
+
+logger = logging.getLogger('main')
+
+
+def is_archive(key: str) -> bool:
+    """Check whether a key names an archive, plain or compressed."""
+    name = key.rsplit('/', 1)[-1]
+    for extension in ('', '.gz', '.zst'):
+        if name.endswith(ARCHIVE_SUFFIX + extension):
+            return True
+    return False
+
+
+class ArchiveReader:
+    """Lists and reads archives under an s3:// URI or a local directory."""
+    def __init__(
+            self,
+            uri: str,
+            session: Union[boto3.Session, botocore.session.Session, None] = None,
+    ) -> 'ArchiveReader':
+        self.uri = uri
+        self._s3_client = None
+        if uri.startswith('s3://'):
+            self.bucket, self.prefix = utils.parse_s3_uri(uri)
+            self._s3_client = AWSClientFactory.get_or_create_client('s3', session or boto3.Session())
+        else:
+            self.bucket, self.prefix = None, uri
+
+    def list_keys(self) -> Iterator[str]:
+        """Iterate over archives under the URI, oldest partitions first."""
+        if self._s3_client is None:
+            for directory, _, names in sorted(os.walk(self.prefix)):
+                for name in sorted(names):
+                    if is_archive(name):
+                        yield os.path.join(directory, name)
+            return
+        kwargs = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        while True:
+            response = self._s3_client.list_objects_v2(**kwargs)
+            for item in response.get('Contents', []):
+                if is_archive(item['Key']):
+                    yield item['Key']
+            if not response.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def read(self, key: str) -> Iterator[bytes]:
+        """Iterate over serialized messages of a single archive."""
+        if self._s3_client is None:
+            with open(key, 'rb') as file:
+                data = compression.open_stream(file, key).read()
+        else:
+            obj = self._s3_client.get_object(Bucket=self.bucket, Key=key)
+            data = compression.open_stream(obj['Body'], key, obj.get('ContentEncoding')).read()
+        yield from iter_delimited(data)
+
+    def rewrite(self, key: str, payloads: List[bytes]):
+        """Replace an archive with the given messages, keeping its compression."""
+        codec = compression.detect(key)
+        body = compression.compress(b''.join(map(encode_delimited, payloads)), codec)
+        if self._s3_client is None:
+            with open(key + '.part', 'wb') as file:
+                file.write(body)
+            os.replace(key + '.part', key)
+        else:
+            kwargs = {'ContentEncoding': codec} if codec else {}
+            self._s3_client.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=body,
+                ContentType='application/octet-stream',
+                **kwargs,
+            )
+
+    def delete(self, key: str):
+        """Delete a loaded archive."""
+        if self._s3_client is None:
+            os.remove(key)
+        else:
+            self._s3_client.delete_object(Bucket=self.bucket, Key=key)
+
+
+def load(
+        reader: ArchiveReader,
+        stub: 'MonitoringServiceStub',
+        concurrency: int = 64,
+        delete: bool = False,
+        timeout: Union[float, None] = None,
+) -> Tuple[int, Dict[str, int]]:
+    """
+    Send messages of all archives of the reader, one archive at a time.
+    Return the number of delivered messages and the numbers of undelivered
+    ones by archive. When asked to delete, an archive is deleted if all its
+    messages were delivered, and rewritten with the undelivered ones
+    otherwise.
+    """
+    # pylint: disable=import-outside-toplevel
+    from hydro_serving_grpc.monitoring.api_pb2 import ExecutionInformation
+    loaded, undelivered = 0, {}
+    for key in list(reader.list_keys()):
+        logger.info("Loading %s", key)
+        messages = [ExecutionInformation.FromString(item) for item in reader.read(key)]
+        failed = send_concurrently(stub, messages, concurrency, timeout)
+        loaded += len(messages) - len(failed)
+        if failed:
+            logger.warning("%d of %d messages of %s weren't delivered", len(failed), len(messages), key)
+            undelivered[key] = len(failed)
+        if delete and failed:
+            reader.rewrite(key, [message.SerializeToString() for message in failed])
+        elif delete:
+            reader.delete(key)
+    return loaded, undelivered
+
+
+def parse_args(argv: Union[List[str], None] = None) -> argparse.Namespace:
+    # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(description="Load file sink archives into Hydrosphere.")
+    parser.add_argument('uri', help="s3://<bucket>/<prefix> or a local directory with archives")
+    parser.add_argument('--endpoint', default=os.environ.get('HYDROSPHERE_ENDPOINT'),
+                        help="Hydrosphere endpoint, $HYDROSPHERE_ENDPOINT by default")
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help="maximum number of calls in flight")
+    parser.add_argument('--timeout', type=float, default=float(os.environ.get('ANALYZE_TIMEOUT', 5)),
+                        help="deadline of a call in seconds, $ANALYZE_TIMEOUT or 5 by default")
+    parser.add_argument('--delete', action='store_true',
+                        help="delete loaded archives, leave only undelivered messages in the rest")
+    return parser.parse_args(argv)
+
+
+def main(argv: Union[List[str], None] = None) -> int:
+    # pylint: disable=import-outside-toplevel,missing-function-docstring
+    from hydro_serving_grpc.monitoring.api_pb2_grpc import MonitoringServiceStub
+    args = parse_args(argv)
+    if not args.endpoint:
+        print("Hydrosphere endpoint is required, see --endpoint", file=sys.stderr)
+        return 2
+    stub = RPCStubFactory.create_stub(
+        MonitoringServiceStub, RPCStubFactory.get_or_create_channel(args.endpoint))
+    loaded, undelivered = load(ArchiveReader(args.uri), stub, args.concurrency, args.delete, args.timeout)
+    print(json.dumps({'loaded': loaded, 'failed': sum(undelivered.values())}))
+    return 1 if undelivered else 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
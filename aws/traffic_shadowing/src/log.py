@@ -1,23 +1,146 @@
 """
 This module configures logging for the Lambda function.
+
+Logging is configured with environment variables:
+
+    LOG_LEVEL       level of the "main" logger, INFO by default
+    LOG_FORMAT      "json" (default) for one JSON object per line, or "text"
+    LOG_ROW_RATE    per-row debug messages passed through per second, 10 by default
+
+Records are put into a queue by a `QueueHandler`; a listener thread formats
+them and writes them to stdout, so an invocation only pays for enqueueing.
+The queue is drained with `flush` before the invocation returns, because
+a frozen container doesn't run background threads.
+
+Messages emitted for every row go through `RowLogger`, which discards them
+before touching any argument unless DEBUG level is enabled, and passes
+through at most `LOG_ROW_RATE` of them per second otherwise.
 """
-import logging.config
-
-logging.config.dictConfig({
-    'version': 1,
-    'disable_existing_loggers': True,
-    'formatters': {
-        'verbose': {
-            'format': '%(levelname)s %(asctime)s %(module)s %(process)d %(thread)d %(message)s'
-        },
-        'simple': {
-            'format': '%(levelname)s %(message)s'
-        },
-    },
-    'loggers': {
-        'main': {
-            'handlers': [],
-            'level': 'DEBUG',
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+from typing import Any, Dict, Union
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_ROW_RATE = float(os.environ.get('LOG_ROW_RATE', '10'))
+
+TEXT_FORMAT = '%(levelname)s %(asctime)s %(module)s %(thread)d %(message)s'
+
+# Fields added to every JSON record, e.g. the id of the current request
+_fields: Dict[str, Any] = {}
+_listener: Union[logging.handlers.QueueListener, None] = None
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects."""
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            'timestamp': '%s.%03dZ' % (
+                time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)), record.msecs
+            ),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
         }
-    }
-})
+        document.update(_fields)
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records as they are. Unlike the base class, messages are not
+    rendered in the calling thread, but by the listener.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to the current sys.stdout, even if it got replaced."""
+    def emit(self, record: logging.LogRecord):
+        self.stream = sys.stdout
+        super().emit(record)
+
+
+class RowLogger:
+    """
+    Rate-limited logger for messages emitted for every row. Callers check
+    `enabled` before building arguments, which costs a single cached level
+    lookup when DEBUG level is off. Suppressed messages are counted and
+    reported with the next message passed through.
+    """
+    def __init__(self, logger: logging.Logger, rate: float = LOG_ROW_RATE) -> 'RowLogger':
+        self.logger = logger
+        self.rate = rate
+        self._allowance = rate
+        self._checked = time.monotonic()
+        self._suppressed = 0
+
+    @property
+    def enabled(self) -> bool:
+        # pylint: disable=missing-function-docstring
+        return self.logger.isEnabledFor(logging.DEBUG)
+
+    def debug(self, msg: str, *args):
+        """Log a DEBUG message, unless the rate limit is exhausted."""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        now = time.monotonic()
+        self._allowance = min(self.rate, self._allowance + (now - self._checked) * self.rate)
+        self._checked = now
+        if self._allowance < 1:
+            self._suppressed += 1
+            return
+        self._allowance -= 1
+        if self._suppressed:
+            msg, args = msg + ' (%d similar messages suppressed)', args + (self._suppressed,)
+            self._suppressed = 0
+        self.logger.debug(msg, *args)
+
+
+def bind(**fields):
+    """Add fields to every following JSON record. None values are removed."""
+    for name, value in fields.items():
+        if value is None:
+            _fields.pop(name, None)
+        else:
+            _fields[name] = value
+
+
+def configure(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """Configure loggers. Called once, when the container gets initialized."""
+    global _listener  # pylint: disable=global-statement
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+
+        handler = _StdoutHandler()
+        handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, handler)
+        _listener.start()
+
+        logger = logging.getLogger('main')
+        for existing in list(logger.handlers):
+            logger.removeHandler(existing)
+        logger.addHandler(_QueueHandler(records))
+        logger.setLevel(level)
+        logger.propagate = False
+
+
+def flush():
+    """Write out all queued records. Called before the invocation returns."""
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
@@ -0,0 +1,259 @@
+"""
+This module collects per-invocation metrics of the Lambda function and
+emits them in CloudWatch Embedded Metric Format (EMF).
+
+Stages are measured with monotonic timers, events with counters, and RPC
+latencies with log-linear histograms. Everything is accumulated in memory
+and printed as a single EMF JSON line at the end of the invocation, so the
+per-row overhead is limited to a couple of clock reads and dict updates.
+
+    collector = metrics.start()
+    with metrics.current().timer('SchemaInference'):
+        ...
+    collector.emit()
+"""
+import os
+import sys
+import json
+import time
+import threading
+from typing import Dict, IO, Iterator, Tuple, Union
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Hydrosphere/TrafficShadowing')
+ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+PERCENTILES = (50, 90, 99)
+
+_local = threading.local()
+
+
+class Histogram:
+    """
+    Log-linear histogram in the spirit of HdrHistogram. Values below
+    2 ** significant_bits are counted exactly, larger values fall into
+    buckets with a relative width of 2 ** -(significant_bits - 1), so the
+    memory footprint depends on the value range, not on the sample count.
+    """
+    __slots__ = ('significant_bits', 'half', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, significant_bits: int = 5) -> 'Histogram':
+        self.significant_bits = significant_bits
+        self.half = 1 << (significant_bits - 1)
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value: int) -> int:
+        if value < 2 * self.half:
+            return value
+        shift = value.bit_length() - self.significant_bits
+        return 2 * self.half + (shift - 1) * self.half + (value >> shift) - self.half
+
+    def bounds(self, index: int) -> Tuple[int, int]:
+        """Lowest and highest values counted in the bucket."""
+        if index < 2 * self.half:
+            return index, index
+        shift = (index - 2 * self.half) // self.half + 1
+        top = (index - 2 * self.half) % self.half + self.half
+        return top << shift, ((top + 1) << shift) - 1
+
+    def record(self, value: int):
+        """Count a non-negative integer value."""
+        value = int(value) if value > 0 else 0
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram'):
+        """Add counts of another histogram with the same precision."""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, q: float) -> int:
+        """Estimate the value at the given percentile."""
+        if not self.count:
+            return 0
+        threshold = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                return min(self.bounds(index)[1], self.max)
+        return self.max
+
+    def buckets(self) -> Iterator[Tuple[int, int]]:
+        """Iterate over (lowest value, count) pairs of non-empty buckets."""
+        for index in sorted(self.counts):
+            yield self.bounds(index)[0], self.counts[index]
+
+
+class Timer:
+    """Adds the time spent within the block to a stage of the collector."""
+    __slots__ = ('timings', 'name', 'histogram', 'started')
+
+    def __init__(
+            self,
+            timings: Dict[str, int],
+            name: str,
+            histogram: Union[Histogram, None] = None,
+    ) -> 'Timer':
+        self.timings = timings
+        self.name = name
+        self.histogram = histogram
+        self.started = 0
+
+    def __enter__(self) -> 'Timer':
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter_ns() - self.started
+        self.timings[self.name] = self.timings.get(self.name, 0) + elapsed
+        if self.histogram is not None:
+            self.histogram.record(elapsed // 1000)
+
+
+class Collector:
+    """Accumulates metrics of a single invocation."""
+    def __init__(self, namespace: str = NAMESPACE) -> 'Collector':
+        self.namespace = namespace
+        self.started = time.perf_counter_ns()
+        self.models = set()
+        self.timings: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self._timers: Dict[Tuple[str, bool], Timer] = {}
+
+    def timer(self, name: str, histogram: bool = False) -> Timer:
+        """
+        Measure a stage. With `histogram`, the duration of every entry is
+        also recorded into a latency histogram of the same name. Timers are
+        reused, so a stage can't be nested into itself.
+        """
+        timer = self._timers.get((name, histogram))
+        if timer is None:
+            timer = self._timers[(name, histogram)] = Timer(
+                self.timings, name, self._histogram(name) if histogram else None)
+        return timer
+
+    def add_time(self, name: str, nanoseconds: int):
+        # pylint: disable=missing-function-docstring
+        self.timings[name] = self.timings.get(name, 0) + nanoseconds
+
+    def increment(self, name: str, value: int = 1):
+        # pylint: disable=missing-function-docstring
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def _histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def observe(self, name: str, microseconds: int):
+        """Record a latency in microseconds into a histogram."""
+        self._histogram(name).record(microseconds)
+
+    def set_model(self, name: str):
+        """Attribute the invocation to a model."""
+        self.models.add(name)
+
+    def to_emf(self, function_name: Union[str, None] = None) -> Dict:
+        """Render collected metrics as an EMF document."""
+        function_name = function_name or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+        if len(self.models) == 1:
+            model_name = next(iter(self.models))
+        else:
+            model_name = 'multiple' if self.models else 'none'
+
+        document = {'FunctionName': function_name, 'ModelName': model_name}
+        definitions = []
+
+        def put(name, value, unit):
+            document[name] = value
+            definitions.append({'Name': name, 'Unit': unit})
+
+        self.add_time('Invocation', time.perf_counter_ns() - self.started)
+        for name, nanoseconds in sorted(self.timings.items()):
+            put(f"{name}Time", nanoseconds / 1e6, 'Milliseconds')
+        for name, value in sorted(self.counts.items()):
+            put(name, value, 'Count')
+        for name, histogram in sorted(self.histograms.items()):
+            for q in PERCENTILES:
+                put(f"{name}P{q}", histogram.percentile(q) / 1000, 'Milliseconds')
+            put(f"{name}Max", (histogram.max or 0) / 1000, 'Milliseconds')
+            document[f"{name}Histogram"] = {
+                str(low): count for low, count in histogram.buckets()
+            }
+
+        document['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': self.namespace,
+                'Dimensions': [['FunctionName'], ['FunctionName', 'ModelName']],
+                'Metrics': definitions,
+            }],
+        }
+        return document
+
+    def emit(self, stream: Union[IO, None] = None):
+        """Print the EMF document as a single line."""
+        stream = stream or sys.stdout
+        stream.write(json.dumps(self.to_emf(), separators=(',', ':')) + '\n')
+        stream.flush()
+
+
+class NullCollector(Collector):
+    """Collector, which discards everything. Used when metrics are disabled."""
+    class _NullTimer:
+        # pylint: disable=too-few-public-methods
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    _timer = _NullTimer()
+
+    def timer(self, name: str, histogram: bool = False) -> Timer:
+        return self._timer
+
+    def add_time(self, name: str, nanoseconds: int):
+        pass
+
+    def increment(self, name: str, value: int = 1):
+        pass
+
+    def observe(self, name: str, microseconds: int):
+        pass
+
+    def set_model(self, name: str):
+        pass
+
+    def emit(self, stream: Union[IO, None] = None):
+        pass
+
+
+def start() -> Collector:
+    """Start collecting metrics of a new invocation in the current thread."""
+    _local.collector = Collector() if ENABLED else NullCollector()
+    return _local.collector
+
+
+def current() -> Collector:
+    """Collector of the invocation running in the current thread."""
+    collector = getattr(_local, 'collector', None)
+    if collector is None:
+        collector = start()
+    return collector
@@ -1,35 +1,84 @@
 """
 This module provides interface for interacting with Hydrosphere.
+
+Messages of hydro_serving_grpc are imported on first use to keep the cold
+start short. Composed messages are delivered by a sink, see `src.sinks`.
 """
 import logging
+from collections import deque
+from typing import Iterable, List, Union
 
-import hydro_serving_grpc as hs
-from hydro_serving_grpc.monitoring.api_pb2_grpc import MonitoringServiceStub
-from hydro_serving_grpc.monitoring.metadata_pb2 import ExecutionMetadata
-from hydro_serving_grpc.monitoring.api_pb2 import ExecutionInformation
+import grpc
 from src.data import Request
-from src.clients import RPCStubFactory
+from src.sinks import GrpcSink, Sink
+from src.spool import Spool
+from src import errors
+from src import log
+from src import metrics
 
 logger = logging.getLogger('main')
+rows_logger = log.RowLogger(logger)
+
+
+def send_concurrently(
+        stub: 'MonitoringServiceStub',
+        messages: Iterable['ExecutionInformation'],
+        max_in_flight: int = 8,
+        timeout: Union[float, None] = None,
+) -> List['ExecutionInformation']:
+    """
+    Send messages with RPC method Analyze, keeping at most `max_in_flight`
+    calls pending at once, each for at most `timeout` seconds. Return the
+    messages which could not be delivered.
+    """
+    failed = []
+    in_flight = deque()
+
+    def settle():
+        message, future = in_flight.popleft()
+        try:
+            future.result()
+        except grpc.RpcError as error:
+            logger.warning("Failed to analyse a message: %s", error)
+            failed.append(message)
+
+    for message in messages:
+        if len(in_flight) >= max_in_flight:
+            settle()
+        in_flight.append((message, stub.Analyze.future(message, timeout=timeout)))
+    while in_flight:
+        settle()
+    return failed
 
 
 class Model:
     """
     Represents a model registered in Hydrosphere and available operations on it.
     """
-    def __init__(self, name: str, version: int, model_version_id: int) -> 'Model':
+    def __init__(
+            self,
+            name: str,
+            version: int,
+            model_version_id: int,
+            spool: Union[Spool, None] = None,
+            retries: int = 3,
+            sink: Union[Sink, None] = None,
+    ) -> 'Model':
         self.name = name
         self.version = version
         self.model_version_id = model_version_id
         self.signature_name = "predict"
-        self.stub = RPCStubFactory.create_stub(MonitoringServiceStub)
+        self.sink = sink or GrpcSink(retries=retries)
+        self.spool = spool
 
-    def _create_execution_metadata_proto(self, request: Request) -> ExecutionMetadata:
+    def _create_execution_metadata_proto(self, request: Request) -> 'ExecutionMetadata':
         """
         Create an ExecutionMetadata message. ExecutionMetadata is used to define,
         which model, registered within Hydrosphere platform, was used to process
         a given request.
         """
+        # pylint: disable=import-outside-toplevel
+        from hydro_serving_grpc.monitoring.metadata_pb2 import ExecutionMetadata
         return ExecutionMetadata(
             model_name=self.name,
             model_version=self.version,
@@ -38,11 +87,12 @@ class Model:
             request_id=request.metadata.event_id,
         )
 
-    def _create_predict_request_proto(self, request: Request) -> hs.PredictRequest:
+    def _create_predict_request_proto(self, request: Request) -> 'hs.PredictRequest':
         """
         Create a PredictRequest message. PredictRequest is used to define the data
         passed to the model for inference.
         """
+        import hydro_serving_grpc as hs  # pylint: disable=import-outside-toplevel
         return hs.PredictRequest(
             model_spec=hs.ModelSpec(
                 name=self.name,
@@ -51,33 +101,36 @@ class Model:
             inputs=request.build_input_tensors(),
         )
 
-    def _create_predict_response_proto(self, request: Request) -> hs.PredictResponse:
+    def _create_predict_response_proto(self, request: Request) -> 'hs.PredictResponse':
         """
         Create a PredictResponse message. PredictResponse is used to define the
         outputs of the model inference.
         """
+        import hydro_serving_grpc as hs  # pylint: disable=import-outside-toplevel
         return hs.PredictResponse(
             outputs=request.build_output_tensors(),
         )
 
     def _create_execution_information_proto(
             self,
-            request: hs.PredictRequest,
-            response: hs.PredictResponse,
-            metadata: ExecutionMetadata
-    ) -> ExecutionInformation:
+            request: 'hs.PredictRequest',
+            response: 'hs.PredictResponse',
+            metadata: 'ExecutionMetadata'
+    ) -> 'ExecutionInformation':
         """
         Create an ExecutionInformation message. ExecutionInformation contains all
         request data and all auxiliary information about request execution, required
         to calculate metrics.
         """
+        # pylint: disable=import-outside-toplevel
+        from hydro_serving_grpc.monitoring.api_pb2 import ExecutionInformation
         return ExecutionInformation(
             request=request,
             response=response,
             metadata=metadata,
         )
 
-    def compose_execution_information_proto(self, request: Request) -> ExecutionInformation:
+    def compose_execution_information_proto(self, request: Request) -> 'ExecutionInformation':
         """Compose an ExecutionInformation message from a Request."""
         return self._create_execution_information_proto(
             self._create_predict_request_proto(request),
@@ -85,7 +138,67 @@ class Model:
             self._create_execution_metadata_proto(request),
         )
 
-    def analyse(self, request: Request) -> None:
-        """Use RPC method Analyse of the MonitoringService to calculate metrics."""
-        logger.debug("Analysing request: %s", request)
-        self.stub.Analyze(self.compose_execution_information_proto(request))
+    def encode_shared(self, request: Request) -> bytes:
+        """
+        Serialize the part of an ExecutionInformation message, which doesn't
+        depend on the model version: tensors of inputs and outputs. Models of
+        the same contract registered in different clusters complete it with
+        `analyse(request, shared)`, so a row is encoded once for all of them.
+        """
+        # pylint: disable=import-outside-toplevel
+        import hydro_serving_grpc as hs
+        from hydro_serving_grpc.monitoring.api_pb2 import ExecutionInformation
+        return ExecutionInformation(
+            request=hs.PredictRequest(inputs=request.build_input_tensors()),
+            response=self._create_predict_response_proto(request),
+        ).SerializeToString()
+
+    def _encode_own(self, request: Request) -> bytes:
+        """
+        Serialize the part of an ExecutionInformation message specific to the
+        model version: the model spec and the execution metadata. Parsers
+        merge repeated occurrences of a message field, so appending it to the
+        shared part gives the same message as composing it whole.
+        """
+        # pylint: disable=import-outside-toplevel
+        import hydro_serving_grpc as hs
+        from hydro_serving_grpc.monitoring.api_pb2 import ExecutionInformation
+        return ExecutionInformation(
+            request=hs.PredictRequest(
+                model_spec=hs.ModelSpec(name=self.name, signature_name=self.signature_name),
+            ),
+            metadata=self._create_execution_metadata_proto(request),
+        ).SerializeToString()
+
+    def analyse(self, request: Request, shared: Union[bytes, None] = None) -> bool:
+        """
+        Deliver the request to the sink, which calls RPC method Analyse of the
+        MonitoringService by default. With `shared`, the output of
+        `encode_shared` for the request, only the model specific part of the
+        message is encoded. Transient failures are retried with an
+        exponential backoff. If the request still can't be delivered, it's
+        written to the spool when one is configured, otherwise
+        `AnalysisFailed` is raised.
+        """
+        if rows_logger.enabled:
+            rows_logger.debug("Analysing a request of %s model", self.name)
+        collector = metrics.current()
+        with collector.timer('TensorBuild'):
+            if shared is None:
+                message = self.compose_execution_information_proto(request)
+            else:
+                payload = shared + self._encode_own(request)
+        try:
+            if shared is None:
+                self.sink.send(message)
+            else:
+                self.sink.send_serialized(self.name, payload)
+            return True
+        except grpc.RpcError as error:
+            collector.increment('AnalyzeFailures')
+            if self.spool is None:
+                raise errors.AnalysisFailed(
+                    f"Could not analyse request {request.metadata.event_id}: {error}")
+            logger.warning("Spooling request %s: %s", request.metadata.event_id, error)
+            self.spool.put(self.name, message.SerializeToString() if shared is None else payload)
+            return False
@@ -1,17 +1,21 @@
 """
 This module provides interface for interacting with Hydrosphere HTTP API.
 """
+import json
 import logging
 import time
 import urllib.parse
-from typing import List
+from typing import List, Tuple, Union
 from enum import Enum
 
 import requests
 from src.utils import transform_model_name, PROFILE_CONVERSIONS
 from src.data import SchemaDescription, ColumnDescription
 from src.model import Model
+from src.sinks import Sink
+from src.spool import Spool
 from src import errors
+from src import metrics
 
 
 class DataProfileStatus(Enum):
@@ -47,12 +51,37 @@ def find_model_version(endpoint: str, name: str, version: int) -> dict:
             "name": response["model"]["name"],
             "version": response["modelVersion"],
             "model_version_id": response["id"],
+            "contract": response.get("modelContract") or {},
         }
     else:
         raise errors.ApiNotAvailable(response.content)
     return response
 
 
+def contract_differences(contract: dict, schema: SchemaDescription) -> List[str]:
+    """
+    Compare the contract a model was registered with to the schema of the
+    tensors, which are sent. Return descriptions of tensors, which differ by
+    name, dtype or shape. Contracts without a predict signature can't be
+    compared and have no differences.
+    """
+    predict = contract.get("predict")
+    if not predict:
+        return []
+    differences = []
+    for side, columns in (("inputs", schema.inputs), ("outputs", schema.outputs)):
+        registered = {
+            field["name"]: (field.get("dtype"), [dim.get("size") for dim in field.get("shape", {}).get("dim", [])])
+            for field in predict.get(side, [])
+        }
+        sent = {column.name: (column.htype, list(column.shape)) for column in columns}
+        for name in sorted(set(registered) | set(sent)):
+            if registered.get(name) != sent.get(name):
+                differences.append(
+                    f"{side} {name}: registered {registered.get(name)}, sent {sent.get(name)}")
+    return differences
+
+
 class ModelPool:
     """
     Represents a pool of the models and available operations
@@ -60,25 +89,56 @@ class ModelPool:
     """
     logger = logging.getLogger('main')
 
-    def __init__(self, endpoint: str) -> 'ModelPool':
+    def __init__(
+            self,
+            endpoint: str,
+            spool: Union[Spool, None] = None,
+            sink: Union[Sink, None] = None,
+    ) -> 'ModelPool':
         self.endpoint = endpoint
+        self.spool = spool
+        self.sink = sink
+
+    def make_model(self, name: str, version: int, model_version_id: int) -> Model:
+        """Create a handle of a known model version, bound to the pool's spool and sink."""
+        return Model(name, version, model_version_id, spool=self.spool, sink=self.sink)
 
     def get_or_create_model(
             self,
             name: str,
             schema: SchemaDescription,
             training_file: str,
-            metadata: dict = None
+            metadata: dict = None,
+            check_contract: bool = False,
     ) -> Model:
-        """Try to load an existing model or register a new one."""
+        """
+        Try to load an existing model or register a new one. An existing
+        model, which was registered with another contract than the schema,
+        raises `ContractMismatch` with `check_contract`, otherwise the
+        differences are logged. Lookup and registration are timed as
+        separate stages.
+        """
         try:
-            return self.get_model(name)
+            with metrics.current().timer('ModelLookup'):
+                model, contract = self._find_model(name)
         except errors.ModelNotFound:
             return self.create_model(name, schema, training_file, metadata)
+        differences = contract_differences(contract, schema)
+        if differences and check_contract:
+            raise errors.ContractMismatch(
+                f'Model "{model.name}" is registered with another contract: {"; ".join(differences)}')
+        if differences:
+            self.logger.warning('Model "%s" is registered with another contract: %s',
+                                model.name, "; ".join(differences))
+        return model
 
     def get_model(self, name: str, strict: bool = False) -> Model:
         """Retrieve an existing model from Hydrosphere."""
-        model = None
+        return self._find_model(name, strict)[0]
+
+    def _find_model(self, name: str, strict: bool = False) -> Tuple[Model, dict]:
+        """Retrieve an existing model and the contract it was registered with."""
+        result = None
         candidates = find_model(self.endpoint, name)
         if candidates:
             self.logger.debug(
@@ -86,9 +146,7 @@ class ModelPool:
             self.logger.info(
                 'Found the model "%s"', candidates[0]["name"])
             result = find_model_version(self.endpoint, candidates[0]["name"], 1)
-            model = Model(
-                result["name"], result["version"], result["model_version_id"])
-        if not (model or strict):
+        if not (result or strict):
             self.logger.info('Didn\'t find the exact match for "%s" model name', name)
             candidates = find_model(self.endpoint, transform_model_name(name))
             if candidates:
@@ -97,11 +155,10 @@ class ModelPool:
                 self.logger.info(
                     'Found the model "%s"', candidates[0]["name"])
                 result = find_model_version(self.endpoint, candidates[0]["name"], 1)
-                model = Model(
-                    result["name"], result["version"], result["model_version_id"])
-        if not model:
+        if not result:
             raise errors.ModelNotFound("Didn't find any models with similar name")
-        return model
+        model = self.make_model(result["name"], result["version"], result["model_version_id"])
+        return model, result["contract"]
 
     def create_model(
             self,
@@ -111,16 +168,18 @@ class ModelPool:
             metadata: dict = None
     ) -> Model:
         """
-        Register an external model and send training data.
+        Register an external model and send training data, timed as the
+        ModelRegistration stage.
         """
-        response = self._register_model(name, schema, metadata)
-        model = Model(
-            name=response["model"]["name"],
-            version=response["modelVersion"],
-            model_version_id=response["id"]
-        )
-        self._upload_training_data(model.model_version_id, training_file)
-        self._wait_for_data_processing(model.model_version_id)
+        with metrics.current().timer('ModelRegistration'):
+            response = self._register_model(name, schema, metadata)
+            model = self.make_model(
+                name=response["model"]["name"],
+                version=response["modelVersion"],
+                model_version_id=response["id"],
+            )
+            self._upload_training_data(model.model_version_id, training_file)
+            self._wait_for_data_processing(model.model_version_id)
         return model
 
     def _wait_for_data_processing(
@@ -194,16 +253,23 @@ class ModelPool:
         return response
 
     def _create_feature(self, column: ColumnDescription) -> dict:
-        """Create a single feature for the model registration contract."""
+        """
+        Create a single feature for the model registration contract. The
+        dimension of a packed column is named after the features it holds.
+        """
+        if column.features:
+            dims = [{"size": len(column.features), "name": ",".join(column.features)}]
+        else:
+            dims = [
+                {"size": dim, "name": f"{column.name}_{i}"}
+                for i, dim in enumerate(column.shape)
+            ]
         return {
             "name":     column.name,
             "dtype":    column.htype,
             "profile":  PROFILE_CONVERSIONS.get(column.dtype),
             "shape": {
-                "dim": [
-                    {"size": dim, "name": f"{column.name}_{i}"}
-                    for i, dim in enumerate(column.shape)
-                ],
+                "dim": dims,
                 "unknownRank": False,
             }
         }
@@ -215,9 +281,14 @@ class ModelPool:
             metadata: dict
     ) -> dict:
         """Create a request body for external model registration request."""
+        metadata = dict(metadata or {})
+        for column in schema.inputs + schema.outputs:
+            if column.features:
+                # Names of packed features, in the order of tensor values
+                metadata[f"features.{column.name}"] = json.dumps(list(column.features))
         body = {
             "name": name,
-            "metadata": metadata or {},
+            "metadata": metadata,
             "contract": {
                 "modelName": name,
                 "predict": {
@@ -0,0 +1,218 @@
+"""
+This module provides opt-in profiling of Lambda invocations.
+
+Profiling is configured with environment variables:
+
+    PROFILE_MODE            "cpu", "memory" or "cpu,memory"; empty disables profiling
+    PROFILE_SAMPLE_PERCENT  percentage of invocations to profile, 100 by default
+    PROFILE_DIR             local directory for the results, /tmp/profiles by default
+    PROFILE_S3_URI          optional S3 location the results are uploaded to
+    PROFILE_TOP_ALLOCATIONS number of allocation sites to report, 25 by default
+
+CPU profiles are written as pstats files, memory profiles as text reports of
+the top allocation sites. Profiles collected from many invocations can be
+merged with:
+
+    python -m src.profiling merged.pstats s3://bucket/profiles/2020/03/11/ local.pstats
+"""
+import os
+import io
+import sys
+import time
+import uuid
+import random
+import pstats
+import logging
+import cProfile
+import tracemalloc
+from typing import List, Union
+import boto3
+import botocore
+from src.clients import AWSClientFactory
+from src import utils
+
+logger = logging.getLogger('main')
+
+PROFILE_MODE = os.environ.get('PROFILE_MODE', '')
+PROFILE_SAMPLE_PERCENT = float(os.environ.get('PROFILE_SAMPLE_PERCENT', '100'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+PROFILE_S3_URI = os.environ.get('PROFILE_S3_URI', '')
+PROFILE_TOP_ALLOCATIONS = int(os.environ.get('PROFILE_TOP_ALLOCATIONS', '25'))
+
+MODES = ('cpu', 'memory')
+
+
+def parse_modes(value: str) -> List[str]:
+    """Parse a comma separated list of profiling modes."""
+    modes = [mode.strip() for mode in (value or '').split(',') if mode.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, expected one of {MODES}")
+    return modes
+
+
+class Profiler:
+    """
+    Context manager profiling the enclosed block. Results are written to
+    a local directory and, if configured, uploaded to S3.
+    """
+    def __init__(
+            self,
+            name: str,
+            modes: List[str],
+            directory: str = PROFILE_DIR,
+            s3_uri: str = '',
+            top_allocations: int = PROFILE_TOP_ALLOCATIONS,
+            session: Union[boto3.Session, botocore.session.Session, None] = None,
+    ) -> 'Profiler':
+        self.name = name
+        self.modes = modes
+        self.directory = directory
+        self.s3_uri = s3_uri
+        self.top_allocations = top_allocations
+        self.paths: List[str] = []
+        self._session = session
+        self._profile = None
+
+    @classmethod
+    def from_env(
+            cls,
+            name: Union[str, None] = None,
+            session: Union[boto3.Session, botocore.session.Session, None] = None,
+            rng: Union[random.Random, None] = None,
+    ) -> 'Profiler':
+        """
+        Create a profiler configured by environment variables. If the
+        invocation doesn't fall into the sample, the profiler does nothing.
+        """
+        modes = parse_modes(PROFILE_MODE)
+        if modes and (rng or random).random() * 100 >= PROFILE_SAMPLE_PERCENT:
+            modes = []
+        return cls(name or uuid.uuid4().hex, modes, PROFILE_DIR, PROFILE_S3_URI,
+                   PROFILE_TOP_ALLOCATIONS, session)
+
+    @property
+    def enabled(self) -> bool:
+        # pylint: disable=missing-function-docstring
+        return bool(self.modes)
+
+    def __enter__(self) -> 'Profiler':
+        if 'memory' in self.modes:
+            if tracemalloc.is_tracing():
+                # Somebody else is tracing allocations, don't interfere
+                self.modes = [mode for mode in self.modes if mode != 'memory']
+            else:
+                tracemalloc.start()
+        if 'cpu' in self.modes:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, *args):
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if self._profile is not None:
+                self._profile.disable()
+                self.paths.append(self._dump_cpu())
+            if 'memory' in self.modes:
+                self.paths.append(self._dump_memory())
+            if self.s3_uri:
+                self._upload()
+        except Exception:  # pylint: disable=broad-except
+            # Profiling must never fail the invocation
+            logger.exception("Failed to save the profile of %s", self.name)
+        finally:
+            if 'memory' in self.modes:
+                tracemalloc.stop()
+
+    def _dump_cpu(self) -> str:
+        path = os.path.join(self.directory, f"{self.name}.pstats")
+        self._profile.dump_stats(path)
+        logger.info("Saved CPU profile to %s", path)
+        return path
+
+    def _dump_memory(self) -> str:
+        path = os.path.join(self.directory, f"{self.name}.allocations.txt")
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        with open(path, 'w') as file:
+            file.write(f"current={current} peak={peak}\n")
+            for stat in snapshot.statistics('lineno')[:self.top_allocations]:
+                file.write(f"{stat}\n")
+        logger.info("Saved memory profile to %s", path)
+        return path
+
+    def _upload(self):
+        bucket, prefix = utils.parse_s3_uri(self.s3_uri)
+        s3_client = AWSClientFactory.get_or_create_client('s3', self._session or boto3.Session())
+        date = time.strftime('%Y/%m/%d', time.gmtime())
+        for path in self.paths:
+            key = '/'.join(filter(None, [prefix, date, os.path.basename(path)]))
+            with open(path, 'rb') as file:
+                s3_client.put_object(Bucket=bucket, Key=key, Body=file.read())
+            logger.info("Uploaded profile to s3://%s/%s", bucket, key)
+
+
+def download_profiles(
+        s3_uri: str,
+        directory: str,
+        session: Union[boto3.Session, botocore.session.Session, None] = None,
+) -> List[str]:
+    """Download all pstats files under the S3 location."""
+    bucket, prefix = utils.parse_s3_uri(s3_uri)
+    s3_client = AWSClientFactory.get_or_create_client('s3', session or boto3.Session())
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        for item in response.get('Contents', []):
+            if item['Key'].endswith('.pstats'):
+                path = os.path.join(directory, item['Key'].replace('/', '_'))
+                s3_client.download_file(bucket, item['Key'], path)
+                paths.append(path)
+        if not response.get('IsTruncated'):
+            return paths
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def merge_profiles(paths: List[str], output: Union[str, None] = None) -> pstats.Stats:
+    """Merge pstats files collected from many invocations."""
+    if not paths:
+        raise ValueError("No profiles to merge")
+    stats = pstats.Stats(paths[0], stream=io.StringIO())
+    for path in paths[1:]:
+        stats.add(path)
+    if output:
+        stats.dump_stats(output)
+    return stats
+
+
+def main(argv: Union[List[str], None] = None):
+    """
+    Merge profiles given as local files or S3 locations and print the
+    hottest functions.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print("Usage: python -m src.profiling OUTPUT PROFILE_OR_S3_URI...", file=sys.stderr)
+        return 2
+    output, sources = argv[0], argv[1:]
+    paths = []
+    for source in sources:
+        if source.startswith('s3://'):
+            paths.extend(download_profiles(source, os.path.join(PROFILE_DIR, 'downloaded')))
+        else:
+            paths.append(source)
+    stats = merge_profiles(paths, output)
+    stats.stream = sys.stdout
+    stats.sort_stats('cumulative').print_stats(30)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
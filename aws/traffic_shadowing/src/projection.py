@@ -0,0 +1,66 @@
+"""
+This module selects columns of a model, which are shadowed to Hydrosphere.
+
+A projection either lists the columns to keep ("include"), or the columns
+to drop ("exclude"), by the names they have in the contract: training file
+headers for CSV payloads, keys of JSON objects, or synthetic names like
+`input_0`. Inputs and outputs are projected alike. Projections are
+configured per model and applied when the contract is built, so dropped
+columns are never cast or converted into tensors. Listed names, which the
+contract doesn't have, are logged, and a projection keeping no column
+fails the contract with `EmptyProjection`.
+"""
+import json
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Union
+
+INCLUDE, EXCLUDE = 'include', 'exclude'
+DEFAULT_PROJECTION_KEY = '*'
+
+
+class Projection(NamedTuple):
+    """Names of columns to keep or to drop. Keeps everything by default."""
+    include: Union[FrozenSet[str], None] = None
+    exclude: FrozenSet[str] = frozenset()
+
+    def keeps(self, name: str) -> bool:
+        """Check whether a column with the given name is shadowed."""
+        if self.include is not None and name not in self.include:
+            return False
+        return name not in self.exclude
+
+    def positions(self, names: Iterable[str]) -> List[int]:
+        """Find positions of the kept columns among the given ones."""
+        return [position for position, name in enumerate(names) if self.keeps(name)]
+
+    def unknown(self, names: Iterable[str]) -> FrozenSet[str]:
+        """Find listed names, which aren't among the given ones."""
+        return (self.include or frozenset()).union(self.exclude).difference(names)
+
+
+def _projection(name: str, spec: Dict[str, List[str]]) -> Projection:
+    if not isinstance(spec, dict) or len(spec) != 1 or not set(spec) <= {INCLUDE, EXCLUDE}:
+        raise ValueError(f"Projection for {name} should be an object with either "
+                         f"{INCLUDE} or {EXCLUDE} list of columns, got {spec}")
+    if INCLUDE in spec:
+        return Projection(include=frozenset(spec[INCLUDE]))
+    return Projection(exclude=frozenset(spec[EXCLUDE]))
+
+
+def parse_projections(value: str) -> Dict[str, Projection]:
+    """
+    Parse projection configuration. The value is either a single projection
+    applied to all models, e.g. '{"exclude": ["Phone"]}', or a JSON object
+    mapping model names to projections, where the "*" key defines the default.
+    """
+    value = (value or '').strip()
+    specs = json.loads(value) if value else {}
+    if specs and set(specs) <= {INCLUDE, EXCLUDE}:
+        specs = {DEFAULT_PROJECTION_KEY: specs}
+    projections = {name: _projection(name, spec) for name, spec in specs.items()}
+    projections.setdefault(DEFAULT_PROJECTION_KEY, Projection())
+    return projections
+
+
+def for_model(projections: Dict[str, Projection], model_name: str) -> Projection:
+    """Find the projection configured for the given model."""
+    return projections.get(model_name, projections.get(DEFAULT_PROJECTION_KEY, Projection()))
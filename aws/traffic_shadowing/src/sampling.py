@@ -0,0 +1,78 @@
+"""
+This module implements deterministic sampling of captured requests.
+
+The decision is based on a hash of `eventMetadata.eventId`, so the same
+request is either always shadowed or always skipped, no matter how many
+times the capture file gets processed.
+"""
+import json
+import re
+import hashlib
+import logging
+from typing import Dict, Union
+
+logger = logging.getLogger('main')
+
+EVENT_ID_PATTERN = re.compile(rb'"eventId"\s*:\s*"([^"]*)"')
+DEFAULT_RATE_KEY = '*'
+HASH_SPACE = float(2 ** 64)
+
+
+def parse_sampling_rates(value: str) -> Dict[str, float]:
+    """
+    Parse sampling configuration. The value is either a single rate applied
+    to all models, e.g. "0.1", or a JSON object mapping model names to rates,
+    where the "*" key defines the default rate.
+    """
+    value = (value or '').strip() or '1.0'
+    parsed = json.loads(value)
+    rates = parsed if isinstance(parsed, dict) else {DEFAULT_RATE_KEY: parsed}
+    rates = {name: float(rate) for name, rate in rates.items()}
+    for name, rate in rates.items():
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError(f"Sampling rate for {name} should be within [0, 1], got {rate}")
+    rates.setdefault(DEFAULT_RATE_KEY, 1.0)
+    return rates
+
+
+def extract_event_id(line: bytes) -> Union[bytes, None]:
+    """Find the eventId in a raw capture line without parsing the JSON."""
+    match = EVENT_ID_PATTERN.search(line)
+    return match.group(1) if match else None
+
+
+def event_hash(event_id: bytes) -> int:
+    """Hash an event id uniformly into [0, 2 ** 64)."""
+    return int.from_bytes(hashlib.blake2b(event_id, digest_size=8).digest(), 'big')
+
+
+class Sampler:
+    """Decides, whether a captured request should be shadowed."""
+    def __init__(self, rate: float = 1.0) -> 'Sampler':
+        self.rate = rate
+        self.threshold = int(rate * HASH_SPACE)
+        self.sampled = 0
+        self.dropped = 0
+
+    @classmethod
+    def for_model(cls, rates: Dict[str, float], model_name: str) -> 'Sampler':
+        """Create a sampler with the rate configured for the given model."""
+        return cls(rates.get(model_name, rates.get(DEFAULT_RATE_KEY, 1.0)))
+
+    def accept(self, line: bytes) -> bool:
+        """Check whether a raw capture line falls into the sample."""
+        if self.rate >= 1.0:
+            accepted = True
+        elif self.rate <= 0.0:
+            accepted = False
+        else:
+            event_id = extract_event_id(line)
+            if event_id is None:
+                accepted = True
+            else:
+                accepted = event_hash(event_id) < self.threshold
+        if accepted:
+            self.sampled += 1
+        else:
+            self.dropped += 1
+        return accepted
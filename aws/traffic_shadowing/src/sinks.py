@@ -0,0 +1,415 @@
+"""
+This module defines sinks, which receive messages composed by models.
+
+A sink is picked with the SINK variable:
+
+    grpc    -> sends messages with RPC method Analyze of Hydrosphere (default)
+    file    -> writes messages to archives on S3 or a local disk
+    null    -> counts messages and discards them
+
+Archives have the format of the dead-letter spool: serialized
+`ExecutionInformation` messages, each prefixed with its length encoded as
+a varint, compressed with gzip or zstd, or left plain. They are partitioned
+by model name and hour:
+
+    <SINK_URI>/<model>/<YYYY>/<MM>/<DD>/<HH>/<uuid>.bin[.gz|.zst]
+
+where SINK_URI is either s3://<bucket>/<prefix> or a local directory.
+A partition is written once `SINK_MAX_BYTES` of messages are buffered, and
+all partitions are written in the end of an invocation. Archives are loaded
+into Hydrosphere with `src.loader`.
+
+The gRPC sink gives every call a deadline and stops calling Hydrosphere
+for the rest of the invocation after a run of failed calls, see
+`CircuitBreaker`, so an outage costs a few timeouts instead of retries of
+every row.
+
+Mirror sinks send copies of messages to secondary clusters, see `MirrorSink`.
+Sinks accept already serialized messages too, so a row encoded once can be
+completed for and sent to every cluster without being composed again.
+"""
+import abc
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Tuple, Union
+import grpc
+import boto3
+import botocore
+from src.clients import AWSClientFactory, RPCStubFactory
+from src.spool import encode_delimited, partition_key
+from src import compression
+from src import metrics
+from src import utils
+
+logger = logging.getLogger('main')
+
+GRPC, FILE, NULL = 'grpc', 'file', 'null'
+SINKS = (GRPC, FILE, NULL)
+NONE = 'none'
+COMPRESSIONS = (compression.GZIP, compression.ZSTD, NONE)
+ARCHIVE_SUFFIX = '.bin'
+EXTENSIONS = {compression.GZIP: '.gz', compression.ZSTD: '.zst', NONE: ''}
+
+ANALYZE_METHOD = '/hydrosphere.monitoring.MonitoringService/Analyze'
+RETRYABLE_STATUS_CODES = (
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+)
+
+
+class CircuitOpen(grpc.RpcError):
+    """Raised instead of calling a cluster, which the circuit breaker considers down."""
+    def code(self) -> grpc.StatusCode:
+        # pylint: disable=missing-function-docstring
+        return grpc.StatusCode.UNAVAILABLE
+
+    def __str__(self) -> str:
+        return "Circuit breaker is open, the call wasn't made"
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive messages, which failed with transient errors after
+    all their retries. After `threshold` of them the breaker opens and stays open for the rest of
+    the invocation, so remaining messages fail fast and are spooled. A zero
+    threshold never opens it.
+    """
+    def __init__(self, threshold: int = 5) -> 'CircuitBreaker':
+        self.threshold = threshold
+        self.failures = 0
+        self.opened = False
+
+    def success(self):
+        # pylint: disable=missing-function-docstring
+        self.failures = 0
+
+    def failure(self):
+        # pylint: disable=missing-function-docstring
+        self.failures += 1
+        if self.threshold and self.failures >= self.threshold:
+            self.trip(f"{self.failures} messages failed in a row")
+
+    def trip(self, reason: str):
+        """Open the breaker for the rest of the invocation."""
+        if not self.opened:
+            logger.warning("Not calling Hydrosphere anymore: %s", reason)
+            metrics.current().increment('CircuitOpened')
+            self.opened = True
+
+
+class Sink(abc.ABC):
+    """Receives composed messages. Sinks may be shared by several models."""
+    # Invocation counter of received messages, if they are worth reporting
+    counter = None
+
+    def __init__(self) -> 'Sink':
+        self.count = 0
+
+    @abc.abstractmethod
+    def send(self, message: 'ExecutionInformation'):
+        """Deliver a message. Delivery failures are raised as grpc.RpcError."""
+
+    def send_serialized(self, model_name: str, payload: bytes):
+        """Deliver a serialized message of the given model."""
+        # pylint: disable=import-outside-toplevel
+        from hydro_serving_grpc.monitoring.api_pb2 import ExecutionInformation
+        self.send(ExecutionInformation.FromString(payload))
+
+    def flush(self) -> List[str]:
+        """Write buffered messages, return locations of written files."""
+        return []
+
+
+class RawMonitoringServiceStub:
+    """MonitoringService stub, which sends already serialized messages as they are."""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, channel: grpc.Channel) -> 'RawMonitoringServiceStub':
+        from google.protobuf.empty_pb2 import Empty  # pylint: disable=import-outside-toplevel
+        self.Analyze = channel.unary_unary(  # pylint: disable=invalid-name
+            ANALYZE_METHOD,
+            request_serializer=None,
+            response_deserializer=Empty.FromString,
+        )
+
+
+class GrpcSink(Sink):
+    """
+    Sends messages to Hydrosphere, retrying on transient failures. Every
+    call waits for at most `timeout` seconds; once `breaker_threshold`
+    messages failed in a row, later ones fail without calls, see
+    `CircuitBreaker`.
+    Serialized messages are sent with `raw_stub`, created on first use.
+    """
+    def __init__(
+            self,
+            stub: Union['MonitoringServiceStub', None] = None,
+            retries: int = 3,
+            raw_stub: Union[RawMonitoringServiceStub, None] = None,
+            timeout: float = 5.0,
+            breaker_threshold: int = 5,
+    ) -> 'GrpcSink':
+        super().__init__()
+        if stub is None:
+            # pylint: disable=import-outside-toplevel
+            from hydro_serving_grpc.monitoring.api_pb2_grpc import MonitoringServiceStub
+            stub = RPCStubFactory.create_stub(MonitoringServiceStub)
+        self.stub = stub
+        self.raw_stub = raw_stub
+        self.retries = retries
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(breaker_threshold)
+
+    def send(self, message: 'ExecutionInformation'):
+        self._call(self.stub, message)
+
+    def send_serialized(self, model_name: str, payload: bytes):
+        if self.raw_stub is None:
+            self.raw_stub = RPCStubFactory.create_stub(RawMonitoringServiceStub)
+        self._call(self.raw_stub, payload)
+
+    def _call(self, stub: Any, message: Union['ExecutionInformation', bytes]):
+        if self.breaker.opened:
+            raise CircuitOpen()
+        collector = metrics.current()
+        attempt = 0
+        while True:
+            try:
+                with collector.timer('Analyze', histogram=True):
+                    stub.Analyze(message, timeout=self.timeout)
+                self.count += 1
+                self.breaker.success()
+                return
+            except grpc.RpcError as error:
+                code = error.code() if callable(getattr(error, 'code', None)) else None
+                if code not in RETRYABLE_STATUS_CODES:
+                    raise
+                if attempt >= self.retries:
+                    self.breaker.failure()
+                    raise
+                if self.breaker.opened:
+                    raise
+                attempt += 1
+                collector.increment('AnalyzeRetries')
+                time.sleep(0.1 * 2 ** attempt)
+
+
+class NullSink(Sink):
+    """Counts messages and discards them, e.g. to measure the function alone."""
+    counter = 'discarded'
+
+    def send(self, message: 'ExecutionInformation'):
+        self.count += 1
+
+    def send_serialized(self, model_name: str, payload: bytes):
+        self.count += 1
+
+
+class FileSink(Sink):
+    """
+    Buffers messages per model/hour partition and writes them as
+    length-delimited archives to S3 or a local directory.
+    """
+    counter = 'archived'
+
+    def __init__(
+            self,
+            uri: str,
+            codec: str = compression.GZIP,
+            max_bytes: int = 32 * 1024 * 1024,
+            session: Union[boto3.Session, botocore.session.Session, None] = None,
+    ) -> 'FileSink':
+        super().__init__()
+        if codec not in COMPRESSIONS:
+            raise ValueError(f"Sink compression should be one of {COMPRESSIONS}, got {codec}")
+        self.codec = None if codec == NONE else codec
+        self.suffix = ARCHIVE_SUFFIX + EXTENSIONS[codec]
+        self.max_bytes = max_bytes
+        self._s3_client = None
+        if uri.startswith('s3://'):
+            self.bucket, self.prefix = utils.parse_s3_uri(uri)
+            self._s3_client = AWSClientFactory.get_or_create_client('s3', session or boto3.Session())
+        else:
+            self.bucket, self.prefix = None, uri
+        self._buffers: Dict[Tuple[str, str], bytearray] = {}
+        self._counts: Dict[Tuple[str, str], int] = {}
+
+    def send(self, message: 'ExecutionInformation'):
+        self.send_serialized(message.metadata.model_name, message.SerializeToString())
+
+    def send_serialized(self, model_name: str, payload: bytes):
+        hour = time.strftime('%Y/%m/%d/%H', time.gmtime())
+        partition = (model_name, hour)
+        buffer = self._buffers.setdefault(partition, bytearray())
+        buffer.extend(encode_delimited(payload))
+        self._counts[partition] = self._counts.get(partition, 0) + 1
+        self.count += 1
+        if len(buffer) >= self.max_bytes:
+            self._write(partition)
+
+    def flush(self) -> List[str]:
+        return [self._write(partition) for partition in list(self._buffers)]
+
+    def _write(self, partition: Tuple[str, str]) -> str:
+        """Write a buffered partition, return the location of the archive."""
+        model_name, hour = partition
+        body = compression.compress(bytes(self._buffers.pop(partition)), self.codec)
+        count = self._counts.pop(partition)
+        if self._s3_client is not None:
+            key = partition_key(self.prefix, model_name, hour, self.suffix)
+            kwargs = {'ContentEncoding': self.codec} if self.codec else {}
+            self._s3_client.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=body,
+                ContentType='application/octet-stream',
+                **kwargs,
+            )
+            location = f"s3://{self.bucket}/{key}"
+        else:
+            location = os.path.join(self.prefix, partition_key('', model_name, hour, self.suffix))
+            os.makedirs(os.path.dirname(location), exist_ok=True)
+            # Archives appear whole, so a concurrent loader never reads a partial one
+            with open(location + '.part', 'wb') as file:
+                file.write(body)
+            os.replace(location + '.part', location)
+        logger.info("Archived %d messages to %s", count, location)
+        return location
+
+
+class MirrorSink(Sink):
+    """
+    Sends messages to a secondary cluster without waiting for replies. Up to
+    `max_in_flight` calls are pending at once; messages, which arrive while
+    all of them are pending, are shed, so a slow mirror never holds back the
+    primary cluster. Calls failed with transient errors are sent again, up to
+    `retries` times, after an exponential backoff: a retry waits in a queue
+    ordered by its not-before time, holding a slot of a pending call, while
+    every finished call is settled as soon as it's seen. Other failures are
+    counted and logged, never raised. Shed, retried and failed messages are
+    counted as the MirrorShed, MirrorRetries and MirrorFailures metrics.
+    Pending calls and retries are awaited by `flush`.
+    """
+    counter = 'mirrored'
+
+    def __init__(
+            self,
+            endpoint: str,
+            max_in_flight: int = 8,
+            retries: int = 3,
+            timeout: float = 10.0,
+            stub: Union[RawMonitoringServiceStub, None] = None,
+            backoff: float = 0.1,
+    ) -> 'MirrorSink':
+        super().__init__()
+        self.endpoint = endpoint
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.stub = stub or RPCStubFactory.create_stub(
+            RawMonitoringServiceStub, RPCStubFactory.get_or_create_channel(endpoint))
+        self.shed = 0
+        self.failed = 0
+        # (payload, attempt, future) of pending calls
+        self._in_flight = deque()
+        # Heap of (not-before time, sequence, payload, attempt) of retries
+        self._retries = []
+        self._sequence = itertools.count()
+
+    def send(self, message: 'ExecutionInformation'):
+        self.send_serialized(message.metadata.model_name, message.SerializeToString())
+
+    def send_serialized(self, model_name: str, payload: bytes):
+        self._settle(block=False)
+        if len(self._in_flight) + len(self._retries) >= self.max_in_flight:
+            self.shed += 1
+            metrics.current().increment('MirrorShed')
+            return
+        self._submit(payload, 0)
+
+    def flush(self) -> List[str]:
+        self._settle(block=True)
+        if self.shed or self.failed:
+            logger.warning("Mirror %s shed %d and failed %d messages",
+                           self.endpoint, self.shed, self.failed)
+        return []
+
+    def _submit(self, payload: bytes, attempt: int):
+        future = self.stub.Analyze.future(payload, timeout=self.timeout)
+        self._in_flight.append((payload, attempt, future))
+
+    def _settle(self, block: bool):
+        """
+        Settle every finished call and make retries, which are due. With
+        `block`, wait for all calls and retries.
+        """
+        while True:
+            if any(future.done() for _, _, future in self._in_flight):
+                pending = deque()
+                for payload, attempt, future in self._in_flight:
+                    if future.done():
+                        self._settle_call(payload, attempt, future)
+                    else:
+                        pending.append((payload, attempt, future))
+                self._in_flight = pending
+            now = time.monotonic()
+            while self._retries and self._retries[0][0] <= now:
+                _, _, payload, attempt = heapq.heappop(self._retries)
+                self._submit(payload, attempt)
+            if not block:
+                return
+            if self._in_flight:
+                # Retries falling due meanwhile are made on the next round
+                self._settle_call(*self._in_flight.popleft())
+            elif self._retries:
+                time.sleep(self._retries[0][0] - now)
+            else:
+                return
+
+    def _settle_call(self, payload: bytes, attempt: int, future: Any):
+        """Count a call, waiting for it if needed, or queue its retry."""
+        try:
+            future.result()
+            self.count += 1
+        except grpc.RpcError as error:
+            code = error.code() if callable(getattr(error, 'code', None)) else None
+            if attempt < self.retries and code in RETRYABLE_STATUS_CODES:
+                metrics.current().increment('MirrorRetries')
+                not_before = time.monotonic() + self.backoff * 2 ** attempt
+                heapq.heappush(self._retries, (not_before, next(self._sequence), payload, attempt + 1))
+            else:
+                self.failed += 1
+                metrics.current().increment('MirrorFailures')
+                logger.debug("Mirror %s failed to analyse a message: %s", self.endpoint, error)
+
+
+def parse_sink(value: str) -> str:
+    """Validate the kind of the sink, gRPC by default."""
+    value = (value or '').strip().lower() or GRPC
+    if value not in SINKS:
+        raise ValueError(f"Sink should be one of {SINKS}, got {value}")
+    return value
+
+
+def create(
+        kind: str,
+        uri: str = '',
+        codec: str = compression.GZIP,
+        max_bytes: int = 32 * 1024 * 1024,
+        session: Union[boto3.Session, botocore.session.Session, None] = None,
+        timeout: float = 5.0,
+        breaker_threshold: int = 5,
+) -> Sink:
+    """Create a sink of the given kind. Timeout and breaker apply to the gRPC sink."""
+    if kind == NULL:
+        return NullSink()
+    if kind == FILE:
+        if not uri:
+            raise ValueError("File sink requires an s3:// URI or a directory to write archives to")
+        return FileSink(uri, codec, max_bytes, session)
+    return GrpcSink(timeout=timeout, breaker_threshold=breaker_threshold)
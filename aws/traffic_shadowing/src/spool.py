@@ -0,0 +1,154 @@
+"""
+This module implements a dead-letter spool for rows rejected by Hydrosphere.
+
+Spool files contain already serialized `ExecutionInformation` messages, each
+prefixed with its length encoded as a varint, and compressed with gzip. Files
+are partitioned by model name and hour of the failure:
+
+    s3://<bucket>/<prefix>/<model>/<YYYY>/<MM>/<DD>/<HH>/<uuid>.bin.gz
+"""
+import gzip
+import logging
+import time
+import uuid
+from typing import Dict, Iterator, List, Tuple, Union
+import boto3
+import botocore
+from src.clients import AWSClientFactory
+
+logger = logging.getLogger('main')
+
+SPOOL_SUFFIX = '.bin.gz'
+
+
+def encode_varint(value: int) -> bytes:
+    """Encode a non-negative integer as a protobuf varint."""
+    result = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            result.append(byte | 0x80)
+        else:
+            result.append(byte)
+            return bytes(result)
+
+
+def decode_varint(buffer: bytes, position: int) -> Tuple[int, int]:
+    """Decode a protobuf varint, return the value and the next position."""
+    result, shift = 0, 0
+    while True:
+        if position >= len(buffer):
+            raise ValueError("Truncated varint in a length-delimited stream")
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def encode_delimited(payload: bytes) -> bytes:
+    """Prefix a payload with its varint-encoded length."""
+    return encode_varint(len(payload)) + payload
+
+
+def iter_delimited(buffer: bytes) -> Iterator[bytes]:
+    """Iterate over payloads of a length-delimited stream."""
+    position = 0
+    while position < len(buffer):
+        size, position = decode_varint(buffer, position)
+        if position + size > len(buffer):
+            raise ValueError("Truncated payload in a length-delimited stream")
+        yield buffer[position:position + size]
+        position += size
+
+
+def partition_key(prefix: str, model_name: str, hour: str, suffix: str = SPOOL_SUFFIX) -> str:
+    """Build the key of a new spool file within a model/hour partition."""
+    return '/'.join(filter(None, [
+        prefix.strip('/'), model_name, hour, uuid.uuid4().hex + suffix
+    ]))
+
+
+class Spool:
+    """
+    Buffers rejected messages per model/hour partition and writes them to S3
+    as compressed length-delimited files.
+    """
+    def __init__(
+            self,
+            bucket: str,
+            prefix: str,
+            session: Union[boto3.Session, botocore.session.Session, None] = None,
+    ) -> 'Spool':
+        self.bucket = bucket
+        self.prefix = prefix
+        self._session = session or boto3.Session()
+        self._s3_client = AWSClientFactory.get_or_create_client('s3', self._session)
+        self._buffers: Dict[Tuple[str, str], bytearray] = {}
+        self._counts: Dict[Tuple[str, str], int] = {}
+
+    def __len__(self) -> int:
+        return sum(self._counts.values())
+
+    def put(self, model_name: str, message: bytes, timestamp: Union[float, None] = None):
+        """Append a serialized message to the partition of the given model."""
+        hour = time.strftime('%Y/%m/%d/%H', time.gmtime(timestamp or time.time()))
+        partition = (model_name, hour)
+        self._buffers.setdefault(partition, bytearray()).extend(encode_delimited(message))
+        self._counts[partition] = self._counts.get(partition, 0) + 1
+
+    def flush(self) -> List[str]:
+        """Write all buffered partitions to S3 and return the created keys."""
+        keys = []
+        for (model_name, hour), buffer in self._buffers.items():
+            key = partition_key(self.prefix, model_name, hour)
+            self._s3_client.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=gzip.compress(bytes(buffer)),
+                ContentType='application/octet-stream',
+                ContentEncoding='gzip',
+            )
+            logger.info("Spooled %d rejected messages to s3://%s/%s",
+                        self._counts[(model_name, hour)], self.bucket, key)
+            keys.append(key)
+        self._buffers.clear()
+        self._counts.clear()
+        return keys
+
+
+class SpoolReader:
+    """Lists and reads spool files under a given prefix."""
+    def __init__(
+            self,
+            bucket: str,
+            prefix: str,
+            session: Union[boto3.Session, botocore.session.Session, None] = None,
+    ) -> 'SpoolReader':
+        self.bucket = bucket
+        self.prefix = prefix
+        self._session = session or boto3.Session()
+        self._s3_client = AWSClientFactory.get_or_create_client('s3', self._session)
+
+    def list_keys(self) -> Iterator[str]:
+        """Iterate over spool files under the prefix."""
+        kwargs = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        while True:
+            response = self._s3_client.list_objects_v2(**kwargs)
+            for item in response.get('Contents', []):
+                if item['Key'].endswith(SPOOL_SUFFIX):
+                    yield item['Key']
+            if not response.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def read(self, key: str) -> Iterator[bytes]:
+        """Iterate over serialized messages of a single spool file."""
+        obj = self._s3_client.get_object(Bucket=self.bucket, Key=key)
+        yield from iter_delimited(gzip.decompress(obj['Body'].read()))
+
+    def delete(self, key: str):
+        """Delete a drained spool file."""
+        self._s3_client.delete_object(Bucket=self.bucket, Key=key)
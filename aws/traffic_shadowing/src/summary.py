@@ -0,0 +1,446 @@
+"""
+This module summarizes capture files instead of shadowing every row.
+
+Shadowing every row of an endpoint with extreme traffic costs more than
+drift monitoring needs. In the summary mode a capture file is reduced to
+statistics of every scalar CSV column: counts of values and nulls, min and
+max, mean and variance, a histogram and a quantile sketch. Cells are
+converted and aggregated with NumPy a chunk of rows at a time. Summaries
+are stored as JSON next to the capture file, under `<key>.summary.json`.
+
+Summaries of different files merge into the summary of their union: counts
+add up, moments merge with the parallel variance formula, and bins of the
+histograms and sketches don't depend on data. Histogram bins are bounded by
+1, 2 and 5 times powers of ten on both sides of zero. The sketch counts
+values in buckets, whose bounds grow geometrically, so every quantile is
+known within `SKETCH_ACCURACY` of its value, as in DDSketch.
+
+A few rows, the ones with the smallest hashes of event ids, are still
+shadowed through `Analyze`. Such bottom-k sample is stable across retries
+of a file and merges across files as well.
+"""
+import heapq
+import json
+import math
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Tuple, Union
+import boto3
+import botocore
+from src.clients import AWSClientFactory
+from src.data import Request, SchemaDescription, PACKED_DTYPE_PREFIXES
+from src import dtypes
+from src import lines
+from src.sampling import event_hash, extract_event_id
+
+logger = logging.getLogger('main')
+
+ROWS, SUMMARY = 'rows', 'summary'
+SHADOWING_MODES = (ROWS, SUMMARY)
+DEFAULT_MODE_KEY = '*'
+SUMMARY_SUFFIX = '.summary.json'
+SUMMARY_VERSION = 1
+# Rows, whose cells are converted and aggregated at once
+CHUNK_ROWS = 10000
+SKETCH_ACCURACY = 0.01
+SKETCH_MAX_BUCKETS = 2048
+HISTOGRAM_MAGNITUDES = tuple(
+    round(mantissa * 10.0 ** exponent, 12)
+    for exponent in range(-9, 10) for mantissa in (1, 2, 5)
+)
+# Bin i holds values within [edges[i - 1], edges[i]), the first and the last
+# bins hold values beyond the edges
+HISTOGRAM_EDGES = tuple(-edge for edge in reversed(HISTOGRAM_MAGNITUDES)) \
+    + (0.0,) + HISTOGRAM_MAGNITUDES
+
+
+def _numpy():
+    import numpy  # pylint: disable=import-outside-toplevel
+    return numpy
+
+
+def parse_shadowing_modes(value: str) -> Dict[str, str]:
+    """
+    Parse shadowing mode configuration. The value is either a single mode
+    applied to all models, e.g. "summary", or a JSON object mapping model
+    names to modes, where the "*" key defines the default mode.
+    """
+    value = (value or '').strip() or ROWS
+    modes = json.loads(value) if value.startswith('{') else {DEFAULT_MODE_KEY: value}
+    for name, mode in modes.items():
+        if mode not in SHADOWING_MODES:
+            raise ValueError(f"Shadowing mode for {name} should be one of {SHADOWING_MODES}, "
+                             f"got {mode}")
+    modes.setdefault(DEFAULT_MODE_KEY, ROWS)
+    return modes
+
+
+def shadowing_mode(modes: Dict[str, str], model_name: str) -> str:
+    """Find the shadowing mode configured for the given model."""
+    return modes.get(model_name, modes.get(DEFAULT_MODE_KEY, ROWS))
+
+
+class QuantileSketch:
+    """
+    Counts values in buckets with geometrically growing bounds. Positive and
+    negative values are counted separately, by the index of the bucket of
+    their magnitude. When there are too many buckets, the ones of the
+    smallest magnitudes are collapsed together.
+    """
+    def __init__(
+            self,
+            accuracy: float = SKETCH_ACCURACY,
+            max_buckets: int = SKETCH_MAX_BUCKETS,
+    ) -> 'QuantileSketch':
+        self.accuracy = accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zeros = 0
+
+    @property
+    def count(self) -> int:
+        # pylint: disable=missing-function-docstring
+        return self.zeros + sum(self.positive.values()) + sum(self.negative.values())
+
+    def update(self, values: Any):
+        """Count an array of values, which doesn't contain NaNs."""
+        numpy = _numpy()
+        self.zeros += int(numpy.count_nonzero(values == 0))
+        log_gamma = math.log(self.gamma)
+        for store, magnitudes in ((self.positive, values[values > 0]),
+                                  (self.negative, -values[values < 0])):
+            if not magnitudes.size:
+                continue
+            indices = numpy.ceil(numpy.log(magnitudes) / log_gamma).astype(numpy.int64)
+            indices, counts = numpy.unique(indices, return_counts=True)
+            for index, count in zip(indices.tolist(), counts.tolist()):
+                store[index] = store.get(index, 0) + count
+            self._collapse(store)
+
+    def merge(self, other: 'QuantileSketch'):
+        """Add counts of a sketch with the same accuracy."""
+        if other.gamma != self.gamma:
+            raise ValueError("Sketches of different accuracy can't be merged")
+        self.zeros += other.zeros
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_store.items():
+                store[index] = store.get(index, 0) + count
+            self._collapse(store)
+
+    def _collapse(self, store: Dict[int, int]):
+        if len(store) <= self.max_buckets:
+            return
+        indices = sorted(store)[:len(store) - self.max_buckets + 1]
+        store[indices[-1]] = sum(store.pop(index) for index in indices)
+
+    def _value(self, index: int) -> float:
+        # The middle of the bucket in terms of relative error
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q: float) -> Union[float, None]:
+        """Estimate the q-quantile of counted values."""
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
+
+    def to_dict(self) -> Dict:
+        # pylint: disable=missing-function-docstring
+        return {
+            'accuracy': self.accuracy,
+            'zeros': self.zeros,
+            'positive': {str(index): count for index, count in sorted(self.positive.items())},
+            'negative': {str(index): count for index, count in sorted(self.negative.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'QuantileSketch':
+        # pylint: disable=missing-function-docstring
+        sketch = cls(data['accuracy'])
+        sketch.zeros = data['zeros']
+        sketch.positive = {int(index): count for index, count in data['positive'].items()}
+        sketch.negative = {int(index): count for index, count in data['negative'].items()}
+        return sketch
+
+
+@dataclass
+class FeatureSummary:
+    """
+    Sufficient statistics of a column. Non-numeric columns count values and
+    nulls only.
+    """
+    numeric: bool = True
+    count: int = 0
+    nulls: int = 0
+    minimum: float = math.inf
+    maximum: float = -math.inf
+    mean: float = 0.0
+    m2: float = 0.0     # Sum of squared deviations from the mean
+    histogram: List[int] = field(default_factory=lambda: [0] * (len(HISTOGRAM_EDGES) + 1))
+    sketch: QuantileSketch = field(default_factory=QuantileSketch)
+
+    @property
+    def variance(self) -> Union[float, None]:
+        # pylint: disable=missing-function-docstring
+        return self.m2 / self.count if self.count else None
+
+    def update(self, values: Any):
+        """Aggregate an array of values, where NaNs are nulls."""
+        numpy = _numpy()
+        nulls = numpy.isnan(values)
+        self.nulls += int(numpy.count_nonzero(nulls))
+        values = values[~nulls]
+        if not values.size:
+            return
+        mean = float(values.mean())
+        self._merge_moments(values.size, mean, float(numpy.square(values - mean).sum()))
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        bins = numpy.bincount(
+            numpy.searchsorted(HISTOGRAM_EDGES, values, side='right'),
+            minlength=len(self.histogram),
+        )
+        self.histogram = [a + b for a, b in zip(self.histogram, bins.tolist())]
+        self.sketch.update(values)
+
+    def _merge_moments(self, count: int, mean: float, m2: float):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def merge(self, other: 'FeatureSummary'):
+        """Aggregate statistics of another part of the same column."""
+        self.nulls += other.nulls
+        if not other.count:
+            return
+        if not other.numeric:
+            self.count += other.count
+            return
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        self.sketch.merge(other.sketch)
+
+    def to_dict(self) -> Dict:
+        # pylint: disable=missing-function-docstring
+        result = {'numeric': self.numeric, 'count': self.count, 'nulls': self.nulls}
+        if self.numeric and self.count:
+            result.update({
+                'min': self.minimum,
+                'max': self.maximum,
+                'mean': self.mean,
+                'variance': self.variance,
+                'm2': self.m2,
+                'histogram': self.histogram,
+                'sketch': self.sketch.to_dict(),
+            })
+        return result
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'FeatureSummary':
+        # pylint: disable=missing-function-docstring
+        summary = cls(data['numeric'], data['count'], data['nulls'])
+        if 'sketch' in data:
+            summary.minimum, summary.maximum = data['min'], data['max']
+            summary.mean, summary.m2 = data['mean'], data['m2']
+            summary.histogram = list(data['histogram'])
+            summary.sketch = QuantileSketch.from_dict(data['sketch'])
+        return summary
+
+
+def _features(schema: SchemaDescription) -> Dict[str, List[Tuple[str, int, bool]]]:
+    """
+    List (name, position, numeric) of scalar columns of CSV payloads by the
+    side of the payload. Packed columns are listed feature by feature.
+    """
+    features = {'input': [], 'output': []}
+    sides = (
+        ('input', schema.inputs, schema.input_layout, schema.input_decoder),
+        ('output', schema.outputs, schema.output_layout, schema.output_decoder),
+    )
+    for side, columns, layout, decoder in sides:
+        if not decoder.positional:
+            continue
+        for index, column in enumerate(columns):
+            position = layout[index] if layout else index
+            numeric = column.dtype.startswith(PACKED_DTYPE_PREFIXES)
+            if isinstance(position, tuple):
+                features[side].extend(zip(column.features, position, [numeric] * len(position)))
+            elif column.shape in ((), (-1,)):
+                features[side].append((column.name, position, numeric))
+    return features
+
+
+class Summarizer:
+    """Aggregates capture lines of a file into a summary and a sample of rows."""
+    def __init__(
+            self,
+            schema: SchemaDescription,
+            sample_rows: int = 100,
+            chunk_rows: int = CHUNK_ROWS,
+    ) -> 'Summarizer':
+        self.schema = schema
+        self.sample_rows = sample_rows
+        self.chunk_rows = chunk_rows
+        self.features = _features(schema)
+        self.summaries = {
+            name: FeatureSummary(numeric)
+            for features in self.features.values() for name, _, numeric in features
+        }
+        self.rows = 0
+        self._chunks: Dict[str, List[List[str]]] = {'input': [], 'output': []}
+        # Max-heap of (-hash, event id, line) of the sampled lines
+        self._sample: List[Tuple[int, str, bytes]] = []
+
+    def add(self, line: Union[bytes, memoryview]):
+        """Aggregate a raw capture line."""
+        input_data, output_data, metadata = Request.unpack(lines.loads(line))
+        sides = (
+            ('input', self.schema.input_decoder, input_data),
+            ('output', self.schema.output_decoder, output_data),
+        )
+        rows = 1
+        for side, decoder, data in sides:
+            if not decoder.positional:
+                continue
+            split = [dtypes.split_row(row) for row in decoder.payload(data).splitlines() if row]
+            self._chunks[side].extend(split)
+            if side == 'input':
+                rows = len(split)
+        self.rows += rows
+        if len(self._chunks['input']) >= self.chunk_rows \
+                or len(self._chunks['output']) >= self.chunk_rows:
+            self.flush()
+
+        event_id = extract_event_id(line)
+        digest = event_hash(bytes(event_id if event_id is not None else line))
+        if len(self._sample) < self.sample_rows:
+            heapq.heappush(self._sample, (-digest, metadata.event_id, bytes(line)))
+        elif self._sample and digest < -self._sample[0][0]:
+            heapq.heapreplace(self._sample, (-digest, metadata.event_id, bytes(line)))
+
+    def flush(self):
+        """Aggregate the pending chunk of rows."""
+        numpy = _numpy()
+        for side, rows in self._chunks.items():
+            if not rows or not self.features[side]:
+                rows.clear()
+                continue
+            width = max(len(row) for row in rows)
+            if any(len(row) != width for row in rows):
+                rows = [row + [''] * (width - len(row)) for row in rows]
+            table = numpy.array(rows)
+            self._chunks[side] = []
+            names, positions, numeric = zip(*self.features[side])
+            cells = table[:, list(positions)]
+            nulls = numpy.isin(numpy.char.strip(cells), list(dtypes.NA_VALUES))
+            values = _to_float(numpy.where(nulls, 'nan', cells))
+            for j, name in enumerate(names):
+                if numeric[j]:
+                    self.summaries[name].update(values[:, j])
+                else:
+                    column_nulls = int(numpy.count_nonzero(nulls[:, j]))
+                    self.summaries[name].nulls += column_nulls
+                    self.summaries[name].count += len(rows) - column_nulls
+
+    def sample_lines(self) -> List[bytes]:
+        """Sampled capture lines in the order of their hashes."""
+        return [line for _, _, line in sorted(self._sample, reverse=True)]
+
+    def summary(self, model_name: str, key: str) -> Dict:
+        """Summary document of aggregated lines."""
+        self.flush()
+        return {
+            'version': SUMMARY_VERSION,
+            'model': model_name,
+            'key': key,
+            'rows': self.rows,
+            'histogram_edges': list(HISTOGRAM_EDGES),
+            'features': {name: summary.to_dict() for name, summary in self.summaries.items()},
+            'sample': [
+                {'eventId': event_id, 'hash': -negated}
+                for negated, event_id, _ in sorted(self._sample, reverse=True)
+            ],
+        }
+
+
+def _to_float(cells: Any) -> Any:
+    """Convert an array of cells to floats, unparseable cells become NaNs."""
+    numpy = _numpy()
+    try:
+        return cells.astype(numpy.float64)
+    except ValueError:
+        return numpy.vectorize(_parse_float, otypes=[numpy.float64])(cells)
+
+
+def _parse_float(cell: str) -> float:
+    try:
+        return float(cell)
+    except ValueError:
+        return math.nan
+
+
+def merge(documents: Iterable[Dict]) -> Dict:
+    """
+    Merge summary documents of several files of a model. The sample keeps
+    as many rows as the largest sample of the documents.
+    """
+    merged, features, sample, sample_rows, keys = None, {}, [], 0, []
+    for document in documents:
+        if merged is None:
+            merged = {key: value for key, value in document.items()
+                      if key not in ('features', 'sample', 'key')}
+            merged['rows'] = 0
+        merged['rows'] += document['rows']
+        keys.append(document['key'])
+        for name, data in document['features'].items():
+            summary = FeatureSummary.from_dict(data)
+            if name in features:
+                features[name].merge(summary)
+            else:
+                features[name] = summary
+        sample.extend(document['sample'])
+        sample_rows = max(sample_rows, len(document['sample']))
+    if merged is None:
+        raise ValueError("Nothing to merge")
+    merged['keys'] = keys
+    merged['features'] = {name: summary.to_dict() for name, summary in features.items()}
+    merged['sample'] = sorted(sample, key=lambda item: item['hash'])[:sample_rows]
+    return merged
+
+
+def store(
+        document: Dict,
+        bucket: str,
+        key: str,
+        session: Union[boto3.Session, botocore.session.Session, None] = None,
+) -> str:
+    """Store the summary of a capture file next to it. Return the key of the summary."""
+    s3_client = AWSClientFactory.get_or_create_client('s3', session or boto3.Session())
+    summary_key = key + SUMMARY_SUFFIX
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=summary_key,
+        Body=json.dumps(document).encode(),
+        ContentType='application/json',
+    )
+    logger.debug("Stored the summary of %d rows in s3://%s/%s", document['rows'], bucket, summary_key)
+    return summary_key
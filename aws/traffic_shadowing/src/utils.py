@@ -3,8 +3,10 @@ This module contains utility functions for performing traffic shadowing.
 """
 import os
 import logging
+import datetime
 import urllib.parse
-from typing import Tuple, Union
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 import boto3
 import botocore
 from src import errors
@@ -124,6 +126,42 @@ class S3Utils:
         candidates.sort(key=lambda x: x['Size'], reverse=True)
         return f"s3://{bucket}/{candidates[0]['Key']}"
 
+    def _list_prefixes(self, bucket: str, prefix: str) -> Iterator[str]:
+        """Iterate over common prefixes one level below the given one."""
+        kwargs = {'Bucket': bucket, 'Prefix': prefix, 'Delimiter': '/'}
+        while True:
+            response = self._s3_client.list_objects_v2(**kwargs)
+            for item in response.get('CommonPrefixes', []):
+                yield item['Prefix']
+            if not response.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def find_recent_captures(self, bucket: str, prefix: str, hours: int = 24) -> Dict[str, str]:
+        """
+        Find a capture file of every endpoint, which captured requests within
+        the last hours. SageMaker stores captured requests under
+        <prefix>/<endpoint>/<variant>/YYYY/MM/DD/HH/ paths.
+        """
+        now = datetime.datetime.utcnow()
+        partitions = [
+            (now - datetime.timedelta(hours=i)).strftime('%Y/%m/%d/%H')
+            for i in range(hours)
+        ]
+        captures = {}
+        for endpoint in self._list_prefixes(bucket, prefix.strip('/') + '/'):
+            model_name = endpoint.rstrip('/').split('/')[-1]
+            for variant in self._list_prefixes(bucket, endpoint):
+                for partition in partitions:
+                    response = self._s3_client.list_objects_v2(
+                        Bucket=bucket, Prefix=f"{variant}{partition}/", MaxKeys=1)
+                    if response.get('Contents'):
+                        captures.setdefault(model_name, response['Contents'][0]['Key'])
+                        break
+                if model_name in captures:
+                    break
+        return captures
+
 
 def parse_s3_uri(uri: str) -> Tuple[str, str]:
     """Parse S3 URI to bucket, key tuple."""
@@ -133,6 +171,24 @@ def parse_s3_uri(uri: str) -> Tuple[str, str]:
     return bucket, key
 
 
+def batch_task_to_event_record(task: dict) -> dict:
+    """
+    Convert an S3 Batch Operations task into an S3 event record, referencing
+    the same object. Both 1.0 and 2.0 invocation schemas are supported.
+    """
+    bucket = task.get('s3Bucket') or task['s3BucketArn'].split(':::', 1)[-1]
+    return {
+        's3': {
+            'bucket': {'name': bucket},
+            'object': {
+                'key': urllib.parse.unquote_plus(task['s3Key']),
+                'eTag': '',
+                'sequencer': task.get('s3VersionId') or '',
+            },
+        },
+    }
+
+
 def parse_model_name(capture_prefix: str, record_key: str) -> str:
     """Parse the name of the Sagemaker model from the S3 path."""
     logger.debug("Parsing a SageMaker model name from %s", record_key)
@@ -150,3 +206,13 @@ def transform_model_name(name: str) -> str:
     new_name = name.lower()
     logger.debug("Transforming model name: %s -> %s", name, new_name)
     return new_name
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of at most `size` items."""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
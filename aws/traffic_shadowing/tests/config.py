@@ -1,4 +1,6 @@
 import os
+import json
+import urllib.parse
 import boto3
 from src.clients import AWSClientFactory
 from src.data import SchemaDescription, ColumnDescription
@@ -98,3 +100,63 @@ SCHEMA = SchemaDescription(
         )
     ]
 )
+
+
+def wrap_into_sqs_message(message_id: str, body: str) -> dict:
+    """Wrap a body into an SQS message, as delivered by the SQS event source."""
+    return {
+        "messageId": message_id,
+        "receiptHandle": f"receipt-{message_id}",
+        "body": body,
+        "attributes": {
+            "ApproximateReceiveCount": "1",
+            "SentTimestamp": "1583930785000",
+            "SenderId": "xxxxxxxxxxxxxxxxxxxxx",
+            "ApproximateFirstReceiveTimestamp": "1583930785010"
+        },
+        "messageAttributes": {},
+        "md5OfBody": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+        "eventSource": "aws:sqs",
+        "eventSourceARN": "arn:aws:sqs:us-east-2:xxxxxxxxxxxx:traffic-shadowing-CaptureQueue",
+        "awsRegion": "us-east-2"
+    }
+
+
+def with_sequencer(event: dict, sequencer: str) -> dict:
+    """Copy an S3 event, making it look like a notification of another PUT."""
+    event = json.loads(json.dumps(event))
+    for record in event["Records"]:
+        record["s3"]["object"]["sequencer"] = sequencer
+    return event
+
+
+SQS_EVENT = {
+    "Records": [
+        wrap_into_sqs_message("message-1", json.dumps(with_sequencer(S3_EVENT, "0000000000000001"))),
+        wrap_into_sqs_message("message-2", json.dumps(with_sequencer(S3_EVENT, "0000000000000002"))),
+        wrap_into_sqs_message("message-3", json.dumps({"Event": "s3:TestEvent"})),
+        wrap_into_sqs_message("message-4", "not a json"),
+    ]
+}
+
+BATCH_OPERATIONS_EVENT = {
+    "invocationSchemaVersion": "1.0",
+    "invocationId": "YXNkbGZqYWRmaiBhc2RmdW9hZHNmZGpmaGFzbGtkaGZza2RmaAo",
+    "job": {
+        "id": "f3cc4f60-61f6-4a2b-8a21-d07600c373ce"
+    },
+    "tasks": [
+        {
+            "taskId": "dGFza2lkZ29lc2hlcmUK",
+            "s3Key": urllib.parse.quote_plus(CAPTURE_KEY, safe="/"),
+            "s3VersionId": "1",
+            "s3BucketArn": f"arn:aws:s3:::{CAPTURE_BUCKET}"
+        },
+        {
+            "taskId": "bm90YWNhcHR1cmVmaWxlCg",
+            "s3Key": "file.jsonl",
+            "s3VersionId": None,
+            "s3BucketArn": f"arn:aws:s3:::{CAPTURE_BUCKET}"
+        },
+    ]
+}
@@ -0,0 +1,13 @@
+# pylint: disable=missing-function-docstring
+import pytest
+from src import handler
+
+
+@pytest.fixture(autouse=True)
+def clear_model_cache():
+    # Resolved models survive invocations, tests expect every one to be cold
+    handler.RESOLVED_MODELS.clear()
+    handler.MIRRORED_MODELS.clear()
+    yield
+    handler.RESOLVED_MODELS.clear()
+    handler.MIRRORED_MODELS.clear()
@@ -71,6 +71,12 @@ class GetObjectStub(StubBase):
             "Key": self.key,
         }
 
+    @staticmethod
+    def from_bytes(body: bytes) -> dict:
+        return {
+            'Body': StreamingBody(BytesIO(body), len(body))
+        }
+
     @property
     def service_response(self) -> dict:
         with open(self.filename, 'rb') as file:
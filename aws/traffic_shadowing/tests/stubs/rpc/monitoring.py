@@ -0,0 +1,47 @@
+# pylint: disable=missing-function-docstring,missing-class-docstring
+"""
+In-memory stand-in for the MonitoringService stub, which doesn't require
+a running Hydrosphere instance.
+"""
+from concurrent.futures import Future
+from typing import Iterable
+import grpc
+
+
+class FakeRpcError(grpc.RpcError):
+
+    def __init__(self, code: grpc.StatusCode = grpc.StatusCode.UNAVAILABLE):
+        super().__init__()
+        self._code = code
+
+    def code(self) -> grpc.StatusCode:
+        return self._code
+
+
+class FakeAnalyze:
+    """Callable mimicking a unary-unary multi-callable."""
+
+    def __init__(self, failures: Iterable[bool] = ()):
+        self.received = []
+        self.calls = 0
+        self._failures = list(failures)
+
+    def __call__(self, message, **kwargs):
+        self.calls += 1
+        if self._failures and self._failures.pop(0):
+            raise FakeRpcError()
+        self.received.append(message)
+
+    def future(self, message, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(self(message))
+        except grpc.RpcError as error:
+            future.set_exception(error)
+        return future
+
+
+class FakeMonitoringStub:
+
+    def __init__(self, failures: Iterable[bool] = ()):
+        self.Analyze = FakeAnalyze(failures)  # pylint: disable=invalid-name
@@ -0,0 +1,61 @@
+import os
+import json
+from src.clients import RPCStubFactory
+from src.data import Contract, Request
+from benchmarks.generators import CaptureSpec, CaptureGenerator, parse_dtypes_mix
+from benchmarks.fakes import FakeS3Client, install_s3_client
+from benchmarks.run import InMemoryRecord, compare
+from benchmarks.load import percentile, run_load
+
+
+def test_generated_capture_is_parsable():
+    spec = CaptureSpec(rows=5, columns=4, outputs=2, dtypes=parse_dtypes_mix('int:1,float:1'))
+    generator = CaptureGenerator(spec)
+    capture = generator.capture_file()
+    session = install_s3_client(FakeS3Client())
+    contract = Contract(InMemoryRecord(capture), InMemoryRecord(generator.training_file()), session)
+    assert [column.name for column in contract.schema.inputs] == generator.header()[2:]
+    assert [column.name for column in contract.schema.outputs] == generator.header()[:2]
+
+    lines = capture.splitlines()
+    assert len(lines) == 5
+    request = Request.from_dict(json.loads(lines[0]), contract.schema)
+    assert len(request.build_input_tensors()) == 4
+
+
+def test_generator_is_deterministic():
+    spec = CaptureSpec(rows=3, columns=3, dtypes={'string': 1}, string_width=5)
+    assert CaptureGenerator(spec).capture_file() == CaptureGenerator(spec).capture_file()
+
+
+def test_compare_flags_regressions():
+    baseline = {'handler': {'rows_per_sec': 100.0, 'bytes_per_sec': 1000.0, 'peak_memory_bytes': 1000}}
+    results = {'handler': {'rows_per_sec': 80.0, 'bytes_per_sec': 950.0, 'peak_memory_bytes': 1200}}
+    regressions = compare(results, baseline, tolerance=0.1)
+    assert len(regressions) == 2
+    assert regressions[0].startswith('handler.rows_per_sec')
+    assert regressions[1].startswith('handler.peak_memory_bytes')
+    assert not compare(results, baseline, tolerance=0.5)
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0.0
+
+
+def test_load_harness_runs_offline(monkeypatch):
+    # test_handler replaces the factory with a replaying mocker for the whole session
+    monkeypatch.setattr(RPCStubFactory, 'create_stub', staticmethod(
+        lambda service_stub, channel=None: service_stub(
+            channel or RPCStubFactory._create_channel(os.environ['HYDROSPHERE_ENDPOINT']))
+    ))
+    spec = CaptureSpec(rows=10, columns=3)
+    results = run_load(spec, [2], error_rate=0.1, files_per_worker=1)
+    assert len(results) == 1
+    result = results[0]
+    assert result['failed_invocations'] == 0
+    assert result['rows'] == 20
+    assert result['server']['received'] == 20
+    assert result['latency_ms']['p50'] <= result['latency_ms']['p99']
@@ -0,0 +1,84 @@
+# pylint: disable=missing-function-docstring
+import io
+import gzip
+import tracemalloc
+import pytest
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from src import compression
+from src.data import Record
+from src.lines import iter_line_batches
+from tests.config import CAPTURE_BUCKET, CAPTURE_FILENAME, CAPTURE_PREFIX, MODEL_NAME
+from tests.config import s3_client, session
+
+
+def read_all(stream) -> bytes:
+    return b''.join(iter(lambda: stream.read(5), b''))
+
+
+def capture_lines(rows: int) -> bytes:
+    return b''.join(b'{"eventMetadata": {"eventId": "%d"}, "data": "%s"}\n' % (i, b'x' * (i % 97))
+                    for i in range(rows))
+
+
+@pytest.mark.parametrize("key,encoding,head,expected", [
+    ("file.jsonl", None, b'{"c', None),
+    ("file.jsonl.gz", None, b'', compression.GZIP),
+    ("file.jsonl", "gzip", b'', compression.GZIP),
+    ("file.jsonl.zst", None, b'', compression.ZSTD),
+    ("file.jsonl", None, b'\x1f\x8b\x08', compression.GZIP),
+    ("file.jsonl", None, b'\x28\xb5\x2f\xfd', compression.ZSTD),
+])
+def test_detect(key, encoding, head, expected):
+    assert compression.detect(key, encoding, head) == expected
+
+
+def test_gzip_members_are_concatenated():
+    data = gzip.compress(b'first\n') + gzip.compress(b'second\n')
+    stream = compression.open_stream(io.BytesIO(data), 'file.jsonl.gz')
+    assert read_all(stream) == b'first\nsecond\n'
+
+
+def test_plain_stream_is_untouched():
+    stream = compression.open_stream(io.BytesIO(b'{"a": 1}\n'), 'file.jsonl')
+    assert read_all(stream) == b'{"a": 1}\n'
+
+
+def test_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    data = zstandard.ZstdCompressor().compress(b'first\nsecond\n')
+    stream = compression.open_stream(io.BytesIO(data), 'file.jsonl')
+    assert read_all(stream) == b'first\nsecond\n'
+
+
+def test_record_reads_compressed_file():
+    with open(CAPTURE_FILENAME, 'rb') as file:
+        plain = file.read()
+    data = gzip.compress(plain)
+    key = f"{CAPTURE_PREFIX}/{MODEL_NAME}/archived.jsonl.gz"
+    with Stubber(s3_client) as s3_stubber:
+        s3_stubber.add_response(
+            'get_object',
+            {'Body': StreamingBody(io.BytesIO(data), len(data)), 'ContentLength': len(data)},
+            {'Bucket': CAPTURE_BUCKET, 'Key': key},
+        )
+        lines = list(Record(CAPTURE_BUCKET, key, session).read())
+    assert lines == plain.splitlines()
+
+
+def peak_memory(data: bytes, key: str) -> int:
+    tracemalloc.start()
+    try:
+        for batch in iter_line_batches(compression.open_stream(io.BytesIO(data), key)):
+            len(batch)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_compressed_file_needs_the_same_memory():
+    plain, larger = capture_lines(10000), capture_lines(40000)
+    plain_peak = peak_memory(plain, 'file.jsonl')
+    compressed_peak = peak_memory(gzip.compress(plain), 'file.jsonl.gz')
+    assert compressed_peak < 2 * plain_peak
+    assert peak_memory(gzip.compress(larger), 'file.jsonl.gz') < 1.2 * compressed_peak
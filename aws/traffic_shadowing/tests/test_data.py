@@ -1,10 +1,21 @@
-# pylint: disable=missing-function-docstring
+# pylint: disable=missing-function-docstring,protected-access
 import json
+import boto3
+import pytest
 from botocore.stub import Stubber
+import hydro_serving_grpc as hs
+from src import errors
+from src import handler
+from src import lines
 from src.data import (
     Record, Contract, Request
 )
+from src.model import Model
+from src.projection import Projection
+from src.sinks import GrpcSink
+from benchmarks.fakes import FakeS3Client, install_s3_client
 from tests.stubs.http.aws import GetObjectStub
+from tests.stubs.rpc.monitoring import FakeMonitoringStub
 from tests.config import (
     CAPTURE_BUCKET, CAPTURE_KEY, CAPTURE_FILENAME, TRAIN_BUCKET, TRAIN_KEY, TRAIN_FILENAME,
     SCHEMA,
@@ -50,6 +61,115 @@ def test_contract_update_headers():
         assert contract.schema == SCHEMA
 
 
+def test_contract_narrow_dtypes():
+    with Stubber(s3_client) as s3_stubber:
+        # Schema inference and narrowing read both files
+        for _ in range(2):
+            s3_stubber.add_response(
+                **GetObjectStub(CAPTURE_BUCKET, CAPTURE_KEY, CAPTURE_FILENAME).generate_response()
+            )
+            s3_stubber.add_response(
+                **GetObjectStub(TRAIN_BUCKET, TRAIN_KEY, TRAIN_FILENAME).generate_response()
+            )
+        capture_record = Record(CAPTURE_BUCKET, CAPTURE_KEY, session=session)
+        train_record = Record(TRAIN_BUCKET, TRAIN_KEY, session=session)
+        contract = Contract(capture_record, train_record, session=session, narrow=True)
+    assert [(column.dtype, column.htype) for column in contract.schema.inputs] == [
+        ("int32", "DT_INT32"), ("float32", "DT_FLOAT"), ("float32", "DT_FLOAT"), ("int32", "DT_INT32"),
+    ]
+    assert contract.schema.outputs[0].dtype == "float64"
+
+    with open(CAPTURE_FILENAME, "r") as file:
+        request = Request.from_dict(json.loads(file.readline()), contract.schema)
+    tensors = request.build_input_tensors()
+    assert list(tensors["Account Length"].int_val) == [186]
+    assert tensors["Day Mins"].float_val[0] == pytest.approx(137.8)
+
+    # Values of rows, which weren't sampled, may not fit narrowed dtypes, then
+    # their tensors are sent with the wide dtypes
+    with open(CAPTURE_FILENAME, "r") as file:
+        line = json.loads(file.readline())
+    line["captureData"]["endpointInput"]["data"] = "2147483653,0.1,137.8123456,97"
+    request = Request.from_dict(line, contract.schema)
+    tensors = request.build_input_tensors()
+    assert (tensors["Account Length"].dtype, list(tensors["Account Length"].int64_val)) == \
+        (hs.DT_INT64, [2147483653])
+    assert (tensors["Day Mins"].dtype, list(tensors["Day Mins"].double_val)) == \
+        (hs.DT_DOUBLE, [137.8123456])
+    assert (tensors["VMail Message"].dtype, tensors["Day Calls"].dtype) == \
+        (hs.DT_FLOAT, hs.DT_INT32)
+    stub = FakeMonitoringStub()
+    assert handler._analyse(request, Model("model", 1, 1, sink=GrpcSink(stub)), [])
+    assert len(stub.Analyze.received) == 1
+
+
+def inferred_contract(**kwargs) -> Contract:
+    with Stubber(s3_client) as s3_stubber:
+        s3_stubber.add_response(
+            **GetObjectStub(CAPTURE_BUCKET, CAPTURE_KEY, CAPTURE_FILENAME).generate_response()
+        )
+        s3_stubber.add_response(
+            **GetObjectStub(TRAIN_BUCKET, TRAIN_KEY, TRAIN_FILENAME).generate_response()
+        )
+        capture_record = Record(CAPTURE_BUCKET, CAPTURE_KEY, session=session)
+        train_record = Record(TRAIN_BUCKET, TRAIN_KEY, session=session)
+        return Contract(capture_record, train_record, session=session, **kwargs)
+
+
+def test_contract_pack_features():
+    contract = inferred_contract(pack=True)
+    names = [column.name for column in SCHEMA.inputs]
+    assert [(c.name, c.dtype, c.shape, c.features) for c in contract.schema.inputs] == [
+        ("input_int64", "int64", (2,), (names[0], names[3])),
+        ("input_float64", "float64", (2,), (names[1], names[2])),
+    ]
+    assert contract.schema.input_layout == [(0, 3), (1, 2)]
+    # A single column of a dtype is kept as it is
+    assert contract.schema.outputs == SCHEMA.outputs
+    assert contract.schema.output_layout is None
+
+    with open(CAPTURE_FILENAME, "r") as file:
+        document = json.loads(file.readline())
+    request = Request.from_dict(document, contract.schema)
+    tensor = request.build_input_tensors()["input_float64"]
+    cells = document["captureData"]["endpointInput"]["data"].split(",")
+    assert list(tensor.double_val) == [float(cells[1]), float(cells[2])]
+    assert [dim.size for dim in tensor.tensor_shape.dim] == [2]
+
+
+def test_contract_projection():
+    names = [column.name for column in SCHEMA.inputs]
+    contract = inferred_contract(projection=Projection(exclude=frozenset([names[1]])))
+    assert contract.schema.inputs == [SCHEMA.inputs[0], SCHEMA.inputs[2], SCHEMA.inputs[3]]
+    assert contract.schema.input_layout == [0, 2, 3]
+    assert contract.schema.outputs == SCHEMA.outputs
+
+    with open(CAPTURE_FILENAME, "r") as file:
+        document = json.loads(file.readline())
+    cells = document["captureData"]["endpointInput"]["data"].split(",")
+    request = Request.from_dict(document, contract.schema)
+    assert [column.data for column in request.inputs] == [cells[0], cells[2], cells[3]]
+    assert list(request.build_input_tensors()) == [names[0], names[2], names[3]]
+
+
+def test_contract_projection_of_unknown_columns(caplog):
+    names = [column.name for column in SCHEMA.inputs]
+    contract = inferred_contract(projection=Projection(include=frozenset([names[0], "Phone"])))
+    assert contract.schema.inputs == [SCHEMA.inputs[0]]
+    assert "Phone" in caplog.text
+    with pytest.raises(errors.EmptyProjection):
+        inferred_contract(projection=Projection(include=frozenset(["account length"])))
+
+
+def test_contract_projection_with_packing():
+    names = [column.name for column in SCHEMA.inputs]
+    contract = inferred_contract(projection=Projection(exclude=frozenset([names[1]])), pack=True)
+    assert [(c.name, c.features) for c in contract.schema.inputs] == [
+        (names[2], ()), ("input_int64", (names[0], names[3])),
+    ]
+    assert contract.schema.input_layout == [2, (0, 3)]
+
+
 def test_request_build_inputs():
     with Stubber(s3_client) as s3_stubber:
         s3_stubber.add_response(
@@ -62,4 +182,39 @@ def test_request_build_inputs():
             outputs = request.build_output_tensors()
             assert inputs["Account Length"].int64_val[0] == int(request.inputs[0].data)
             assert outputs["Churn"].double_val[0] == float(request.outputs[0].data)
-        
\ No newline at end of file
+
+
+def test_request_unpack_of_lines_and_projections():
+    with open(CAPTURE_FILENAME, "rb") as file:
+        line = json.loads(file.readline())
+    projected = {
+        "input": line["captureData"]["endpointInput"]["data"],
+        "output": line["captureData"]["endpointOutput"]["data"],
+        "eventId": line["eventMetadata"]["eventId"],
+        "inferenceTime": line["eventMetadata"]["inferenceTime"],
+    }
+    assert Request.unpack(line) == Request.unpack(projected)
+
+
+def select_requests(expression: str = None) -> list:
+    s3 = FakeS3Client()
+    with open(CAPTURE_FILENAME, "rb") as file:
+        s3.put_object(Bucket=CAPTURE_BUCKET, Key=CAPTURE_KEY, Body=file.read())
+    record = Record(CAPTURE_BUCKET, CAPTURE_KEY, install_s3_client(s3, boto3.Session()))
+    batches = record.select_batches(expression) if expression else record.select_batches()
+    return [as_tuple(Request.from_dict(lines.loads(line), SCHEMA)) for batch in batches for line in batch]
+
+
+def as_tuple(request: Request) -> tuple:
+    return request.inputs, request.outputs, request.metadata
+
+
+def test_record_select():
+    with open(CAPTURE_FILENAME, "r") as file:
+        expected = [as_tuple(Request.from_dict(json.loads(line), SCHEMA)) for line in file if line.strip()]
+    assert select_requests() == expected
+
+
+def test_record_select_falls_back_to_get_object():
+    # The fake rejects expressions it can't parse, like S3 does
+    assert select_requests("SELECT * FROM S3Object s LIMIT 1") == select_requests()
@@ -0,0 +1,195 @@
+# pylint: disable=missing-function-docstring
+import io
+import json
+import base64
+import pytest
+from src import decoders, errors
+from src.data import Contract, Request
+from src.projection import Projection
+from benchmarks.fakes import FakeS3Client, install_s3_client
+from benchmarks.run import InMemoryRecord
+
+np = pytest.importorskip("numpy")
+
+
+def npy(array) -> str:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def capture_line(input_payload: dict, output_payload: dict, event_id: str = "1") -> bytes:
+    return json.dumps({
+        "captureData": {"endpointInput": input_payload, "endpointOutput": output_payload},
+        "eventMetadata": {"eventId": event_id, "inferenceTime": "2020-03-11T12:45:15Z"},
+        "eventVersion": "0",
+    }).encode()
+
+
+@pytest.mark.parametrize("payload,decoder", [
+    ({"observedContentType": "text/csv", "encoding": "CSV"}, decoders.CsvDecoder()),
+    ({"observedContentType": "text/csv; charset=utf-8", "encoding": "BASE64"},
+     decoders.CsvDecoder(base64=True)),
+    ({"observedContentType": "application/json", "encoding": "JSON"}, decoders.JsonDecoder()),
+    ({"observedContentType": "application/x-npy", "encoding": "BASE64"}, decoders.NpyDecoder()),
+    ({"observedContentType": "application/octet-stream", "encoding": "JSON"}, decoders.JsonDecoder()),
+])
+def test_for_payload(payload, decoder):
+    assert decoders.for_payload(payload) == decoder
+
+
+def test_unsupported_payload():
+    with pytest.raises(errors.UnsupportedEncoding):
+        decoders.for_payload({"observedContentType": "image/png", "encoding": "BASE64"})
+
+
+def test_npy_is_read_without_copies():
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    decoder = decoders.NpyDecoder()
+    payload = decoder.payload(npy(array))
+    assert decoder.infer(payload) == [decoders.Field(None, "float32", (-1, 4))]
+
+    decoded, = decoder.split(payload, [])
+    assert not decoded.flags.owndata
+    np.testing.assert_array_equal(decoded, array)
+    assert decoders.tensor_values(decoded, "float32") == (array.ravel().tolist(), (3, 4))
+
+
+def test_npy_fortran_order():
+    array = np.asfortranarray(np.arange(6, dtype=np.int16).reshape(2, 3))
+    decoder = decoders.NpyDecoder()
+    decoded, = decoder.split(decoder.payload(npy(array)), [])
+    np.testing.assert_array_equal(decoded, array)
+
+
+def test_json_object_is_a_column_per_key():
+    data = json.dumps({"features": [[1, 2], [3, 4]], "label": "a"})
+    assert decoders.JsonDecoder().infer(data) == [
+        decoders.Field("features", "int64", (-1, 2)),
+        decoders.Field("label", "string", ()),
+    ]
+
+
+def test_decoders_must_implement_infer_and_split():
+    with pytest.raises(TypeError):
+        decoders.Decoder()
+
+
+def test_csv_cells_may_be_quoted():
+    assert decoders.CsvDecoder().split('1,"a,b"', []) == ["1", "a,b"]
+    assert decoders.CsvDecoder(batched=True).split('1,"a,b"\n2,c', []) == [("1", "2"), ("a,b", "c")]
+
+
+def test_missing_json_keys_are_missing_values():
+    columns = [
+        decoders.Field("a", "float64", (-1,)),
+        decoders.Field("b", "float64", (-1, 2)),
+        decoders.Field("c", "string", ()),
+        decoders.Field("d", "int64", ()),
+    ]
+    a, b, c, d = decoders.JsonDecoder().split('{"a": [1.5]}', columns)
+    assert decoders.tensor_values(a, "float64") == ([1.5], (1,))
+    assert decoders.tensor_values(b, "float64") == ([], (0, 2))
+    assert decoders.tensor_values(c, "string") == ([b""], ())
+    with pytest.raises(errors.ValueOutOfRange):
+        decoders.tensor_values(d, "int64")
+
+
+def test_tensor_values_cast_to_column_dtype():
+    assert decoders.tensor_values(np.asarray([1, 2]), "float64") == ([1.0, 2.0], (2,))
+    assert decoders.tensor_values(np.asarray(["a", "b"]), "string") == ([b"a", b"b"], (2,))
+    assert decoders.tensor_values(np.asarray([1 + 2j]), "complex64") == ([1.0, 2.0], (1,))
+    assert decoders.tensor_values(np.asarray([1.0, -2.0]), "int64") == ([1, -2], (2,))
+    assert decoders.tensor_values(np.asarray([7], dtype=np.int64), "int32") == ([7], (1,))
+    for array, dtype in ((np.asarray([1.7]), "int64"), (np.asarray([2 ** 40]), "int32"),
+                         (np.asarray([-1]), "uint8")):
+        with pytest.raises(errors.ValueOutOfRange):
+            decoders.tensor_values(array, dtype)
+
+
+def test_contract_and_tensors_of_npy_and_json_payloads():
+    array = np.arange(8, dtype=np.float32).reshape(2, 4)
+    lines = [
+        capture_line(
+            {"observedContentType": "application/x-npy", "encoding": "BASE64", "data": npy(array)},
+            {"observedContentType": "application/json", "encoding": "JSON", "data": "[0.5, 0.25]"},
+        ),
+    ]
+    session = install_s3_client(FakeS3Client())
+    contract = Contract(InMemoryRecord(b"\n".join(lines)), InMemoryRecord(b"a,b,c,d,e\n"), session)
+    assert [(c.name, c.dtype, c.shape) for c in contract.schema.inputs] == \
+        [("input_0", "float32", (-1, 4))]
+    assert [(c.name, c.dtype, c.shape) for c in contract.schema.outputs] == \
+        [("output_0", "float64", (-1,))]
+
+    request = Request.from_dict(json.loads(lines[0]), contract.schema)
+    tensor = request.build_input_tensors()["input_0"]
+    assert list(tensor.float_val) == array.ravel().tolist()
+    assert [dim.size for dim in tensor.tensor_shape.dim] == [2, 4]
+    assert list(request.build_output_tensors()["output_0"].double_val) == [0.5, 0.25]
+
+
+def mini_batch_contract(batched: bool, output: str = "0.5\n0.25") -> tuple:
+    line = capture_line(
+        {"observedContentType": "text/csv", "encoding": "CSV", "data": "1,a\n3,b"},
+        {"observedContentType": "text/csv", "encoding": "CSV", "data": output},
+        event_id="event",
+    )
+    session = install_s3_client(FakeS3Client())
+    contract = Contract(InMemoryRecord(line), InMemoryRecord(b"label,x,y\n"), session, batched)
+    return contract, json.loads(line)
+
+
+def test_parse_batch_modes():
+    assert decoders.parse_batch_modes("") == {"*": "explode"}
+    assert decoders.parse_batch_modes("batch") == {"*": "batch"}
+    modes = decoders.parse_batch_modes('{"model-a": "batch"}')
+    assert decoders.batch_mode(modes, "model-a") == "batch"
+    assert decoders.batch_mode(modes, "model-b") == "explode"
+    with pytest.raises(ValueError):
+        decoders.parse_batch_modes("rows")
+
+
+def test_mini_batch_is_exploded_into_rows():
+    contract, document = mini_batch_contract(batched=False)
+    assert [(c.name, c.dtype, c.shape) for c in contract.schema.inputs] == \
+        [("x", "int64", ()), ("y", "string", ())]
+
+    requests = Request.from_dict_rows(document, contract.schema)
+    assert [request.metadata.event_id for request in requests] == ["event-0", "event-1"]
+    assert [request.build_input_tensors()["x"].int64_val[0] for request in requests] == [1, 3]
+    assert [request.build_output_tensors()["label"].double_val[0] for request in requests] == \
+        [0.5, 0.25]
+
+
+def test_mini_batch_is_a_batched_tensor():
+    contract, document = mini_batch_contract(batched=True)
+    assert [c.shape for c in contract.schema.inputs] == [(-1,), (-1,)]
+
+    request, = Request.from_dict_rows(document, contract.schema)
+    assert request.metadata.event_id == "event"
+    tensor = request.build_input_tensors()["y"]
+    assert list(tensor.string_val) == [b"a", b"b"]
+    assert [dim.size for dim in tensor.tensor_shape.dim] == [2]
+
+
+def test_mini_batch_rows_must_match():
+    contract, document = mini_batch_contract(batched=False, output="0.5")
+    with pytest.raises(errors.MalformedCapture):
+        Request.from_dict_rows(document, contract.schema)
+
+
+def test_projection_of_json_keys():
+    line = capture_line(
+        {"observedContentType": "application/json", "encoding": "JSON",
+         "data": json.dumps({"features": [1.5, 2.5], "id": "a"})},
+        {"observedContentType": "application/json", "encoding": "JSON", "data": "[0.5]"},
+    )
+    session = install_s3_client(FakeS3Client())
+    contract = Contract(InMemoryRecord(line), None, session,
+                        projection=Projection(exclude=frozenset(["id"])))
+    assert [c.name for c in contract.schema.inputs] == ["features"]
+    assert contract.schema.input_layout is None
+
+    request = Request.from_dict(json.loads(line), contract.schema)
+    assert list(request.build_input_tensors()["features"].double_val) == [1.5, 2.5]
@@ -0,0 +1,73 @@
+# pylint: disable=missing-function-docstring
+import copy
+from botocore.stub import Stubber
+from src.dedup import ObjectIdentity, ProcessedObjectLog, ObjectMarkers, BloomFilter
+from tests.config import S3_EVENT, CAPTURE_BUCKET
+from tests.config import s3_client, session
+
+
+def make_identity(key: str, sequencer: str = "0055AED6DCD90281E5") -> ObjectIdentity:
+    record = copy.deepcopy(S3_EVENT["Records"][0])
+    record["s3"]["object"]["key"] = key
+    record["s3"]["object"]["sequencer"] = sequencer
+    return ObjectIdentity.from_event_record(record)
+
+
+def test_processed_object_log_is_bounded():
+    log = ProcessedObjectLog(capacity=2)
+    first, second, third = make_identity("a"), make_identity("b"), make_identity("c")
+    log.add(first)
+    log.add(second)
+    assert first in log
+    log.add(third)
+    assert len(log) == 2
+    assert second not in log
+    assert first in log and third in log
+
+
+def test_redelivery_matches_identity():
+    assert make_identity("a") == make_identity("a")
+    assert make_identity("a").digest != make_identity("a", sequencer="other").digest
+
+
+def test_object_markers():
+    identity = make_identity("a")
+    markers = ObjectMarkers(CAPTURE_BUCKET, "markers/", session)
+    key = f"markers/{identity.digest}"
+    with Stubber(s3_client) as s3_stubber:
+        s3_stubber.add_client_error(
+            'head_object', service_error_code='404', http_status_code=404,
+            expected_params={'Bucket': CAPTURE_BUCKET, 'Key': key},
+        )
+        s3_stubber.add_response('put_object', {}, {
+            'Bucket': CAPTURE_BUCKET, 'Key': key, 'Body': b'', 'Metadata': {'source-key': 'a'},
+        })
+        s3_stubber.add_response(
+            'head_object', {}, {'Bucket': CAPTURE_BUCKET, 'Key': key},
+        )
+        assert not markers.exists(identity)
+        markers.mark(identity)
+        assert markers.exists(identity)
+        s3_stubber.assert_no_pending_responses()
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    items = [str(i).encode() for i in range(1000)]
+    assert all(bloom.add(item) for item in items[:500])
+    assert not any(bloom.add(item) for item in items[:500])
+    false_positives = sum(item in bloom for item in items[500:])
+    assert false_positives < 25
+    assert len(bloom._bits) < 2000  # pylint: disable=protected-access
+
+
+def test_bloom_filter_stops_remembering_when_full():
+    bloom = BloomFilter(capacity=100, error_rate=0.01)
+    items = iter(str(i).encode() for i in range(10000))
+    while not bloom.full:
+        bloom.add(next(items))
+    # Items past the capacity aren't remembered, so they don't saturate the filter
+    bits = bytes(bloom._bits)  # pylint: disable=protected-access
+    false_positives = sum(not bloom.add(item) for item in items)
+    assert bytes(bloom._bits) == bits  # pylint: disable=protected-access
+    assert false_positives < 9800 * 0.02
@@ -0,0 +1,71 @@
+# pylint: disable=missing-function-docstring
+import io
+import math
+import pytest
+from src.dtypes import infer_dtype, cast, split_row, parse_header, narrow_dtype
+from src.errors import ValueOutOfRange
+
+CELLS = [
+    ("186", "int64"),
+    ("-7", "int64"),
+    ("18446744073709551615", "uint64"),
+    ("0.1", "float64"),
+    ("1e-3", "float64"),
+    (".5", "float64"),
+    ("", "float64"),
+    ("NaN", "float64"),
+    ("inf", "float64"),
+    ("True", "bool"),
+    ("false", "bool"),
+    ("yes", "string"),
+    ("1_000", "string"),
+]
+
+
+@pytest.mark.parametrize("cell,dtype", CELLS)
+def test_infer_dtype(cell, dtype):
+    assert infer_dtype(cell) == dtype
+
+
+@pytest.mark.parametrize("cell,dtype", CELLS)
+def test_infer_dtype_matches_pandas(cell, dtype):
+    pd = pytest.importorskip("pandas")
+    inferred = pd.read_csv(io.StringIO(f"{cell},1\n"), header=None).dtypes[0].name
+    assert ("string" if inferred in ("object", "str", "string") else inferred) == dtype
+
+
+def test_cast():
+    assert cast("186", "int64") == 186
+    assert cast("0.01584203727543354", "float64") == 0.01584203727543354
+    assert math.isnan(cast("", "float64"))
+    assert cast("TRUE", "bool") is True
+    assert cast("abc", "string") == b"abc"
+    assert cast("2147483647", "int32") == 2147483647
+    with pytest.raises(ValueOutOfRange):
+        cast("2147483653", "int32")
+    assert cast("137.8", "float32") == 137.8
+    with pytest.raises(ValueOutOfRange):
+        cast("137.8123456", "float32")
+
+
+def test_split_row_honours_quotes():
+    assert split_row('1,"a,b",2') == ["1", "a,b", "2"]
+    assert split_row(b"\xef\xbb\xbfx,y") == ["x", "y"]
+
+
+def test_parse_header_mangles_duplicates():
+    assert parse_header(b"a,b,a,a") == ["a", "b", "a.1", "a.2"]
+
+
+@pytest.mark.parametrize("dtype,cells,narrowed", [
+    ("int64", ["186", "-7"], "int32"),
+    ("int64", ["186", "3000000000"], "int64"),
+    ("float64", ["137.8", "0.1", "25", "1e-3", "", "NaN", "-inf"], "float32"),
+    ("float64", ["0.01584203727543354"], "float64"),
+    ("float64", ["1234567"], "float64"),
+    ("float64", ["1e-40"], "float64"),
+    ("float64", ["1e39"], "float64"),
+    ("bool", ["True"], "bool"),
+])
+def test_narrow_dtype(dtype, cells, narrowed):
+    assert narrow_dtype(dtype, cells) == narrowed
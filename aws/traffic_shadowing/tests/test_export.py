@@ -0,0 +1,86 @@
+# pylint: disable=missing-function-docstring
+import io
+import json
+import pytest
+from src import errors, export
+from src.data import Contract, Request
+from src.projection import Projection
+from benchmarks.fakes import FakeS3Client, install_s3_client
+from benchmarks.run import InMemoryRecord
+
+pyarrow = pytest.importorskip("pyarrow")
+pytest.importorskip("pyarrow.parquet")
+
+
+def capture_line(i: int, data: str) -> bytes:
+    return json.dumps({
+        "captureData": {
+            "endpointInput": {"observedContentType": "text/csv", "encoding": "CSV", "data": data},
+            "endpointOutput": {"observedContentType": "text/csv", "encoding": "CSV", "data": "0.5"},
+        },
+        "eventMetadata": {"eventId": f"event-{i}", "inferenceTime": "2020-03-11T12:45:15Z"},
+        "eventVersion": "0",
+    }).encode()
+
+
+def exported(file_format: str, **contract_options) -> tuple:
+    lines = [capture_line(i, f"{i},{i / 4 if i % 3 else ''},a{i},True,{2 * i}") for i in range(1, 8)]
+    s3 = FakeS3Client()
+    session = install_s3_client(s3)
+    contract = Contract(InMemoryRecord(b"\n".join(lines)), InMemoryRecord(b"label,x,y,s,b,z\n"),
+                        session, **contract_options)
+    exporter = export.Exporter(contract.schema, file_format, row_group_rows=3)
+    for line in lines:
+        exporter.add(Request.from_dict(json.loads(line), contract.schema))
+    key = exporter.upload("bucket", "export/", "model", "capture/model/2020/file.jsonl.gz", session)
+    return key, s3.get_object(Bucket="bucket", Key=key)["Body"].read()
+
+
+def test_parquet_export_is_typed_and_partitioned():
+    key, body = exported(export.PARQUET)
+    assert key == "export/model=model/date=2020-03-11/file.parquet"
+    parquet = pyarrow.parquet.ParquetFile(io.BytesIO(body))
+    assert parquet.metadata.num_row_groups == 3
+    table = parquet.read()
+    assert table.schema.names == ["x", "y", "s", "b", "z", "label", "event_id", "inference_time"]
+    assert table.schema.field("x").type == pyarrow.int64()
+    assert table.schema.field("b").type == pyarrow.bool_()
+    assert table.column("x").to_pylist() == list(range(1, 8))
+    assert table.column("y").to_pylist()[:3] == [0.25, 0.5, None]
+    assert table.column("s").to_pylist()[0] == "a1"
+    assert table.column("event_id").to_pylist()[0] == "event-1"
+
+
+def test_arrow_export_of_packed_and_projected_columns():
+    _, body = exported(export.ARROW, pack=True, projection=Projection(exclude=frozenset(["s"])))
+    table = pyarrow.ipc.open_file(io.BytesIO(body)).read_all()
+    assert table.schema.names == ["y", "b", "x", "z", "label", "event_id", "inference_time"]
+    assert table.column("z").to_pylist() == list(range(2, 16, 2))
+
+
+def test_unknown_format():
+    with pytest.raises(errors.UnsupportedFormat):
+        exported("csv")
+
+
+def test_tensors_become_list_columns():
+    line = json.dumps({
+        "captureData": {
+            "endpointInput": {"observedContentType": "application/json", "encoding": "JSON",
+                              "data": json.dumps({"features": [[1, 2], [3, 4]], "name": "a"})},
+            "endpointOutput": {"observedContentType": "application/json", "encoding": "JSON",
+                               "data": "[0.5, 0.25]"},
+        },
+        "eventMetadata": {"eventId": "1", "inferenceTime": "2020-03-11T12:45:15Z"},
+        "eventVersion": "0",
+    }).encode()
+    s3 = FakeS3Client()
+    session = install_s3_client(s3)
+    contract = Contract(InMemoryRecord(line), None, session)
+    exporter = export.Exporter(contract.schema)
+    exporter.add(Request.from_dict(json.loads(line), contract.schema))
+    key = exporter.upload("bucket", "", "model", "file.jsonl", session)
+    table = pyarrow.parquet.read_table(io.BytesIO(s3.get_object(Bucket="bucket", Key=key)["Body"].read()))
+    assert table.column("features").to_pylist() == [[1, 2, 3, 4]]
+    assert table.column("name").to_pylist() == ["a"]
+    assert table.column("output_0").to_pylist() == [[0.5, 0.25]]
@@ -0,0 +1,35 @@
+import os
+import re
+import sys
+import subprocess
+
+# Cold start import budget of the handler module, in milliseconds
+IMPORT_TIME_BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', '500'))
+FUNCTION_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ('pandas', 'numpy', 'hydro_serving_grpc')
+
+
+def run_python(*args) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args], cwd=FUNCTION_ROOT, env=os.environ.copy(),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+
+
+def test_heavy_modules_are_imported_lazily():
+    result = run_python('-c', (
+        "import sys, src.handler; "
+        f"print(','.join(name for name in {LAZY_MODULES!r} if name in sys.modules))"
+    ))
+    assert result.stdout.strip() == ''
+
+
+def test_import_time_budget():
+    timings = []
+    for _ in range(3):
+        result = run_python('-X', 'importtime', '-c', 'import src.handler')
+        match = re.search(r'^import time:\s+\d+ \|\s+(\d+) \| src\.handler$', result.stderr, re.M)
+        assert match, result.stderr[-1000:]
+        timings.append(int(match.group(1)) / 1000)
+    assert min(timings) < IMPORT_TIME_BUDGET_MS, \
+        f"Importing src.handler took {min(timings):.0f} ms, the budget is {IMPORT_TIME_BUDGET_MS:.0f} ms"
@@ -0,0 +1,161 @@
+# pylint: disable=missing-function-docstring
+import json
+import uuid
+import pytest
+import requests_mock
+from botocore.stub import Stubber
+
+from src import handler
+from src.clients import RPCStubFactory
+from src.handler import lambda_handler
+from benchmarks.fakes import FakeS3Client, LocalModelPool, install_s3_client
+from tests.stubs.http.aws import ListObjectsV2Stub, GetObjectStub
+from tests.stubs.http.hydrosphere import ListModelsStub, ListModelVersionsStub
+from tests.stubs.rpc.monitoring import FakeMonitoringStub
+from tests.config import session, s3_client
+from tests.config import (
+    MODEL_NAME, VALID_MODEL_NAME, MODEL_VERSION_ID, CAPTURE_KEY, TRAIN_KEY,
+    TRAIN_FILENAME, CAPTURE_FILENAME, SQS_EVENT, TRAIN_BUCKET, CAPTURE_BUCKET,
+    TRAIN_PREFIX, BATCH_OPERATIONS_EVENT, CAPTURE_PREFIX, S3_EVENT,
+)
+
+
+@pytest.fixture
+def monitoring_stub(monkeypatch) -> FakeMonitoringStub:
+    stub = FakeMonitoringStub()
+    monkeypatch.setattr(
+        RPCStubFactory, "create_stub",
+        staticmethod(lambda service_stub, channel=None: stub),
+    )
+    return stub
+
+
+def test_sqs_batch(monitoring_stub: FakeMonitoringStub, capsys):
+    capture = GetObjectStub(CAPTURE_BUCKET, CAPTURE_KEY, CAPTURE_FILENAME)
+    with Stubber(s3_client) as s3_stubber, requests_mock.mock() as mock:
+        # Model and contract are resolved once for the first message
+        s3_stubber.add_response(
+            **ListObjectsV2Stub(TRAIN_BUCKET, f"{TRAIN_PREFIX}/{MODEL_NAME}").generate_response()
+        )
+        s3_stubber.add_response(**capture.generate_response())
+        s3_stubber.add_response(
+            **GetObjectStub(TRAIN_BUCKET, TRAIN_KEY, TRAIN_FILENAME).generate_response()
+        )
+        mock.get(**ListModelsStub(VALID_MODEL_NAME).generate_response())
+        mock.get(**ListModelVersionsStub(
+            MODEL_NAME, VALID_MODEL_NAME, model_version_id=MODEL_VERSION_ID,
+        ).generate_response())
+
+        # Captured requests are read once per message
+        s3_stubber.add_response(**capture.generate_response())
+        s3_stubber.add_response(**capture.generate_response())
+
+        result = lambda_handler(SQS_EVENT, "", session)
+        s3_stubber.assert_no_pending_responses()
+
+    assert result["batchItemFailures"] == [{"itemIdentifier": "message-4"}]
+    assert json.loads(result["body"])["detail"] == 4
+    assert len(monitoring_stub.Analyze.received) == 4
+
+    # Metrics of the invocation are emitted as a single EMF line
+    lines = [line for line in capsys.readouterr().out.splitlines() if '"_aws"' in line]
+    assert len(lines) == 1
+    document = json.loads(lines[0])
+    assert document["ModelName"] == MODEL_NAME
+    assert document["Requests"] == 4
+    assert document["AnalyzeP99"] >= document["AnalyzeP50"]
+    assert "SchemaInferenceTime" in document
+
+
+def test_requests_count_rows_of_mini_batches(monkeypatch):
+    s3 = FakeS3Client()
+    capture_key = f"{handler.S3_DATA_CAPTURE_PREFIX}/batch-model/capture.jsonl"
+    capture = b"\n".join(
+        json.dumps({
+            "captureData": {
+                "endpointInput": {"observedContentType": "text/csv", "encoding": "CSV", "data": inputs},
+                "endpointOutput": {"observedContentType": "text/csv", "encoding": "CSV", "data": outputs},
+            },
+            "eventMetadata": {"eventId": event_id, "inferenceTime": "2020-03-11T12:45:15Z"},
+        }).encode()
+        for event_id, inputs, outputs in (("mini-batch", "1,a\n3,b", "0.5\n0.25"), ("row", "5,c", "0.75"))
+    )
+    s3.put_object(Bucket=handler.S3_DATA_CAPTURE_BUCKET, Key=capture_key, Body=capture)
+    s3.put_object(Bucket=handler.S3_DATA_TRAINING_BUCKET,
+                  Key=f"{handler.S3_DATA_TRAINING_PREFIX}/batch-model/train.csv", Body=b"label,x,y\n0.5,1,a\n")
+    monkeypatch.setattr(handler, "ModelPool", LocalModelPool)
+    event = {'Records': [{'s3': {
+        'bucket': {'name': handler.S3_DATA_CAPTURE_BUCKET},
+        'object': {'key': capture_key, 'eTag': '', 'sequencer': uuid.uuid4().hex},
+    }}]}
+
+    body = json.loads(lambda_handler(event, None, install_s3_client(s3))["body"])
+    # Requests count rows, sampling counts capture lines
+    assert body["detail"] == 3
+    assert body["sampled"] == 2
+
+
+def test_batch_operations(monitoring_stub: FakeMonitoringStub):
+    capture = GetObjectStub(CAPTURE_BUCKET, CAPTURE_KEY, CAPTURE_FILENAME)
+    with Stubber(s3_client) as s3_stubber, requests_mock.mock() as mock:
+        s3_stubber.add_response(
+            **ListObjectsV2Stub(TRAIN_BUCKET, f"{TRAIN_PREFIX}/{MODEL_NAME}").generate_response()
+        )
+        s3_stubber.add_response(**capture.generate_response())
+        s3_stubber.add_response(
+            **GetObjectStub(TRAIN_BUCKET, TRAIN_KEY, TRAIN_FILENAME).generate_response()
+        )
+        mock.get(**ListModelsStub(VALID_MODEL_NAME).generate_response())
+        mock.get(**ListModelVersionsStub(
+            MODEL_NAME, VALID_MODEL_NAME, model_version_id=MODEL_VERSION_ID,
+        ).generate_response())
+        s3_stubber.add_response(**capture.generate_response())
+
+        result = lambda_handler(BATCH_OPERATIONS_EVENT, "", session)
+        s3_stubber.assert_no_pending_responses()
+
+    assert result["invocationId"] == BATCH_OPERATIONS_EVENT["invocationId"]
+    assert result["treatMissingKeysAs"] == "PermanentFailure"
+    assert [item["resultCode"] for item in result["results"]] == [
+        "Succeeded", "PermanentFailure"
+    ]
+    assert len(monitoring_stub.Analyze.received) == 2
+
+
+def test_warmup(monitoring_stub: FakeMonitoringStub):
+    capture = GetObjectStub(CAPTURE_BUCKET, CAPTURE_KEY, CAPTURE_FILENAME)
+    endpoint = f"{CAPTURE_PREFIX}/{MODEL_NAME}/"
+    with Stubber(s3_client) as s3_stubber, requests_mock.mock() as mock:
+        # Recent capture files are discovered endpoint by endpoint
+        s3_stubber.add_response(
+            'list_objects_v2', {'CommonPrefixes': [{'Prefix': endpoint}]},
+            {'Bucket': CAPTURE_BUCKET, 'Prefix': f"{CAPTURE_PREFIX}/", 'Delimiter': '/'},
+        )
+        s3_stubber.add_response(
+            'list_objects_v2', {'CommonPrefixes': [{'Prefix': f"{endpoint}AllTraffic/"}]},
+            {'Bucket': CAPTURE_BUCKET, 'Prefix': endpoint, 'Delimiter': '/'},
+        )
+        s3_stubber.add_response('list_objects_v2', {'Contents': [{'Key': CAPTURE_KEY}]})
+        s3_stubber.add_response(
+            **ListObjectsV2Stub(TRAIN_BUCKET, f"{TRAIN_PREFIX}/{MODEL_NAME}").generate_response()
+        )
+        s3_stubber.add_response(**capture.generate_response())
+        s3_stubber.add_response(
+            **GetObjectStub(TRAIN_BUCKET, TRAIN_KEY, TRAIN_FILENAME).generate_response()
+        )
+        mock.get(**ListModelsStub(VALID_MODEL_NAME).generate_response())
+        mock.get(**ListModelVersionsStub(
+            MODEL_NAME, VALID_MODEL_NAME, model_version_id=MODEL_VERSION_ID,
+        ).generate_response())
+
+        result = lambda_handler({"action": "warmup"}, "", session)
+        s3_stubber.assert_no_pending_responses()
+        assert json.loads(result["body"])["models"] == [MODEL_NAME]
+        assert not monitoring_stub.Analyze.received
+
+        # The following invocation reuses the warm contract and model
+        s3_stubber.add_response(**capture.generate_response())
+        lambda_handler(S3_EVENT, "", session)
+        s3_stubber.assert_no_pending_responses()
+
+    assert monitoring_stub.Analyze.received
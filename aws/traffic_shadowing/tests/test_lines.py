@@ -0,0 +1,61 @@
+# pylint: disable=missing-function-docstring
+import io
+import json
+import tracemalloc
+import pytest
+from botocore.response import StreamingBody
+from src import lines
+from src.lines import iter_line_batches
+
+
+def capture(rows: int) -> bytes:
+    return b''.join(
+        json.dumps({"eventMetadata": {"eventId": str(i)}, "data": "x" * (i % 97)}).encode() + b'\n'
+        for i in range(rows)
+    )
+
+
+class ReadOnlyStream:
+    """Stream without readinto, like older botocore bodies."""
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 4096])
+@pytest.mark.parametrize("wrap", [
+    io.BytesIO,
+    ReadOnlyStream,
+    lambda data: StreamingBody(io.BytesIO(data), len(data)),
+])
+def test_lines_match_splitlines(chunk_size, wrap):
+    data = b'first\r\n\nsecond line\n' + b'long' * 100 + b'\nlast'
+    result = [bytes(line) for batch in iter_line_batches(wrap(data), chunk_size) for line in batch]
+    assert result == [b'first', b'second line', b'long' * 100, b'last']
+
+
+def test_loads_without_orjson(monkeypatch):
+    monkeypatch.setattr(lines, 'orjson', None)
+    assert lines.loads(memoryview(b'{"a": [1, 2]}')) == {"a": [1, 2]}
+    assert lines.loads(b'{"a": 1}') == {"a": 1}
+
+
+def peak_memory(data: bytes) -> int:
+    tracemalloc.start()
+    try:
+        for batch in iter_line_batches(io.BytesIO(data), 16 * 1024):
+            for line in batch:
+                lines.loads(line)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_peak_memory_does_not_grow_with_file_size():
+    small, large = capture(1000), capture(20000)
+    assert len(large) > 15 * len(small)
+    small_peak, large_peak = peak_memory(small), peak_memory(large)
+    assert large_peak < 1.5 * small_peak + 16 * 1024
+    assert large_peak < len(large) / 10
@@ -0,0 +1,52 @@
+# pylint: disable=missing-function-docstring
+import json
+import logging
+from src import log
+
+
+def test_json_lines(capsys):
+    log.configure('INFO', 'json')
+    log.bind(requestId='request-1')
+    logger = logging.getLogger('main')
+    logger.debug("Hidden %s", 'message')
+    logger.info("Shadowed %d requests", 4)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("Failed")
+    log.flush()
+    log.bind(requestId=None)
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line['message'] for line in lines] == ["Shadowed 4 requests", "Failed"]
+    assert lines[0]['level'] == 'INFO'
+    assert lines[0]['requestId'] == 'request-1'
+    assert 'ValueError: boom' in lines[1]['exception']
+
+
+def test_row_logger_is_disabled_above_debug():
+    logger = logging.getLogger('tests.rows.disabled')
+    logger.setLevel(logging.INFO)
+    rows = log.RowLogger(logger)
+
+    class Unformattable:
+        def __str__(self):
+            raise AssertionError("Arguments should not be evaluated")
+
+    assert not rows.enabled
+    rows.debug("Row %s", Unformattable())
+
+
+def test_row_logger_rate_limit(caplog):
+    logger = logging.getLogger('tests.rows.limited')
+    logger.setLevel(logging.DEBUG)
+    rows = log.RowLogger(logger, rate=5)
+    with caplog.at_level(logging.DEBUG, logger='tests.rows.limited'):
+        for i in range(100):
+            rows.debug("Row %d", i)
+        rows._allowance = 1
+        rows.debug("Row %d", 100)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages[:5] == ["Row 0", "Row 1", "Row 2", "Row 3", "Row 4"]
+    assert messages[-1] == "Row 100 (95 similar messages suppressed)"
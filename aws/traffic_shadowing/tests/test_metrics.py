@@ -0,0 +1,77 @@
+import io
+import json
+import random
+from src import metrics
+from src.metrics import Histogram, Collector, NullCollector
+
+
+def test_histogram_bounds_are_contiguous():
+    histogram = Histogram(significant_bits=5)
+    expected = 0
+    for index in range(200):
+        low, high = histogram.bounds(index)
+        assert low == expected
+        assert histogram._index(low) == index
+        assert histogram._index(high) == index
+        expected = high + 1
+
+
+def test_histogram_percentiles():
+    values = [random.Random(42).randint(1, 100000) for _ in range(10000)]
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    for q in (50, 90, 99):
+        exact = values[int(q / 100 * len(values)) - 1]
+        assert abs(histogram.percentile(q) - exact) <= exact / 16 + 1
+    assert histogram.max == values[-1]
+    assert histogram.count == len(values)
+
+
+def test_histogram_merge():
+    first, second, merged = Histogram(), Histogram(), Histogram()
+    for value in range(100):
+        first.record(value)
+        merged.record(value)
+    for value in range(1000, 1100):
+        second.record(value)
+        merged.record(value)
+    first.merge(second)
+    assert first.counts == merged.counts
+    assert (first.min, first.max, first.total) == (merged.min, merged.max, merged.total)
+
+
+def test_collector_emits_emf():
+    collector = Collector(namespace='Test')
+    collector.set_model('model')
+    with collector.timer('Parse'):
+        pass
+    for _ in range(3):
+        with collector.timer('Analyze', histogram=True):
+            pass
+    collector.increment('Requests', 3)
+
+    stream = io.StringIO()
+    collector.emit(stream)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    document = json.loads(lines[0])
+    definition = document['_aws']['CloudWatchMetrics'][0]
+    assert definition['Namespace'] == 'Test'
+    assert ['FunctionName', 'ModelName'] in definition['Dimensions']
+    names = {metric['Name'] for metric in definition['Metrics']}
+    assert {'ParseTime', 'AnalyzeTime', 'InvocationTime', 'Requests',
+            'AnalyzeP50', 'AnalyzeP99', 'AnalyzeMax'} <= names
+    assert all(name in document for name in names)
+    assert document['ModelName'] == 'model'
+    assert document['Requests'] == 3
+    assert sum(document['AnalyzeHistogram'].values()) == 3
+
+
+def test_collector_per_thread(monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+    assert isinstance(metrics.start(), NullCollector)
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    collector = metrics.start()
+    assert metrics.current() is collector
@@ -1,9 +1,13 @@
 # pylint: disable=protected-access,missing-function-docstring
+import json
+import time
 import pytest
 import requests_mock
-from src.model_pool import ModelPool
+from src import metrics
+from src.model_pool import ModelPool, contract_differences
+from src.data import SchemaDescription, ColumnDescription
 from src.errors import (
-    ModelNotFound, DataUploadFailed, ApiNotAvailable
+    ModelNotFound, DataUploadFailed, ApiNotAvailable, ContractMismatch
 )
 from tests.stubs.http.hydrosphere import (
     ListModelsStub, ListModelVersionsStub, RegisterExternalModelStub,
@@ -158,7 +162,9 @@ def test_create_model():
         assert model.model_version_id == MODEL_VERSION_ID
 
 
-def test_get_or_create_model():
+def test_get_or_create_model(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    collector = metrics.start()
     with requests_mock.mock(real_http=False) as mock:
         mock.get(**ListModelsStub().generate_response())
         mock.get(**ListModelVersionsStub(
@@ -179,6 +185,50 @@ def test_get_or_create_model():
         ).generate_response())
 
         pool = ModelPool(HYDROSPHERE_ENDPOINT)
+        wait = pool._wait_for_data_processing
+        monkeypatch.setattr(pool, "_wait_for_data_processing",
+                            lambda model_version_id: time.sleep(0.05) or wait(model_version_id))
         model = pool.get_or_create_model(MODEL_NAME, SCHEMA, TRAIN_KEY_FULL)
         assert model.name == VALID_MODEL_NAME
         assert model.model_version_id == MODEL_VERSION_ID
+    # Registration isn't a part of the lookup
+    assert collector.timings["ModelRegistration"] >= 50_000_000 > collector.timings["ModelLookup"]
+
+
+def test_get_or_create_model_with_another_contract():
+    narrowed = SchemaDescription(
+        inputs=[ColumnDescription("Account Length", "int32", "DT_INT32", ())] + SCHEMA.inputs[1:],
+        outputs=SCHEMA.outputs,
+    )
+    with requests_mock.mock(real_http=False) as mock:
+        mock.get(**ListModelsStub(MODEL_NAME).generate_response())
+        mock.get(**ListModelVersionsStub(MODEL_NAME).generate_response())
+        pool = ModelPool(HYDROSPHERE_ENDPOINT)
+        assert pool.get_or_create_model(MODEL_NAME, SCHEMA, TRAIN_KEY_FULL, check_contract=True)
+        assert pool.get_or_create_model(MODEL_NAME, narrowed, TRAIN_KEY_FULL).name == MODEL_NAME
+        with pytest.raises(ContractMismatch, match="Account Length"):
+            pool.get_or_create_model(MODEL_NAME, narrowed, TRAIN_KEY_FULL, check_contract=True)
+
+
+def test_contract_differences():
+    contract = ListModelVersionsStub(MODEL_NAME).service_response["modelContract"]
+    assert contract_differences(contract, SCHEMA) == []
+    assert contract_differences({}, SCHEMA) == []
+    packed = SchemaDescription(
+        inputs=[ColumnDescription("input_float64", "float64", "DT_DOUBLE", (4,), ("a", "b", "c", "d"))],
+        outputs=SCHEMA.outputs,
+    )
+    assert len(contract_differences(contract, packed)) == 5
+
+
+def test_registration_of_packed_features():
+    schema = SchemaDescription(
+        inputs=[ColumnDescription("input_float64", "float64", "DT_DOUBLE", (2,), ("a", "b"))],
+        outputs=[ColumnDescription("label", "int64", "DT_INT64", ())],
+    )
+    pool = ModelPool(HYDROSPHERE_ENDPOINT)
+    body = pool._create_registration_request_body(VALID_MODEL_NAME, schema, {"key": "value"})
+    assert json.loads(body["metadata"]["features.input_float64"]) == ["a", "b"]
+    assert body["metadata"]["key"] == "value"
+    feature, = body["contract"]["predict"]["inputs"]
+    assert feature["shape"]["dim"] == [{"size": 2, "name": "a,b"}]
@@ -0,0 +1,52 @@
+import os
+import random
+import pytest
+from src import profiling
+from src.profiling import Profiler, merge_profiles, parse_modes
+
+
+def work():
+    return sorted(str(i) for i in range(10000))
+
+
+def test_parse_modes():
+    assert parse_modes('') == []
+    assert parse_modes('cpu, memory') == ['cpu', 'memory']
+    with pytest.raises(ValueError):
+        parse_modes('gpu')
+
+
+def test_profiles_are_written(tmp_path):
+    with Profiler('invocation', ['cpu', 'memory'], str(tmp_path)) as profiler:
+        work()
+    assert sorted(os.path.basename(path) for path in profiler.paths) == [
+        'invocation.allocations.txt', 'invocation.pstats'
+    ]
+    with open(tmp_path / 'invocation.allocations.txt') as file:
+        assert file.readline().startswith('current=')
+
+
+def test_merge_profiles(tmp_path):
+    paths = []
+    for name in ('first', 'second'):
+        with Profiler(name, ['cpu'], str(tmp_path)) as profiler:
+            work()
+        paths.extend(profiler.paths)
+    output = str(tmp_path / 'merged.pstats')
+    stats = merge_profiles(paths, output)
+    calls = [
+        stat[1] for func, stat in stats.stats.items() if func[2] == 'work'
+    ]
+    assert calls == [2]
+    assert os.path.exists(output)
+
+
+def test_sampling(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', 'cpu')
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_PERCENT', 30.0)
+    rng = random.Random(42)
+    enabled = sum(Profiler.from_env('id', rng=rng).enabled for _ in range(1000))
+    assert 250 < enabled < 350
+
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', '')
+    assert not Profiler.from_env('id').enabled
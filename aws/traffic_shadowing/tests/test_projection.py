@@ -0,0 +1,29 @@
+# pylint: disable=missing-function-docstring
+import pytest
+from src import projection
+from src.projection import Projection
+
+
+def test_parse_projections():
+    assert projection.parse_projections("") == {"*": Projection()}
+    assert projection.parse_projections('{"exclude": ["id"]}') == \
+        {"*": Projection(exclude=frozenset(["id"]))}
+    projections = projection.parse_projections('{"model-a": {"include": ["x", "y"]}}')
+    assert projection.for_model(projections, "model-a") == Projection(include=frozenset(["x", "y"]))
+    assert projection.for_model(projections, "model-b") == Projection()
+    with pytest.raises(ValueError):
+        projection.parse_projections('{"model-a": {"include": ["x"], "exclude": ["y"]}}')
+
+
+def test_positions():
+    names = ["id", "x", "y", "label"]
+    assert Projection().positions(names) == [0, 1, 2, 3]
+    assert Projection(include=frozenset(["y", "x"])).positions(names) == [1, 2]
+    assert Projection(exclude=frozenset(["id"])).positions(names) == [1, 2, 3]
+
+
+def test_unknown_names():
+    names = ["id", "x", "label"]
+    assert Projection().unknown(names) == frozenset()
+    assert Projection(include=frozenset(["x", "z"])).unknown(names) == frozenset(["z"])
+    assert Projection(exclude=frozenset(["Id"])).unknown(names) == frozenset(["Id"])
@@ -0,0 +1,42 @@
+# pylint: disable=missing-function-docstring
+import json
+import uuid
+import pytest
+from src.sampling import Sampler, parse_sampling_rates, extract_event_id
+
+
+def make_line(event_id: str) -> bytes:
+    return json.dumps({
+        "captureData": {},
+        "eventMetadata": {"eventId": event_id, "inferenceTime": "2020-03-11T12:45:15Z"},
+    }).encode()
+
+
+def test_parse_sampling_rates():
+    assert parse_sampling_rates("") == {"*": 1.0}
+    assert parse_sampling_rates("0.25") == {"*": 0.25}
+    assert parse_sampling_rates('{"model-a": 0.1, "*": 0.5}') == {"model-a": 0.1, "*": 0.5}
+    assert parse_sampling_rates('{"model-a": 0.1}') == {"model-a": 0.1, "*": 1.0}
+    with pytest.raises(ValueError):
+        parse_sampling_rates("1.5")
+
+
+def test_extract_event_id():
+    assert extract_event_id(make_line("abc")) == b"abc"
+    assert extract_event_id(b'{"captureData": {}}') is None
+
+
+def test_sampling_is_deterministic():
+    lines = [make_line(str(uuid.uuid4())) for _ in range(2000)]
+    first, second = Sampler(0.3), Sampler(0.3)
+    decisions = [first.accept(line) for line in lines]
+    assert decisions == [second.accept(line) for line in lines]
+    assert first.sampled + first.dropped == len(lines)
+    assert 0.25 < first.sampled / len(lines) < 0.35
+
+
+def test_sampling_rate_per_model():
+    rates = parse_sampling_rates('{"model-a": 0.0, "*": 1.0}')
+    line = make_line("abc")
+    assert not Sampler.for_model(rates, "model-a").accept(line)
+    assert Sampler.for_model(rates, "model-b").accept(line)
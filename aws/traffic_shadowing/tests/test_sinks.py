@@ -0,0 +1,232 @@
+# pylint: disable=missing-function-docstring
+import json
+from concurrent.futures import Future
+import grpc
+import pytest
+from hydro_serving_grpc.monitoring.api_pb2 import ExecutionInformation
+from hydro_serving_grpc.monitoring.metadata_pb2 import ExecutionMetadata
+from src import loader, metrics, sinks
+from src.clients import parse_endpoints
+from src.data import Contract, Request
+from src.model import Model
+from benchmarks.fakes import FakeS3Client, install_s3_client
+from benchmarks.run import InMemoryRecord
+from tests.stubs.rpc.monitoring import FakeMonitoringStub, FakeRpcError
+
+
+def messages(model_name: str = "model", count: int = 3) -> list:
+    return [
+        ExecutionInformation(metadata=ExecutionMetadata(model_name=model_name, request_id=str(i)))
+        for i in range(count)
+    ]
+
+
+def test_parse_sink():
+    assert sinks.parse_sink("") == sinks.GRPC
+    assert sinks.parse_sink("Null") == sinks.NULL
+    with pytest.raises(ValueError):
+        sinks.parse_sink("kafka")
+    with pytest.raises(ValueError):
+        sinks.create(sinks.FILE)
+
+
+def test_null_sink_counts_messages():
+    sink = sinks.create(sinks.NULL)
+    for message in messages():
+        sink.send(message)
+    assert sink.count == 3
+    assert sink.flush() == []
+
+
+def test_sinks_must_implement_send():
+    class Incomplete(sinks.Sink):  # pylint: disable=too-few-public-methods
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_grpc_sink_retries_transient_failures():
+    stub = FakeMonitoringStub(failures=[True, False])
+    sink = sinks.GrpcSink(stub, retries=1)
+    message, = messages(count=1)
+    sink.send(message)
+    assert stub.Analyze.received == [message]
+    assert sink.count == 1
+
+
+def test_grpc_sink_breaker_counts_messages_not_attempts(monkeypatch):
+    monkeypatch.setattr(sinks.time, "sleep", lambda seconds: None)
+    # Two messages succeed on their last attempt, two more fail all of them
+    stub = FakeMonitoringStub(failures=[True, True, False] * 2 + [True] * 6)
+    sink = sinks.GrpcSink(stub, retries=2, breaker_threshold=2)
+    first, second, third, fourth, fifth = messages(count=5)
+    sink.send(first)
+    sink.send(second)
+    assert not sink.breaker.opened
+    for message in (third, fourth):
+        with pytest.raises(grpc.RpcError):
+            sink.send(message)
+    assert sink.breaker.opened and stub.Analyze.calls == 12
+    with pytest.raises(sinks.CircuitOpen):
+        sink.send(fifth)
+
+
+@pytest.mark.parametrize("codec,suffix", [("gzip", ".bin.gz"), ("zstd", ".bin.zst"), ("none", ".bin")])
+def test_local_archives_are_loaded(tmp_path, codec, suffix):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    sink = sinks.FileSink(str(tmp_path), codec)
+    for message in messages("a") + messages("b", 2):
+        sink.send(message)
+    locations = sink.flush()
+    assert len(locations) == 2
+    assert all(location.endswith(suffix) for location in locations)
+    assert sink.count == 5 and sink.flush() == []
+
+    stub = FakeMonitoringStub(failures=[False, True])
+    reader = loader.ArchiveReader(str(tmp_path))
+    assert loader.load(reader, stub, concurrency=2, delete=True) == (4, {locations[0]: 1})
+    assert sorted((m.metadata.model_name, m.metadata.request_id) for m in stub.Analyze.received) == \
+        [("a", "0"), ("a", "2"), ("b", "0"), ("b", "1")]
+    # The archive loaded completely is deleted, the other one keeps only the undelivered message
+    assert list(reader.list_keys()) == [locations[0]]
+    assert [ExecutionInformation.FromString(item).metadata.request_id
+            for item in reader.read(locations[0])] == ["1"]
+
+    stub = FakeMonitoringStub()
+    assert loader.load(reader, stub, delete=True) == (1, {})
+    assert list(reader.list_keys()) == []
+
+
+def test_s3_archives_are_split_by_size():
+    s3 = FakeS3Client()
+    session = install_s3_client(s3)
+    sink = sinks.FileSink("s3://bucket/archive", max_bytes=1, session=session)
+    for message in messages():
+        sink.send(message)
+    assert sink.flush() == []
+    assert len(s3.objects) == 3
+    assert all(key.startswith("archive/model/") for _, key in s3.objects)
+
+    reader = loader.ArchiveReader("s3://bucket/archive", session)
+    stub = FakeMonitoringStub()
+    assert loader.load(reader, stub) == (3, {})
+    assert sorted(m.metadata.request_id for m in stub.Analyze.received) == ["0", "1", "2"]
+    assert len(list(reader.list_keys())) == 3
+
+
+class PendingAnalyze:
+    """Analyze calls, which stay pending until completed by the test."""
+    def __init__(self):
+        self.futures = []
+
+    def future(self, message, **kwargs) -> Future:
+        future = Future()
+        self.futures.append((message, future))
+        return future
+
+
+def test_parse_endpoints():
+    assert parse_endpoints("http://prod") == ["http://prod"]
+    assert parse_endpoints(" http://prod, http://staging ,") == ["http://prod", "http://staging"]
+    with pytest.raises(ValueError):
+        parse_endpoints(" , ")
+
+
+def test_mirror_sink_sheds_messages_instead_of_waiting():
+    stub = FakeMonitoringStub()
+    stub.Analyze = PendingAnalyze()
+    sink = sinks.MirrorSink("http://staging", max_in_flight=2, stub=stub)
+    for payload in (b"a", b"b", b"c"):
+        sink.send_serialized("model", payload)
+    assert [message for message, _ in stub.Analyze.futures] == [b"a", b"b"]
+    assert sink.shed == 1
+
+    stub.Analyze.futures[0][1].set_result(None)
+    sink.send_serialized("model", b"d")
+    assert [message for message, _ in stub.Analyze.futures] == [b"a", b"b", b"d"]
+    for _, future in stub.Analyze.futures[1:]:
+        future.set_result(None)
+    sink.flush()
+    assert (sink.count, sink.shed, sink.failed) == (3, 1, 0)
+
+
+def test_mirror_sink_retries_and_counts_failures():
+    stub = FakeMonitoringStub(failures=[True, True, True])
+    sink = sinks.MirrorSink("http://staging", retries=1, stub=stub)
+    sink.send_serialized("model", b"a")
+    sink.send_serialized("model", b"b")
+    sink.flush()
+    # The first message fails twice, the second one is sent again once
+    assert stub.Analyze.received == [b"b"]
+    assert (sink.count, sink.failed) == (1, 1)
+
+
+def test_mirror_sink_backs_off_before_retrying(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(sinks.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(sinks.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    collector = metrics.start()
+    stub = FakeMonitoringStub()
+    stub.Analyze = PendingAnalyze()
+    sink = sinks.MirrorSink("http://staging", max_in_flight=2, retries=1, stub=stub, backoff=1.0)
+    sink.send_serialized("model", b"a")
+    stub.Analyze.futures[0][1].set_exception(FakeRpcError())
+
+    # The retry waits for its not-before time and holds its slot meanwhile
+    sink.send_serialized("model", b"b")
+    sink.send_serialized("model", b"c")
+    assert [message for message, _ in stub.Analyze.futures] == [b"a", b"b"]
+    clock[0] += 1.0
+    stub.Analyze.futures[1][1].set_exception(FakeRpcError(grpc.StatusCode.INVALID_ARGUMENT))
+    sink.send_serialized("model", b"d")
+    assert [message for message, _ in stub.Analyze.futures] == [b"a", b"b", b"a", b"d"]
+    stub.Analyze.futures[2][1].set_result(None)
+    stub.Analyze.futures[3][1].set_result(None)
+    sink.flush()
+    assert (sink.count, sink.shed, sink.failed) == (2, 1, 1)
+    assert (collector.counts["MirrorRetries"], collector.counts["MirrorShed"],
+            collector.counts["MirrorFailures"]) == (1, 1, 1)
+
+
+def test_mirror_sink_settles_calls_behind_waiting_retries(monkeypatch):
+    monkeypatch.setattr(sinks.time, "monotonic", lambda: 100.0)
+    stub = FakeMonitoringStub()
+    stub.Analyze = PendingAnalyze()
+    sink = sinks.MirrorSink("http://staging", max_in_flight=2, stub=stub, backoff=1.0)
+    sink.send_serialized("model", b"a")
+    stub.Analyze.futures[0][1].set_exception(FakeRpcError())
+    sink.send_serialized("model", b"b")
+    stub.Analyze.futures[1][1].set_result(None)
+    # The retry of "a" isn't due yet, but the finished call frees its slot
+    sink.send_serialized("model", b"c")
+    assert [message for message, _ in stub.Analyze.futures] == [b"a", b"b", b"c"]
+    assert (sink.count, sink.shed) == (1, 0)
+
+
+def test_shared_encoding_is_completed_per_model():
+    line = json.dumps({
+        "captureData": {
+            "endpointInput": {"observedContentType": "text/csv", "encoding": "CSV", "data": "1,a"},
+            "endpointOutput": {"observedContentType": "text/csv", "encoding": "CSV", "data": "0.5"},
+        },
+        "eventMetadata": {"eventId": "event", "inferenceTime": "2020-03-11T12:45:15Z"},
+        "eventVersion": "0",
+    })
+    session = install_s3_client(FakeS3Client())
+    contract = Contract(InMemoryRecord(line.encode()), InMemoryRecord(b"label,x,y\n"), session)
+    request = Request.from_dict(json.loads(line), contract.schema)
+
+    primary_stub, mirror_stub = FakeMonitoringStub(), FakeMonitoringStub()
+    primary = Model("model", 1, 1, sink=sinks.GrpcSink(FakeMonitoringStub(), raw_stub=primary_stub))
+    mirror = Model("model", 1, 7, sink=sinks.MirrorSink("http://staging", stub=mirror_stub))
+    shared = primary.encode_shared(request)
+    assert primary.analyse(request, shared) and mirror.analyse(request, shared)
+    mirror.sink.flush()
+
+    for model, stub in ((primary, primary_stub), (mirror, mirror_stub)):
+        payload, = stub.Analyze.received
+        assert ExecutionInformation.FromString(payload) == \
+            model.compose_execution_information_proto(request)
@@ -0,0 +1,201 @@
+# pylint: disable=missing-function-docstring
+import gzip
+import json
+import uuid
+import pytest
+from botocore.stub import Stubber, ANY
+from hydro_serving_grpc.monitoring.api_pb2 import ExecutionInformation
+from hydro_serving_grpc.monitoring.metadata_pb2 import ExecutionMetadata
+from src.clients import RPCStubFactory
+from src.data import Record, Request
+from src.model import Model, send_concurrently
+from src.model_pool import ModelPool
+from src.sinks import GrpcSink
+from src.spool import Spool, SpoolReader, encode_delimited, iter_delimited
+from src import handler
+from src import sinks
+from benchmarks.fakes import FakeS3Client, install_s3_client
+from benchmarks.generators import CaptureGenerator, CaptureSpec
+from tests.stubs.http.aws import GetObjectStub
+from tests.stubs.rpc.monitoring import FakeAnalyze, FakeMonitoringStub
+from tests.config import (
+    CAPTURE_BUCKET, CAPTURE_KEY, CAPTURE_FILENAME, VALID_MODEL_NAME, MODEL_VERSION_ID, SCHEMA,
+)
+from tests.config import s3_client, session
+
+
+def read_requests():
+    with Stubber(s3_client) as s3_stubber:
+        s3_stubber.add_response(
+            **GetObjectStub(CAPTURE_BUCKET, CAPTURE_KEY, CAPTURE_FILENAME).generate_response()
+        )
+        record = Record(CAPTURE_BUCKET, CAPTURE_KEY, session)
+        return [Request.from_dict(json.loads(line), SCHEMA) for line in record.read()]
+
+
+def test_delimited_roundtrip():
+    payloads = [b"", b"x", b"y" * 300, bytes(range(256)) * 100]
+    stream = b"".join(encode_delimited(payload) for payload in payloads)
+    assert list(iter_delimited(stream)) == payloads
+
+
+def test_analyse_spools_rejected_request():
+    spool = Spool(CAPTURE_BUCKET, "spool", session)
+    sink = GrpcSink(FakeMonitoringStub(failures=[True, False]), retries=0)
+    model = Model(VALID_MODEL_NAME, 1, MODEL_VERSION_ID, spool=spool, sink=sink)
+
+    requests = read_requests()
+    assert [model.analyse(request) for request in requests] == [False, True]
+    assert len(spool) == 1
+
+    with Stubber(s3_client) as s3_stubber:
+        s3_stubber.add_response('put_object', {}, {
+            'Bucket': CAPTURE_BUCKET,
+            'Key': ANY,
+            'Body': ANY,
+            'ContentType': 'application/octet-stream',
+            'ContentEncoding': 'gzip',
+        })
+        keys = spool.flush()
+        s3_stubber.assert_no_pending_responses()
+
+    assert len(keys) == 1
+    assert keys[0].startswith(f"spool/{VALID_MODEL_NAME}/")
+    assert len(spool) == 0
+
+
+def test_spool_reader_and_replay():
+    model = Model(VALID_MODEL_NAME, 1, MODEL_VERSION_ID)
+    messages = [model.compose_execution_information_proto(r) for r in read_requests()]
+    body = gzip.compress(b"".join(encode_delimited(m.SerializeToString()) for m in messages))
+
+    with Stubber(s3_client) as s3_stubber:
+        s3_stubber.add_response(
+            'get_object',
+            GetObjectStub.from_bytes(body),
+            {'Bucket': CAPTURE_BUCKET, 'Key': 'spool/file.bin.gz'},
+        )
+        reader = SpoolReader(CAPTURE_BUCKET, 'spool', session)
+        restored = list(reader.read('spool/file.bin.gz'))
+
+    assert restored == [m.SerializeToString() for m in messages]
+
+    stub = FakeMonitoringStub(failures=[False, True])
+    failed = send_concurrently(stub, messages, max_in_flight=1)
+    assert failed == messages[1:]
+    assert stub.Analyze.received == messages[:1]
+
+
+
+class OfflineModelPool(ModelPool):
+    def get_or_create_model(self, name, schema, training_file, metadata=None,
+                            check_contract=False) -> Model:
+        return self.make_model(name, 1, 1)
+
+
+class Context:
+    """Lambda context, which runs out of time after the given number of rows."""
+    def __init__(self, rows=None):
+        self.rows = rows
+        self.checks = 0
+
+    def get_remaining_time_in_millis(self) -> int:
+        self.checks += 1
+        return 1000 if self.rows is not None and self.checks > self.rows else 200000
+
+
+def shadow_during_outage(monkeypatch, context: Context, rows: int, breaker_threshold: int):
+    """Shadow a capture file, while every Analyze call fails. Return the stub, sleeps and the spool."""
+    s3 = FakeS3Client()
+    session = install_s3_client(s3)
+    generator = CaptureGenerator(CaptureSpec(rows=rows, columns=4, outputs=1))
+    capture_key = f"{handler.S3_DATA_CAPTURE_PREFIX}/outage-model/capture.jsonl"
+    training_key = f"{handler.S3_DATA_TRAINING_PREFIX}/outage-model/train.csv"
+    s3.put_object(Bucket=handler.S3_DATA_CAPTURE_BUCKET, Key=capture_key, Body=generator.capture_file())
+    s3.put_object(Bucket=handler.S3_DATA_TRAINING_BUCKET, Key=training_key, Body=generator.training_file())
+
+    stub, sleeps = FakeMonitoringStub(failures=[True] * 10000), []
+    monkeypatch.setattr(RPCStubFactory, "create_stub", staticmethod(lambda service_stub, channel=None: stub))
+    monkeypatch.setattr(handler, "ModelPool", OfflineModelPool)
+    monkeypatch.setattr(handler, "S3_SPOOL_BUCKET", "spool-bucket")
+    monkeypatch.setattr(handler, "ANALYZE_BREAKER_THRESHOLD", breaker_threshold)
+    monkeypatch.setattr(sinks.time, "sleep", sleeps.append)
+
+    event = {'Records': [{'s3': {
+        'bucket': {'name': handler.S3_DATA_CAPTURE_BUCKET},
+        'object': {'key': capture_key, 'eTag': '', 'sequencer': uuid.uuid4().hex},
+    }}]}
+    result = handler.lambda_handler(event, context, session)
+    reader = SpoolReader("spool-bucket", handler.S3_SPOOL_PREFIX, session)
+    spooled = {key: list(reader.read(key)) for key in reader.list_keys()}
+    assert json.loads(result["body"])["spooled"] == rows
+    return stub, sleeps, spooled
+
+
+def test_outage_is_bounded_and_every_row_is_spooled(monkeypatch):
+    stub, sleeps, spooled = shadow_during_outage(monkeypatch, Context(), rows=200, breaker_threshold=5)
+    # Hydrosphere isn't called anymore after 5 messages failed all 4 attempts in a row
+    assert stub.Analyze.calls == 5 * 4
+    assert sum(sleeps) < 5 * 1.5
+    assert sum(len(messages) for messages in spooled.values()) == 200
+
+
+def test_spool_is_written_before_the_invocation_times_out(monkeypatch):
+    stub, _, spooled = shadow_during_outage(monkeypatch, Context(rows=3), rows=20, breaker_threshold=0)
+    # Rows before the deadline are retried, the rest is spooled without calls
+    assert stub.Analyze.calls == 3 * 4
+    assert sorted(len(messages) for messages in spooled.values()) == [3, 17]
+
+
+class CrashingAnalyze(FakeAnalyze):
+    """Analyze calls, after a number of which the invocation dies."""
+    def __init__(self, failures, crash_after: int):
+        super().__init__(failures)
+        self.crash_after = crash_after
+
+    def __call__(self, message, **kwargs):
+        if self.calls >= self.crash_after:
+            raise RuntimeError("Task timed out")
+        return super().__call__(message, **kwargs)
+
+
+def test_interrupted_replay_loses_nothing(monkeypatch):
+    session = install_s3_client(FakeS3Client())
+    spool = Spool("spool-bucket", handler.S3_SPOOL_PREFIX, session)
+    messages = [
+        ExecutionInformation(metadata=ExecutionMetadata(model_name=name, request_id=str(i)))
+        for name in ("a", "b") for i in range(10)
+    ]
+    for message in messages:
+        spool.put(message.metadata.model_name, message.SerializeToString())
+    assert len(spool.flush()) == 2
+
+    stub = FakeMonitoringStub()
+    monkeypatch.setattr(RPCStubFactory, "create_stub", staticmethod(lambda service_stub, channel=None: stub))
+    monkeypatch.setattr(handler, "S3_SPOOL_BUCKET", "spool-bucket")
+    # Every other message is rejected, and the replay dies halfway through the second file
+    stub.Analyze = CrashingAnalyze([False, True] * 10, crash_after=15)
+    with pytest.raises(RuntimeError):
+        handler.lambda_handler({"action": "replay"}, None, session)
+
+    reader = SpoolReader("spool-bucket", handler.S3_SPOOL_PREFIX, session)
+    spooled = [item for key in reader.list_keys() for item in reader.read(key)]
+    delivered = list(stub.Analyze.received)
+    assert all(
+        message in delivered or message.SerializeToString() in spooled
+        for message in messages
+    )
+
+    stub.Analyze = FakeAnalyze()
+    handler.lambda_handler({"action": "replay"}, None, session)
+    assert not list(reader.list_keys())
+    assert stub.Analyze.calls == len(spooled)
+    delivered.extend(stub.Analyze.received)
+    assert all(message in delivered for message in messages)
+
+
+def test_replay_without_spool_is_a_bad_request(monkeypatch):
+    monkeypatch.setattr(handler, "S3_SPOOL_BUCKET", "")
+    result = handler.lambda_handler({"action": "replay"}, None, install_s3_client(FakeS3Client()))
+    assert result["statusCode"] == 400
+    assert "s3_spool_uri" in json.loads(result["body"])["message"]
@@ -0,0 +1,127 @@
+# pylint: disable=missing-function-docstring
+import json
+import random
+import pytest
+from src import summary
+from src.data import Contract
+from benchmarks.fakes import FakeS3Client, install_s3_client
+from benchmarks.run import InMemoryRecord
+
+np = pytest.importorskip("numpy")
+
+
+def capture_lines(values: list, offset: int = 0) -> list:
+    return [
+        json.dumps({
+            "captureData": {
+                "endpointInput": {"observedContentType": "text/csv", "encoding": "CSV",
+                                  "data": f"{value},{'' if i % 10 == 0 else i % 3},a"},
+                "endpointOutput": {"observedContentType": "text/csv", "encoding": "CSV",
+                                   "data": "0.5"},
+            },
+            "eventMetadata": {"eventId": str(offset + i), "inferenceTime": "2020-03-11T12:45:15Z"},
+            "eventVersion": "0",
+        }).encode()
+        for i, value in enumerate(values)
+    ]
+
+
+def summarize(lines: list, chunk_rows: int = 7) -> summary.Summarizer:
+    session = install_s3_client(FakeS3Client())
+    contract = Contract(InMemoryRecord(lines[1]), InMemoryRecord(b"label,x,y,z\n"), session)
+    summarizer = summary.Summarizer(contract.schema, sample_rows=5, chunk_rows=chunk_rows)
+    for line in lines:
+        summarizer.add(memoryview(line))
+    return summarizer
+
+
+def test_parse_shadowing_modes():
+    assert summary.parse_shadowing_modes("") == {"*": "rows"}
+    modes = summary.parse_shadowing_modes('{"model-a": "summary"}')
+    assert summary.shadowing_mode(modes, "model-a") == "summary"
+    assert summary.shadowing_mode(modes, "model-b") == "rows"
+    with pytest.raises(ValueError):
+        summary.parse_shadowing_modes("sketch")
+
+
+def test_feature_statistics():
+    values = [random.Random(i).gauss(10, 3) for i in range(100)]
+    document = summarize(capture_lines(values)).summary("model", "key.jsonl")
+    assert document["rows"] == 100
+    x = document["features"]["x"]
+    assert x["count"] == 100 and x["nulls"] == 0
+    assert x["mean"] == pytest.approx(np.mean(values))
+    assert x["variance"] == pytest.approx(np.var(values))
+    assert (x["min"], x["max"]) == (min(values), max(values))
+    assert sum(x["histogram"]) == 100
+    assert document["features"]["y"]["nulls"] == 10
+    assert document["features"]["z"] == {"numeric": False, "count": 100, "nulls": 0}
+    assert document["features"]["label"]["mean"] == 0.5
+
+
+def test_quoted_cells_stay_in_their_column():
+    lines = [
+        json.dumps({
+            "captureData": {
+                "endpointInput": {"observedContentType": "text/csv", "encoding": "CSV",
+                                  "data": f'"a,{i}",{i}.5'},
+                "endpointOutput": {"observedContentType": "text/csv", "encoding": "CSV", "data": "0.5"},
+            },
+            "eventMetadata": {"eventId": str(i), "inferenceTime": "2020-03-11T12:45:15Z"},
+        }).encode()
+        for i in range(3)
+    ]
+    session = install_s3_client(FakeS3Client())
+    contract = Contract(InMemoryRecord(lines[0]), InMemoryRecord(b"label,name,x\n"), session)
+    summarizer = summary.Summarizer(contract.schema, sample_rows=5)
+    for line in lines:
+        summarizer.add(memoryview(line))
+    features = summarizer.summary("model", "key.jsonl")["features"]
+    assert features["name"] == {"numeric": False, "count": 3, "nulls": 0}
+    assert (features["x"]["min"], features["x"]["max"]) == (0.5, 2.5)
+
+
+def test_sketch_quantiles_are_within_accuracy():
+    values = np.random.RandomState(0).lognormal(size=10000) * np.where(
+        np.arange(10000) % 4 == 0, -1, 1)
+    sketch = summary.QuantileSketch()
+    sketch.update(values)
+    ordered = np.sort(values)
+    for q in (0.01, 0.25, 0.5, 0.9, 0.99):
+        exact = ordered[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=summary.SKETCH_ACCURACY)
+
+
+def test_summaries_merge_across_files():
+    values = [random.Random(i).uniform(-100, 100) for i in range(60)]
+    lines = capture_lines(values)
+    whole = summarize(lines).summary("model", "all.jsonl")
+    merged = summary.merge([
+        summarize(lines[:25]).summary("model", "first.jsonl"),
+        summarize(lines[25:]).summary("model", "second.jsonl"),
+    ])
+    assert merged["rows"] == whole["rows"]
+    assert merged["keys"] == ["first.jsonl", "second.jsonl"]
+    assert merged["sample"] == whole["sample"]
+    for name, feature in whole["features"].items():
+        merged_feature = merged["features"][name]
+        for key in ("count", "nulls", "min", "max", "histogram", "sketch"):
+            assert merged_feature.get(key) == feature.get(key)
+        if feature["numeric"]:
+            assert merged_feature["mean"] == pytest.approx(feature["mean"])
+            assert merged_feature["variance"] == pytest.approx(feature["variance"])
+
+
+def test_sample_is_stable_and_bounded():
+    lines = capture_lines(list(range(50)))
+    first, second = summarize(lines), summarize(list(reversed(lines)))
+    assert len(first.sample_lines()) == 5
+    assert first.sample_lines() == second.sample_lines()
+
+
+def test_store_next_to_capture_file():
+    s3 = FakeS3Client()
+    session = install_s3_client(s3)
+    key = summary.store({"rows": 1}, "bucket", "prefix/file.jsonl", session)
+    assert key == "prefix/file.jsonl.summary.json"
+    assert json.loads(s3.get_object(Bucket="bucket", Key=key)["Body"].read()) == {"rows": 1}
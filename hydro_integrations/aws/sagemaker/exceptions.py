@@ -6,5 +6,9 @@ class FunctionNotFound(NotFound):
     pass
 
 
+class QueueNotFound(NotFound):
+    pass
+
+
 class DataCaptureConfigException(Exception):
     pass
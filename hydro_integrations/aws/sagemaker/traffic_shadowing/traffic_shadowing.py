@@ -1,6 +1,11 @@
-from typing import List, Dict, Iterable, Union
+from typing import Callable, List, Dict, Iterable, Tuple, Union
 import os
+import io
+import csv
+import json
+import uuid
 import hashlib
+import datetime
 import logging
 import urllib.parse
 from pkg_resources import resource_string
@@ -9,7 +14,7 @@ import botocore
 from sagemaker.model_monitor.data_capture_config import DataCaptureConfig
 from hydro_integrations.aws.sagemaker import utils
 from hydro_integrations.aws.sagemaker.exceptions import (
-    FunctionNotFound, DataCaptureConfigException
+    FunctionNotFound, QueueNotFound, DataCaptureConfigException
 )
 from hydro_integrations.aws.exceptions import NotFound
 from hydro_integrations.aws.cloudformation import CloudFormation
@@ -17,6 +22,15 @@ from hydro_integrations.aws.helpers import SessionMixin, AWSClientFactory
 
 logger = logging.getLogger(__name__)
 
+INGESTION_MODES = ('direct', 'sqs')
+MINI_BATCH_MODES = ('explode', 'batch')
+PROJECTION_KINDS = ('include', 'exclude')
+SHADOWING_MODES = ('rows', 'summary')
+EXPORT_FORMATS = ('parquet', 'arrow')
+SINKS = ('grpc', 'file', 'null')
+SINK_COMPRESSIONS = ('gzip', 'zstd', 'none')
+CAPTURE_SUFFIXES = ('.jsonl',)
+
 
 def flatten(items: Iterable) -> Iterable:
     """Yield items from any nested iterable."""
@@ -45,17 +59,109 @@ def get_template_body() -> str:
     ).decode()
 
 
+def format_sampling_rate(sampling_rate: Union[float, Dict[str, float]]) -> str:
+    """
+    Validate sampling configuration and serialize it for the stack parameters.
+    A dictionary maps SageMaker model names to rates, "*" defines the default.
+    """
+    rates = sampling_rate if isinstance(sampling_rate, dict) else {"*": sampling_rate}
+    for name, rate in rates.items():
+        if not 0.0 <= float(rate) <= 1.0:
+            raise ValueError(f"Sampling rate for {name} should be within [0, 1], got {rate}")
+    if isinstance(sampling_rate, dict):
+        return json.dumps({name: float(rate) for name, rate in sampling_rate.items()})
+    return str(float(sampling_rate))
+
+
+def format_mini_batch_mode(mini_batch_mode: Union[str, Dict[str, str]]) -> str:
+    """
+    Validate mini-batch configuration and serialize it for the stack parameters.
+    A dictionary maps SageMaker model names to modes, "*" defines the default.
+    """
+    modes = mini_batch_mode if isinstance(mini_batch_mode, dict) else {"*": mini_batch_mode}
+    for name, mode in modes.items():
+        if mode not in MINI_BATCH_MODES:
+            raise ValueError(f"Mini-batch mode for {name} should be one of {MINI_BATCH_MODES}, "
+                             f"got {mode}")
+    if isinstance(mini_batch_mode, dict):
+        return json.dumps(mini_batch_mode)
+    return mini_batch_mode
+
+
+def format_shadowing_mode(shadowing_mode: Union[str, Dict[str, str]]) -> str:
+    """
+    Validate shadowing mode configuration and serialize it for the stack
+    parameters. A dictionary maps SageMaker model names to modes, "*" defines
+    the default.
+    """
+    modes = shadowing_mode if isinstance(shadowing_mode, dict) else {"*": shadowing_mode}
+    for name, mode in modes.items():
+        if mode not in SHADOWING_MODES:
+            raise ValueError(f"Shadowing mode for {name} should be one of {SHADOWING_MODES}, "
+                             f"got {mode}")
+    if isinstance(shadowing_mode, dict):
+        return json.dumps(shadowing_mode)
+    return shadowing_mode
+
+
+def format_feature_projection(
+        feature_projection: Union[Dict[str, List[str]], Dict[str, Dict], None],
+) -> str:
+    """
+    Validate projection configuration and serialize it for the stack parameters.
+    A projection is a dictionary with either "include" or "exclude" list of
+    column names. A dictionary of projections maps SageMaker model names to
+    them, "*" defines the default.
+    """
+    if not feature_projection:
+        return ''
+    projections = feature_projection
+    if set(feature_projection) <= set(PROJECTION_KINDS):
+        projections = {"*": feature_projection}
+    for name, projection in projections.items():
+        if not isinstance(projection, dict) or len(projection) != 1 \
+                or not set(projection) <= set(PROJECTION_KINDS):
+            raise ValueError(f"Projection for {name} should be a dictionary with either "
+                             f"of {PROJECTION_KINDS} lists of columns, got {projection}")
+        columns, = projection.values()
+        if isinstance(columns, str) or not all(isinstance(column, str) for column in columns):
+            raise ValueError(f"Projection for {name} should list column names, got {columns}")
+    return json.dumps({
+        name: {kind: list(columns) for kind, columns in projection.items()}
+        for name, projection in projections.items()
+    })
+
+
 class TrafficShadowing(CloudFormation, SessionMixin):
     """ Serverless application to shadow traffic to Hydrosphere. """
     STACK_NAME = "traffic-shadowing-hydrosphere"
 
     def __init__(
             self,
-            hydrosphere_endpoint: str,
+            hydrosphere_endpoint: Union[str, List[str]],
             s3_data_training_uri: str,
             data_capture_config: DataCaptureConfig,
             validate: bool = True,
             session: Union[boto3.Session, botocore.session.Session, None] = None,
+            s3_spool_uri: Union[str, None] = None,
+            sampling_rate: Union[float, Dict[str, float]] = 1.0,
+            deduplication_marker_prefix: str = '',
+            ingestion_mode: str = 'direct',
+            sqs_batch_size: int = 10,
+            sqs_batching_window: int = 0,
+            provisioned_concurrency: int = 0,
+            warmup_schedule: str = '',
+            notification_suffixes: Iterable[str] = CAPTURE_SUFFIXES,
+            mini_batch_mode: Union[str, Dict[str, str]] = 'explode',
+            narrow_dtypes: bool = False,
+            pack_features: bool = False,
+            feature_projection: Union[Dict[str, List[str]], Dict[str, Dict], None] = None,
+            shadowing_mode: Union[str, Dict[str, str]] = 'rows',
+            s3_export_uri: Union[str, None] = None,
+            export_format: str = 'parquet',
+            sink: str = 'grpc',
+            s3_sink_uri: Union[str, None] = None,
+            sink_compression: str = 'gzip',
     ):
         self._session = session or boto3.Session()
         self._s3_client = AWSClientFactory.get_or_create_client('s3', self._session)
@@ -67,8 +173,16 @@ class TrafficShadowing(CloudFormation, SessionMixin):
 
         self.template_body = get_template_body()
 
-        utils.validate_non_empty_uri(hydrosphere_endpoint, True, True, False)
-        self.hydrosphere_endpoint = hydrosphere_endpoint
+        # Endpoints after the first one are mirrors, which get copies of shadowed rows
+        endpoints = [hydrosphere_endpoint] if isinstance(hydrosphere_endpoint, str) \
+            else list(hydrosphere_endpoint)
+        if not endpoints:
+            raise ValueError("At least one Hydrosphere endpoint is required")
+        for endpoint in endpoints:
+            if ',' in endpoint:
+                raise ValueError(f"Hydrosphere endpoint should not contain commas, got {endpoint}")
+            utils.validate_non_empty_uri(endpoint, True, True, False)
+        self.hydrosphere_endpoint = ','.join(endpoints)
 
         utils.validate_non_empty_uri(data_capture_config.destination_s3_uri, True, True, True)
         capture_parse = urllib.parse.urlparse(data_capture_config.destination_s3_uri)
@@ -79,7 +193,75 @@ class TrafficShadowing(CloudFormation, SessionMixin):
         training_parse = urllib.parse.urlparse(s3_data_training_uri)
         self.s3_data_training_bucket = training_parse.netloc
         self.s3_data_training_prefix = training_parse.path.strip('/')
-        
+
+        self.s3_spool_bucket = ''
+        self.s3_spool_prefix = 'hydrosphere/spool'
+        if s3_spool_uri:
+            utils.validate_non_empty_uri(s3_spool_uri, True, True, False)
+            spool_parse = urllib.parse.urlparse(s3_spool_uri)
+            self.s3_spool_bucket = spool_parse.netloc
+            self.s3_spool_prefix = spool_parse.path.strip('/') or self.s3_spool_prefix
+
+        self.sampling_rate = format_sampling_rate(sampling_rate)
+        self.deduplication_marker_prefix = deduplication_marker_prefix.strip('/')
+
+        if ingestion_mode not in INGESTION_MODES:
+            raise ValueError(f"ingestion_mode should be one of {INGESTION_MODES}")
+        if not 1 <= sqs_batch_size <= 10000:
+            raise ValueError("sqs_batch_size should be within [1, 10000]")
+        if not 0 <= sqs_batching_window <= 300:
+            raise ValueError("sqs_batching_window should be within [0, 300] seconds")
+        self.ingestion_mode = ingestion_mode
+        self.sqs_batch_size = sqs_batch_size
+        self.sqs_batching_window = sqs_batching_window
+
+        if not 0 <= provisioned_concurrency <= 3:
+            raise ValueError("provisioned_concurrency should be within [0, 3], "
+                             "the reserved concurrency of the function")
+        if warmup_schedule and not warmup_schedule.startswith(('rate(', 'cron(')):
+            raise ValueError("warmup_schedule should be a rate(...) or cron(...) expression")
+        self.provisioned_concurrency = provisioned_concurrency
+        self.warmup_schedule = warmup_schedule
+
+        self.notification_suffixes = tuple(notification_suffixes)
+        if not self.notification_suffixes:
+            raise ValueError("notification_suffixes should contain at least one suffix")
+        for suffix in self.notification_suffixes:
+            overlapping = [other for other in self.notification_suffixes
+                           if other != suffix and other.endswith(suffix)]
+            if overlapping:
+                raise ValueError(f"Notification suffix {suffix} overlaps with {overlapping}, "
+                                 "S3 doesn't allow overlapping notification filters")
+
+        self.mini_batch_mode = format_mini_batch_mode(mini_batch_mode)
+        self.narrow_dtypes = bool(narrow_dtypes)
+        self.pack_features = bool(pack_features)
+        self.feature_projection = format_feature_projection(feature_projection)
+        self.shadowing_mode = format_shadowing_mode(shadowing_mode)
+
+        self.s3_export_bucket = ''
+        self.s3_export_prefix = 'hydrosphere/export'
+        if s3_export_uri:
+            utils.validate_non_empty_uri(s3_export_uri, True, True, False)
+            export_parse = urllib.parse.urlparse(s3_export_uri)
+            self.s3_export_bucket = export_parse.netloc
+            self.s3_export_prefix = export_parse.path.strip('/') or self.s3_export_prefix
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"export_format should be one of {EXPORT_FORMATS}")
+        self.export_format = export_format
+
+        if sink not in SINKS:
+            raise ValueError(f"sink should be one of {SINKS}")
+        if sink == 'file' and not s3_sink_uri:
+            raise ValueError("s3_sink_uri is required by the file sink")
+        if s3_sink_uri:
+            utils.validate_non_empty_uri(s3_sink_uri, True, True, False)
+        if sink_compression not in SINK_COMPRESSIONS:
+            raise ValueError(f"sink_compression should be one of {SINK_COMPRESSIONS}")
+        self.sink = sink
+        self.s3_sink_uri = s3_sink_uri or ''
+        self.sink_compression = sink_compression
+
         if validate:
             self._validate_deployment_configuration()
 
@@ -87,9 +269,25 @@ class TrafficShadowing(CloudFormation, SessionMixin):
             target=self.STACK_NAME,
             to_hash=[
                 self.template_body,
-                hydrosphere_endpoint,
+                self.hydrosphere_endpoint,
                 s3_data_training_uri,
                 str(data_capture_config._to_request_dict()),
+                s3_spool_uri or '',
+                self.sampling_rate if self.sampling_rate != '1.0' else '',
+                self.deduplication_marker_prefix,
+                self.ingestion_mode if self.ingestion_mode != 'direct' else '',
+                str(self.provisioned_concurrency) if self.provisioned_concurrency else '',
+                self.warmup_schedule,
+                self.mini_batch_mode if self.mini_batch_mode != 'explode' else '',
+                'narrow_dtypes' if self.narrow_dtypes else '',
+                'pack_features' if self.pack_features else '',
+                self.feature_projection,
+                self.shadowing_mode if self.shadowing_mode != 'rows' else '',
+                s3_export_uri or '',
+                self.export_format if self.export_format != 'parquet' else '',
+                self.sink if self.sink != 'grpc' else '',
+                self.s3_sink_uri,
+                self.sink_compression if self.sink_compression != 'gzip' else '',
             ],
         )
 
@@ -132,22 +330,111 @@ class TrafficShadowing(CloudFormation, SessionMixin):
                 "ParameterKey": "HydrosphereEndpoint",
                 "ParameterValue": self.hydrosphere_endpoint,
             },
+            {
+                "ParameterKey": "S3SpoolBucketName",
+                "ParameterValue": self.s3_spool_bucket,
+            },
+            {
+                "ParameterKey": "S3SpoolPrefix",
+                "ParameterValue": self.s3_spool_prefix,
+            },
+            {
+                "ParameterKey": "SamplingRate",
+                "ParameterValue": self.sampling_rate,
+            },
+            {
+                "ParameterKey": "DeduplicationMarkerPrefix",
+                "ParameterValue": self.deduplication_marker_prefix,
+            },
+            {
+                "ParameterKey": "IngestionMode",
+                "ParameterValue": self.ingestion_mode,
+            },
+            {
+                "ParameterKey": "SqsBatchSize",
+                "ParameterValue": str(self.sqs_batch_size),
+            },
+            {
+                "ParameterKey": "SqsMaximumBatchingWindowInSeconds",
+                "ParameterValue": str(self.sqs_batching_window),
+            },
+            {
+                "ParameterKey": "ProvisionedConcurrency",
+                "ParameterValue": str(self.provisioned_concurrency),
+            },
+            {
+                "ParameterKey": "WarmupSchedule",
+                "ParameterValue": self.warmup_schedule,
+            },
+            {
+                "ParameterKey": "MiniBatchMode",
+                "ParameterValue": self.mini_batch_mode,
+            },
+            {
+                "ParameterKey": "NarrowDtypes",
+                "ParameterValue": "true" if self.narrow_dtypes else "false",
+            },
+            {
+                "ParameterKey": "PackFeatures",
+                "ParameterValue": "true" if self.pack_features else "false",
+            },
+            {
+                "ParameterKey": "FeatureProjection",
+                "ParameterValue": self.feature_projection,
+            },
+            {
+                "ParameterKey": "ShadowingMode",
+                "ParameterValue": self.shadowing_mode,
+            },
+            {
+                "ParameterKey": "S3ExportBucketName",
+                "ParameterValue": self.s3_export_bucket,
+            },
+            {
+                "ParameterKey": "S3ExportPrefix",
+                "ParameterValue": self.s3_export_prefix,
+            },
+            {
+                "ParameterKey": "ExportFormat",
+                "ParameterValue": self.export_format,
+            },
+            {
+                "ParameterKey": "Sink",
+                "ParameterValue": self.sink,
+            },
+            {
+                "ParameterKey": "SinkUri",
+                "ParameterValue": self.s3_sink_uri,
+            },
+            {
+                "ParameterKey": "SinkCompression",
+                "ParameterValue": self.sink_compression,
+            },
         ]
 
     def get_stack_capabilities(self) -> List[str]:
         """Get capabilities list for deploying underlying CloudFormation stack."""
         return ["CAPABILITY_NAMED_IAM"]
 
+    def _get_stack_output(self, key: str) -> str:
+        """Retrieve the value of the given output of the deployed stack."""
+        outputs = self._get_stack_outputs()
+        return next(filter(lambda x: x['OutputKey'] == key, outputs))['OutputValue']
+
     def _get_lambda_arn(self) -> dict:
         """Retrieve Arn of the deployed TrafficShadowingFunction Lambda."""
-        try: 
-            outputs = self._get_stack_outputs()
-            return next(filter(
-                lambda x: x['OutputKey'] == 'TrafficShadowingFunctionArn', outputs
-            ))['OutputValue']
-        except KeyError:
+        try:
+            return self._get_stack_output('TrafficShadowingFunctionArn')
+        except (KeyError, StopIteration):
             raise FunctionNotFound
 
+    def _get_queue_arn(self) -> str:
+        """Retrieve Arn of the deployed CaptureQueue."""
+        try:
+            return self._get_stack_output('CaptureQueueArn')
+        except (KeyError, StopIteration):
+            raise QueueNotFound
+
     def _get_bucket_notification_configuration(self):
         """Retrieve current notification configuration of the bucket."""
         result = self._s3_client.get_bucket_notification_configuration(
@@ -156,50 +443,62 @@ class TrafficShadowing(CloudFormation, SessionMixin):
         result.pop('ResponseMetadata', None)
         return result
 
+    def _get_notification_target(self) -> Tuple[str, str, Callable[[], str]]:
+        """
+        Return the notification configuration section, the name of the target
+        Arn field and a getter of the target Arn for the ingestion mode.
+        """
+        if self.ingestion_mode == 'sqs':
+            return 'QueueConfigurations', 'QueueArn', self._get_queue_arn
+        return 'LambdaFunctionConfigurations', 'LambdaFunctionArn', self._get_lambda_arn
+
     def _add_bucket_notification(self, replace: bool = False):
         """
-        Append a new lambda notification to the existing notification
-        configuration of the data capture bucket.
+        Append a new lambda (or queue, in SQS ingestion mode) notification to
+        the existing notification configuration of the data capture bucket.
         """
+        section, arn_key, get_target_arn = self._get_notification_target()
         if replace:
             logger.info("Replacing bucket notification.")
             configuration = {}
-            lambda_configurations = []
+            target_configurations = []
         else:
             logger.info("Adding bucket notification.")
             configuration = self._get_bucket_notification_configuration()
-            lambda_configurations = configuration.get('LambdaFunctionConfigurations', [])
+            target_configurations = configuration.get(section, [])
 
-        lambda_arn = self._get_lambda_arn()
-        targets = filter(lambda x: x['LambdaFunctionArn'] == lambda_arn, lambda_configurations)
+        target_arn = get_target_arn()
+        targets = filter(lambda x: x[arn_key] == target_arn, target_configurations)
         rules = map(lambda x: x['Filter']['Key']['FilterRules'], targets)
         flattened_rules = flatten(rules)
         prefixes = filter(lambda x: x['Name'].lower() == 'prefix', flattened_rules)
         if any([item['Value'] == self.s3_data_capture_prefix for item in prefixes]):
             return logger.info("Found similar bucket notification configuration.")
 
-        lambda_configurations.append({
-            'LambdaFunctionArn': lambda_arn,
-            'Events': [
-                's3:ObjectCreated:*'
-            ],
-            'Filter': {
-                'Key': {
-                    'FilterRules': [
-                        {
-                            'Name': 'prefix',
-                            'Value': self.s3_data_capture_prefix,
-                        },
-                        {
-                            'Name': 'suffix',
-                            'Value': '.jsonl'
-                        }
-                    ]
+        # A filter holds a single suffix rule, so every suffix gets its own one
+        for suffix in self.notification_suffixes:
+            target_configurations.append({
+                arn_key: target_arn,
+                'Events': [
+                    's3:ObjectCreated:*'
+                ],
+                'Filter': {
+                    'Key': {
+                        'FilterRules': [
+                            {
+                                'Name': 'prefix',
+                                'Value': self.s3_data_capture_prefix,
+                            },
+                            {
+                                'Name': 'suffix',
+                                'Value': suffix
+                            }
+                        ]
+                    }
                 }
-            }
-        })
+            })
 
-        configuration['LambdaFunctionConfigurations'] = lambda_configurations
+        configuration[section] = target_configurations
         self._s3_client.put_bucket_notification_configuration(
             Bucket=self.s3_data_capture_bucket,
             NotificationConfiguration=configuration
@@ -207,15 +506,16 @@ class TrafficShadowing(CloudFormation, SessionMixin):
 
     def _delete_bucket_notification(self, purge: bool = False):
         """
-        Delete lambda notification from the existing notification
-        configuration of the data capture bucket.
+        Delete lambda (or queue, in SQS ingestion mode) notification from
+        the existing notification configuration of the data capture bucket.
         """
-        lambda_arn = None
+        section, arn_key, get_target_arn = self._get_notification_target()
+        target_arn = None
 
         try:
-            lambda_arn = self._get_lambda_arn()
-        except FunctionNotFound:
-            logger.warning("Could not find deployed function arn.")
+            target_arn = get_target_arn()
+        except (FunctionNotFound, QueueNotFound):
+            logger.warning("Could not find deployed notification target arn.")
             if not purge:
                 logger.warning("Skipping bucket notification deletion.")
                 return None
@@ -228,15 +528,15 @@ class TrafficShadowing(CloudFormation, SessionMixin):
 
         if purge:
             configuration = {}
-            lambda_configurations = []
+            target_configurations = []
         else:
             configuration = self._get_bucket_notification_configuration()
-            lambda_configurations = [
-                item for item in configuration.get('LambdaFunctionConfigurations', [])
-                if item['LambdaFunctionArn'] != lambda_arn
+            target_configurations = [
+                item for item in configuration.get(section, [])
+                if item[arn_key] != target_arn
             ]
 
-        configuration['LambdaFunctionConfigurations'] = lambda_configurations
+        configuration[section] = target_configurations
         self._s3_client.put_bucket_notification_configuration(
             Bucket=self.s3_data_capture_bucket,
             NotificationConfiguration=configuration,
@@ -257,3 +557,96 @@ class TrafficShadowing(CloudFormation, SessionMixin):
         """Synchronously delete notification configurations and the stack."""
         self._delete_bucket_notification(purge_bucket_notification_configuration)
         self._delete_stack()
+
+    def _list_capture_keys(
+            self,
+            prefix: str,
+            start_time: datetime.datetime,
+            end_time: datetime.datetime,
+    ) -> Iterable[str]:
+        """List capture files under the prefix, modified within the time range."""
+        paginator = self._s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.s3_data_capture_bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                if item['Key'].endswith(self.notification_suffixes) \
+                        and start_time <= item['LastModified'] < end_time:
+                    yield item['Key']
+
+    def start_backfill(
+            self,
+            start_time: datetime.datetime,
+            end_time: datetime.datetime,
+            prefix: Union[str, None] = None,
+            report_uri: Union[str, None] = None,
+            priority: int = 10,
+    ) -> Union[str, None]:
+        """
+        Start an S3 Batch Operations job, which shadows capture files created
+        within [start_time, end_time) under the data capture prefix (or the
+        given prefix within the data capture bucket). The manifest of keys is
+        written next to the capture data. Return the id of the created job,
+        or None if there is nothing to backfill.
+        """
+        if start_time.tzinfo is None or end_time.tzinfo is None:
+            raise ValueError("start_time and end_time should be timezone-aware")
+        prefix = (prefix or self.s3_data_capture_prefix).strip('/')
+
+        manifest = io.StringIO()
+        writer = csv.writer(manifest)
+        count = 0
+        for key in self._list_capture_keys(prefix, start_time, end_time):
+            writer.writerow([self.s3_data_capture_bucket, urllib.parse.quote(key)])
+            count += 1
+        if not count:
+            logger.warning("Didn't find any capture files to backfill under %s.", prefix)
+            return None
+
+        manifest_key = '/'.join([
+            self.s3_data_capture_prefix, '_backfill',
+            f"manifest-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.csv",
+        ])
+        response = self._s3_client.put_object(
+            Bucket=self.s3_data_capture_bucket,
+            Key=manifest_key,
+            Body=manifest.getvalue().encode(),
+        )
+        logger.info("Written a manifest of %d capture files to s3://%s/%s",
+                    count, self.s3_data_capture_bucket, manifest_key)
+
+        if report_uri:
+            utils.validate_non_empty_uri(report_uri, True, True, False)
+            report_parse = urllib.parse.urlparse(report_uri)
+            report = {
+                'Bucket': f"arn:aws:s3:::{report_parse.netloc}",
+                'Format': 'Report_CSV_20180820',
+                'Enabled': True,
+                'Prefix': report_parse.path.strip('/') or 'backfill-reports',
+                'ReportScope': 'FailedTasksOnly',
+            }
+        else:
+            report = {'Enabled': False}
+
+        sts_client = AWSClientFactory.get_or_create_client('sts', self._session)
+        s3control_client = AWSClientFactory.get_or_create_client('s3control', self._session)
+        job = s3control_client.create_job(
+            AccountId=sts_client.get_caller_identity()['Account'],
+            ConfirmationRequired=False,
+            Operation={'LambdaInvoke': {'FunctionArn': self._get_lambda_arn()}},
+            Manifest={
+                'Spec': {
+                    'Format': 'S3BatchOperations_CSV_20180820',
+                    'Fields': ['Bucket', 'Key'],
+                },
+                'Location': {
+                    'ObjectArn': f"arn:aws:s3:::{self.s3_data_capture_bucket}/{manifest_key}",
+                    'ETag': response['ETag'],
+                },
+            },
+            Report=report,
+            Priority=priority,
+            RoleArn=self._get_stack_output('BatchOperationsRoleArn'),
+            ClientRequestToken=uuid.uuid4().hex,
+            Description=f"Traffic shadowing backfill of {prefix}",
+        )
+        logger.info("Started backfill job %s", job['JobId'])
+        return job['JobId']
@@ -13,3 +13,5 @@ CAPTURE_PREFIX_FULL = f"s3://{CAPTURE_BUCKET}/{CAPTURE_PREFIX}"
 session = boto3.session.Session()
 s3_client = AWSClientFactory.get_or_create_client('s3', session)
 cloudformation_client = AWSClientFactory.get_or_create_client('cloudformation', session)
+sts_client = AWSClientFactory.get_or_create_client('sts', session)
+s3control_client = AWSClientFactory.get_or_create_client('s3control', session)
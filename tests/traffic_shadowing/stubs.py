@@ -57,6 +57,7 @@ class DescribeStacksStub(StubBase):
         self.template_body = template_body
 
         self.__lambda_arn = None
+        self.__queue_arn = None
 
     @property
     def lambda_arn(self):
@@ -64,6 +65,12 @@ class DescribeStacksStub(StubBase):
             self.__lambda_arn = 'arn:aws:lambda:xx-xxxx-x:xxxxxxxxxxxx:function:traffic-shadowing-hydrosp-TrafficShadowingFunction-xxxxxxxxxxxx'
         return self.__lambda_arn
 
+    @property
+    def queue_arn(self):
+        if self.__queue_arn is None:
+            self.__queue_arn = 'arn:aws:sqs:xx-xxxx-x:xxxxxxxxxxxx:traffic-shadowing-hydrosphere-CaptureQueue-xxxxxxxxxxxx'
+        return self.__queue_arn
+
     @classmethod
     def from_stub(cls, stub: CreateStackStub):
         return cls(
@@ -94,7 +101,11 @@ class DescribeStacksStub(StubBase):
                         {
                             'OutputKey': 'TrafficShadowingFunctionArn',
                             'OutputValue': self.lambda_arn,
-                        }
+                        },
+                        {
+                            'OutputKey': 'CaptureQueueArn',
+                            'OutputValue': self.queue_arn,
+                        },
                     ],
                     'Tags': [],
                     'EnableTerminationProtection': False,
@@ -335,6 +346,49 @@ class PutNotificationStub(StubBase):
         return {}
 
 
+class PutQueueNotificationStub(StubBase):
+    method = 'put_bucket_notification_configuration'
+
+    def __init__(self, bucket: str, prefix: str, queue_arn: str):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.queue_arn = queue_arn
+
+    @property
+    def expected_params(self):
+        return {
+            'Bucket': self.bucket,
+            'NotificationConfiguration': {
+                'QueueConfigurations': [
+                    {
+                        'QueueArn': self.queue_arn,
+                        'Events': [
+                            's3:ObjectCreated:*',
+                        ],
+                        'Filter': {
+                            'Key': {
+                                'FilterRules': [
+                                    {
+                                        'Name': 'prefix',
+                                        'Value': self.prefix,
+                                    },
+                                    {
+                                        'Name': 'suffix',
+                                        'Value': '.jsonl'
+                                    },
+                                ]
+                            }
+                        }
+                    },
+                ]
+            }
+        }
+
+    @property
+    def service_response(self):
+        return {}
+
+
 class PutEmptyNotificationStub(StubBase):
     method = 'put_bucket_notification_configuration'
 
@@ -0,0 +1,111 @@
+# pylint: disable=redefined-outer-name
+import datetime
+import logging
+import pytest
+from botocore.stub import Stubber, ANY
+from dateutil.tz import tzutc
+from sagemaker.model_monitor.data_capture_config import DataCaptureConfig
+from hydro_integrations.aws.sagemaker import TrafficShadowing
+from tests.traffic_shadowing.stubs import DescribeStacksStub
+from tests.traffic_shadowing.config import (
+    HYDROSPHERE_ENDPOINT, TRAIN_PREFIX_FULL, CAPTURE_PREFIX_FULL
+)
+from tests.traffic_shadowing.config import (
+    session, s3_client, cloudformation_client, sts_client, s3control_client
+)
+
+
+@pytest.fixture
+def shadowing():
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    return TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+    )
+
+
+def test_start_backfill(caplog, shadowing: TrafficShadowing):
+    """Test creation of a backfill job over a time range."""
+    caplog.set_level(logging.INFO)
+    prefix = shadowing.s3_data_capture_prefix
+    start_time = datetime.datetime(2020, 3, 11, tzinfo=tzutc())
+    end_time = datetime.datetime(2020, 3, 12, tzinfo=tzutc())
+
+    with Stubber(cloudformation_client) as cloudformation_stubber, \
+            Stubber(s3_client) as s3_stubber, \
+            Stubber(sts_client) as sts_stubber, \
+            Stubber(s3control_client) as s3control_stubber:
+
+        describe_stacks_stub = DescribeStacksStub(
+            shadowing.stack_name,
+            shadowing.get_stack_parameters(),
+            shadowing.get_stack_capabilities(),
+            shadowing.stack_body,
+        )
+        describe_stacks_response = describe_stacks_stub.service_response
+        describe_stacks_response['Stacks'][0]['Outputs'].append({
+            'OutputKey': 'BatchOperationsRoleArn',
+            'OutputValue': 'arn:aws:iam::123456789012:role/backfill',
+        })
+
+        # Stub ListObjectsV2 API call to find capture files. Only
+        # the first one falls into the requested time range.
+        s3_stubber.add_response('list_objects_v2', {
+            'IsTruncated': False,
+            'KeyCount': 3,
+            'Contents': [
+                {
+                    'Key': f'{prefix}/model/AllTraffic/2020/03/11/12/in range.jsonl',
+                    'LastModified': datetime.datetime(2020, 3, 11, 12, tzinfo=tzutc()),
+                },
+                {
+                    'Key': f'{prefix}/model/AllTraffic/2020/03/12/12/out-of-range.jsonl',
+                    'LastModified': datetime.datetime(2020, 3, 12, 12, tzinfo=tzutc()),
+                },
+                {
+                    'Key': f'{prefix}/model/AllTraffic/2020/03/11/13/not-a-capture.csv',
+                    'LastModified': datetime.datetime(2020, 3, 11, 13, tzinfo=tzutc()),
+                },
+            ],
+        }, {'Bucket': shadowing.s3_data_capture_bucket, 'Prefix': prefix})
+
+        # Stub PutObject API call to upload the manifest.
+        s3_stubber.add_response('put_object', {'ETag': '"manifest-etag"'}, {
+            'Bucket': shadowing.s3_data_capture_bucket,
+            'Key': ANY,
+            'Body': f'{shadowing.s3_data_capture_bucket},'
+                    f'{prefix}/model/AllTraffic/2020/03/11/12/in%20range.jsonl\r\n'.encode(),
+        })
+
+        sts_stubber.add_response('get_caller_identity', {'Account': '123456789012'}, {})
+
+        # Stub DescribeStacks API calls to retrieve the lambda and
+        # the role Arns from stack outputs.
+        for _ in range(2):
+            cloudformation_stubber.add_response(
+                'describe_stacks', describe_stacks_response,
+                describe_stacks_stub.expected_params,
+            )
+
+        s3control_stubber.add_response('create_job', {'JobId': 'job-id'}, {
+            'AccountId': '123456789012',
+            'ConfirmationRequired': False,
+            'Operation': {'LambdaInvoke': {'FunctionArn': describe_stacks_stub.lambda_arn}},
+            'Manifest': ANY,
+            'Report': {'Enabled': False},
+            'Priority': 10,
+            'RoleArn': 'arn:aws:iam::123456789012:role/backfill',
+            'ClientRequestToken': ANY,
+            'Description': ANY,
+        })
+
+        assert shadowing.start_backfill(start_time, end_time) == 'job-id'
+
+        for stubber in (cloudformation_stubber, s3_stubber, sts_stubber, s3control_stubber):
+            stubber.assert_no_pending_responses()
@@ -5,7 +5,8 @@ from botocore.stub import Stubber
 from sagemaker.model_monitor.data_capture_config import DataCaptureConfig
 from hydro_integrations.aws.sagemaker import TrafficShadowing
 from tests.traffic_shadowing.stubs import (
-    DescribeStacksStub, PutNotificationStub, PutEmptyNotificationStub, GetBucketLocationStub
+    DescribeStacksStub, PutNotificationStub, PutEmptyNotificationStub, GetBucketLocationStub,
+    PutQueueNotificationStub,
 )
 from tests.traffic_shadowing.config import (
     HYDROSPHERE_ENDPOINT, TRAIN_PREFIX_FULL, CAPTURE_BUCKET, CAPTURE_PREFIX_FULL
@@ -68,6 +69,61 @@ def test_replace_notification(caplog, shadowing: TrafficShadowing):
         s3_stubber.assert_no_pending_responses()
 
 
+def test_replace_queue_notification(caplog):
+    """Test notification configuration targeting a queue in SQS ingestion mode."""
+    caplog.set_level(logging.INFO)
+    with Stubber(s3_client):
+        shadowing = TrafficShadowing(
+            HYDROSPHERE_ENDPOINT,
+            TRAIN_PREFIX_FULL,
+            DataCaptureConfig(enable_capture=True, destination_s3_uri=CAPTURE_PREFIX_FULL),
+            validate=False,
+            session=session,
+            ingestion_mode='sqs',
+            sqs_batch_size=50,
+            sqs_batching_window=30,
+        )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert parameters['IngestionMode'] == 'sqs'
+    assert parameters['SqsBatchSize'] == '50'
+    assert parameters['SqsMaximumBatchingWindowInSeconds'] == '30'
+
+    with Stubber(cloudformation_client) as cloudformation_stubber, \
+            Stubber(s3_client) as s3_stubber:
+
+        describe_stacks_stub = DescribeStacksStub(
+            shadowing.stack_name,
+            shadowing.get_stack_parameters(),
+            shadowing.get_stack_capabilities(),
+            shadowing.stack_body,
+        )
+        put_notification_stub = PutQueueNotificationStub(
+            shadowing.s3_data_capture_bucket,
+            shadowing.s3_data_capture_prefix,
+            describe_stacks_stub.queue_arn,
+        )
+
+        # Stub DescribeStacks API call to retreive queue Arn
+        # from stack outputs.
+        cloudformation_stubber.add_response(
+            **describe_stacks_stub.generate_response(),
+        )
+
+        # Stub PutBucketNotificationConfiguration API call to
+        # replace existing notification configuration.
+        s3_stubber.add_response(
+            **put_notification_stub.generate_response(),
+        )
+
+        shadowing._add_bucket_notification(replace=True)
+
+        cloudformation_stubber.assert_no_pending_responses()
+        s3_stubber.assert_no_pending_responses()
+
+
 def test_purge_notification(caplog, shadowing: TrafficShadowing):
     """Test purging of a bucket notification configuration."""
     caplog.set_level(logging.INFO)
@@ -102,3 +158,56 @@ def test_purge_notification(caplog, shadowing: TrafficShadowing):
         shadowing._delete_bucket_notification(purge=True)
         cloudformation_stubber.assert_no_pending_responses()
         s3_stubber.assert_no_pending_responses()
+
+
+def test_compressed_suffixes_notification():
+    """Test a notification filter per configured capture file suffix."""
+    with Stubber(s3_client):
+        shadowing = TrafficShadowing(
+            HYDROSPHERE_ENDPOINT,
+            TRAIN_PREFIX_FULL,
+            DataCaptureConfig(enable_capture=True, destination_s3_uri=CAPTURE_PREFIX_FULL),
+            validate=False,
+            session=session,
+            notification_suffixes=['.jsonl', '.jsonl.gz', '.jsonl.zst'],
+        )
+    with Stubber(cloudformation_client) as cloudformation_stubber, \
+            Stubber(s3_client) as s3_stubber:
+        describe_stacks_stub = DescribeStacksStub(
+            shadowing.stack_name,
+            shadowing.get_stack_parameters(),
+            shadowing.get_stack_capabilities(),
+            shadowing.stack_body,
+        )
+        expected_params = PutNotificationStub(
+            shadowing.s3_data_capture_bucket,
+            shadowing.s3_data_capture_prefix,
+            describe_stacks_stub.lambda_arn,
+        ).expected_params
+        configuration = expected_params['NotificationConfiguration']
+        template = configuration['LambdaFunctionConfigurations'][0]
+        configuration['LambdaFunctionConfigurations'] = [
+            {**template, 'Filter': {'Key': {'FilterRules': [
+                template['Filter']['Key']['FilterRules'][0],
+                {'Name': 'suffix', 'Value': suffix},
+            ]}}}
+            for suffix in ['.jsonl', '.jsonl.gz', '.jsonl.zst']
+        ]
+        cloudformation_stubber.add_response(**describe_stacks_stub.generate_response())
+        s3_stubber.add_response(
+            'put_bucket_notification_configuration', {}, expected_params)
+
+        shadowing._add_bucket_notification(replace=True)
+
+        cloudformation_stubber.assert_no_pending_responses()
+        s3_stubber.assert_no_pending_responses()
+
+    with pytest.raises(ValueError):
+        TrafficShadowing(
+            HYDROSPHERE_ENDPOINT,
+            TRAIN_PREFIX_FULL,
+            DataCaptureConfig(enable_capture=True, destination_s3_uri=CAPTURE_PREFIX_FULL),
+            validate=False,
+            session=session,
+            notification_suffixes=['.gz', '.jsonl.gz'],
+        )
@@ -1,4 +1,5 @@
 # pylint: disable=redefined-outer-name
+import json
 import logging
 import pytest
 import urllib.parse
@@ -163,3 +164,280 @@ def test_delete(caplog, shadowing: TrafficShadowing):
 
         cloudformation_stubber.assert_no_pending_responses()
         s3_stubber.assert_no_pending_responses()
+
+
+def test_warmup_parameters():
+    """Test provisioned concurrency and warm-up schedule stack parameters."""
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    shadowing = TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+        provisioned_concurrency=2,
+        warmup_schedule='rate(5 minutes)',
+    )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert parameters['ProvisionedConcurrency'] == '2'
+    assert parameters['WarmupSchedule'] == 'rate(5 minutes)'
+
+    with pytest.raises(ValueError):
+        TrafficShadowing(
+            HYDROSPHERE_ENDPOINT,
+            TRAIN_PREFIX_FULL,
+            data_capture_config,
+            validate=False,
+            session=session,
+            warmup_schedule='every 5 minutes',
+        )
+
+
+def test_mini_batch_mode_parameter():
+    """Test per-model mini-batch modes."""
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    shadowing = TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+        mini_batch_mode={'*': 'explode', 'wide-model': 'batch'},
+    )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert json.loads(parameters['MiniBatchMode']) == {'*': 'explode', 'wide-model': 'batch'}
+
+    with pytest.raises(ValueError):
+        TrafficShadowing(
+            HYDROSPHERE_ENDPOINT,
+            TRAIN_PREFIX_FULL,
+            data_capture_config,
+            validate=False,
+            session=session,
+            mini_batch_mode='rows',
+        )
+
+
+def test_narrow_dtypes_parameter():
+    """Test the opt-in dtype narrowing parameter."""
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    shadowing = TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+        narrow_dtypes=True,
+    )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert parameters['NarrowDtypes'] == 'true'
+
+
+def test_pack_features_parameter():
+    """Test the opt-in feature packing parameter."""
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    shadowing = TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+        pack_features=True,
+    )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert parameters['PackFeatures'] == 'true'
+
+
+def test_feature_projection_parameter():
+    """Test per-model feature projection parameter."""
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    shadowing = TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+        feature_projection={"model-a": {"include": ["x"]}, "*": {"exclude": ["id"]}},
+    )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert json.loads(parameters['FeatureProjection']) == \
+        {"model-a": {"include": ["x"]}, "*": {"exclude": ["id"]}}
+
+    with pytest.raises(ValueError):
+        TrafficShadowing(
+            HYDROSPHERE_ENDPOINT,
+            TRAIN_PREFIX_FULL,
+            data_capture_config,
+            validate=False,
+            session=session,
+            feature_projection={"*": {"include": ["x"], "exclude": ["y"]}},
+        )
+
+
+def test_shadowing_mode_parameter():
+    """Test per-model shadowing modes."""
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    shadowing = TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+        shadowing_mode={'*': 'rows', 'busy-model': 'summary'},
+    )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert json.loads(parameters['ShadowingMode']) == {'*': 'rows', 'busy-model': 'summary'}
+
+    with pytest.raises(ValueError):
+        TrafficShadowing(
+            HYDROSPHERE_ENDPOINT,
+            TRAIN_PREFIX_FULL,
+            data_capture_config,
+            validate=False,
+            session=session,
+            shadowing_mode='sketch',
+        )
+
+
+def test_export_parameters():
+    """Test the columnar export parameters."""
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    shadowing = TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+        s3_export_uri='s3://analytics/captures/',
+        export_format='arrow',
+    )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert parameters['S3ExportBucketName'] == 'analytics'
+    assert parameters['S3ExportPrefix'] == 'captures'
+    assert parameters['ExportFormat'] == 'arrow'
+
+    with pytest.raises(ValueError):
+        TrafficShadowing(
+            HYDROSPHERE_ENDPOINT,
+            TRAIN_PREFIX_FULL,
+            data_capture_config,
+            validate=False,
+            session=session,
+            export_format='csv',
+        )
+
+
+def test_sink_parameters():
+    """Test the sink parameters."""
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    shadowing = TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+        sink='file',
+        s3_sink_uri='s3://archive/hydrosphere/',
+        sink_compression='zstd',
+    )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert parameters['Sink'] == 'file'
+    assert parameters['SinkUri'] == 's3://archive/hydrosphere/'
+    assert parameters['SinkCompression'] == 'zstd'
+
+    with pytest.raises(ValueError):
+        TrafficShadowing(
+            HYDROSPHERE_ENDPOINT,
+            TRAIN_PREFIX_FULL,
+            data_capture_config,
+            validate=False,
+            session=session,
+            sink='file',
+        )
+
+
+def test_mirror_endpoints():
+    """Test the list of Hydrosphere endpoints."""
+    data_capture_config = DataCaptureConfig(
+        enable_capture=True,
+        destination_s3_uri=CAPTURE_PREFIX_FULL,
+    )
+    shadowing = TrafficShadowing(
+        [HYDROSPHERE_ENDPOINT, 'https://staging.hydrosphere.io'],
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+    )
+    parameters = {
+        item['ParameterKey']: item['ParameterValue']
+        for item in shadowing.get_stack_parameters()
+    }
+    assert parameters['HydrosphereEndpoint'] == \
+        f"{HYDROSPHERE_ENDPOINT},https://staging.hydrosphere.io"
+
+    single = TrafficShadowing(
+        HYDROSPHERE_ENDPOINT,
+        TRAIN_PREFIX_FULL,
+        data_capture_config,
+        validate=False,
+        session=session,
+    )
+    assert single.stack_name != shadowing.stack_name
+
+    with pytest.raises(ValueError):
+        TrafficShadowing(
+            [],
+            TRAIN_PREFIX_FULL,
+            data_capture_config,
+            validate=False,
+            session=session,
+        )